@@ -16,7 +16,13 @@ if sys.platform.startswith("win"):
 load_dotenv()
 bucket = os.getenv("S3_BUCKET_NAME")
 region = os.getenv("AWS_REGION")
-s3 = boto3.client("s3")
+
+
+@st.cache_resource
+def get_s3():
+    # Streamlit re-runs this script on every interaction; build the client once per process
+    return boto3.client("s3")
+
 
 st.set_page_config(page_title="S3 Ingestion UI", layout="centered")
 st.title("📦 S3-Based Ingestion App")
@@ -29,7 +35,7 @@ url_input = st.text_area("Enter one or more URLs (one per line)", height=150)
 urls = [u.strip() for u in url_input.strip().splitlines() if u.strip()]
 
 def get_next_session_prefix():
-    existing = s3.list_objects_v2(Bucket=bucket, Prefix="session_")
+    existing = get_s3().list_objects_v2(Bucket=bucket, Prefix="session_")
     if "Contents" not in existing:
         return "session_1/"
     sessions = [obj["Key"].split("/")[0] for obj in existing["Contents"] if obj["Key"].startswith("session_")]
@@ -42,7 +48,7 @@ if st.button("🚀 Convert to Chunks"):
     with open("session_config.json", "w") as f:
         json.dump({"current_session_dir": session_prefix}, f)
 
-    from ingest_aws_for_app import process_pdf_file
+    from ingest_aws_for_app import process_pdf_file, start_session, close_session
     #
     async def run_pdf_ingestion():
         for file in uploaded_files:
@@ -55,10 +61,13 @@ if st.button("🚀 Convert to Chunks"):
     # Phase 1: Process PDFs/TXT in-memory
     if uploaded_files:
         async def run_ingestion():
-            for file in uploaded_files:
-                file_stream = io.BytesIO(file.read())  # Read in memory
-                await process_pdf_file(file_stream, file.name)
-
+            await start_session(session_prefix)
+            try:
+                for file in uploaded_files:
+                    # UploadedFile is already an in-memory stream; pass it on without another copy
+                    await process_pdf_file(file, file.name)
+            finally:
+                await close_session()  # last shard + session manifest, also after a failed file
 
         try:
             try:
@@ -88,7 +97,7 @@ if st.button("🚀 Convert to Chunks"):
             waited = 0
             while waited < 300:
                 try:
-                    s3.head_object(Bucket=bucket, Key=flag_key)
+                    get_s3().head_object(Bucket=bucket, Key=flag_key)
                     st.success("✅ URL ingestion complete.")
                     break
                 except:
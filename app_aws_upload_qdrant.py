@@ -1,74 +1,169 @@
 import os, json, shutil
+import time
+import random
 import boto3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
 from qdrant_client.models import PointStruct
 
+from s3_session_writer import read_shard, is_manifest_key, S3_SHARD_SUFFIX
+from qdrant_bulk import shadow_of, finish_shadow
+
 load_dotenv()
 bucket = os.getenv("S3_BUCKET_NAME")
 region = os.getenv("AWS_REGION")
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "rice_knowledge")
-
-s3 = boto3.client("s3")
-
-CHUNK_ID_FILE = "last_chunk_id.txt"
-
-def get_next_global_chunk_id():
+S3_FETCH_CONCURRENCY = int(os.getenv("S3_FETCH_CONCURRENCY", "16"))
+S3_UPLOAD_BATCH = int(os.getenv("S3_UPLOAD_BATCH", "128"))  # points per upsert
+S3_UPLOAD_RETRIES = 5
+S3_DELETE_BATCH = 1000
+
+# Clients are created on first use: app.py imports this module from a Streamlit rerun
+_s3 = None
+_qdrant = None
+
+def get_s3():
+    global _s3
+    if _s3 is None:
+        _s3 = boto3.client("s3")
+    return _s3
+
+def get_qdrant():
+    global _qdrant
+    if _qdrant is None:
+        _qdrant = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+    return _qdrant
+
+def list_session_keys(session_prefix) -> list:
+    # Paginated: one list_objects_v2 call only returns up to 1000 keys
+    keys = []
+    for page in get_s3().get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=session_prefix):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    return keys
+
+def fetch_points(key) -> list:
+    # A session holds gzip NDJSON shards (s3_session_writer.py) and/or older one-chunk JSON objects.
+    # Point IDs were leased from last_chunk_id.txt when the chunks were written
+    # (ingest_aws_for_app.claim_point_id), so they are uploaded as-is
+    body = get_s3().get_object(Bucket=bucket, Key=key)["Body"].read()
+    records = read_shard(body) if key.endswith(S3_SHARD_SUFFIX) else [json.loads(body)]
+    return [PointStruct(id=data["id"], vector=data["vector"], payload=data["payload"]) for data in records]
+
+def is_chunk_key(key) -> bool:
+    return key.endswith(S3_SHARD_SUFFIX) or (key.endswith(".json") and not is_manifest_key(key))
+
+def iter_fetched(keys):
+    # -> (key, points or None); up to S3_FETCH_CONCURRENCY GETs in flight, results in key order
+    with ThreadPoolExecutor(S3_FETCH_CONCURRENCY) as pool:
+        window = deque()
+        for key in keys:
+            window.append((key, pool.submit(fetch_points, key)))
+            if len(window) >= S3_FETCH_CONCURRENCY * 2:
+                yield _fetched(*window.popleft())
+        while window:
+            yield _fetched(*window.popleft())
+
+def _fetched(key, future):
     try:
-        obj = s3.get_object(Bucket=bucket, Key=CHUNK_ID_FILE)
-        last = int(obj["Body"].read().decode("utf-8").strip())
-    except:
-        last = 0
-    return last + 1
-
-def save_global_chunk_id(new_id: int):
-    s3.put_object(Bucket=bucket, Key=CHUNK_ID_FILE, Body=str(new_id).encode("utf-8"))
+        return key, future.result()
+    except Exception as e:
+        print(f"❌ Fetch failed, left in S3: {key} | {e}")
+        return key, None
 
-qdrant = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
-
-def upload_session_from_s3(session_prefix):
-    response = s3.list_objects_v2(Bucket=bucket, Prefix=session_prefix)
-    if "Contents" not in response:
+def upsert_batch(points, collection=None) -> bool:
+    for attempt in range(S3_UPLOAD_RETRIES):
+        try:
+            get_qdrant().upsert(collection_name=collection or COLLECTION_NAME, points=points, wait=True)
+            return True
+        except Exception as e:
+            if attempt == S3_UPLOAD_RETRIES - 1:
+                print(f"❌ Upsert of {len(points)} chunks failed, left in S3: {e}")
+                return False
+            time.sleep(min(30, 2 ** attempt) * random.uniform(0.5, 1.0))
+
+def delete_keys(keys):
+    # delete_objects takes at most 1000 keys per call
+    failed = 0
+    for start in range(0, len(keys), S3_DELETE_BATCH):
+        response = get_s3().delete_objects(Bucket=bucket, Delete={
+            "Objects": [{"Key": key} for key in keys[start:start + S3_DELETE_BATCH]], "Quiet": True})
+        for error in response.get("Errors", []):
+            failed += 1
+            print(f"⚠️ Could not delete {error['Key']}: {error.get('Message')}")
+    return len(keys) - failed
+
+def upload_session_from_s3(session_prefix, collection=None, bulk=None):
+    # bulk: {"ids": set, "deferred": list, "failed": list} during a bulk load (run_upload(bulk=True)).
+    # Uploaded IDs and keys that didn't make it are recorded, and the S3 cleanup is deferred
+    # until the shadow collection is live.
+    keys = list_session_keys(session_prefix)
+    chunk_keys = [key for key in keys if is_chunk_key(key)]
+    if not chunk_keys:
         print(f"❌ No files found under {session_prefix}")
         return 0
 
-    json_keys = [obj["Key"] for obj in response["Contents"] if obj["Key"].endswith(".json")]
-    batch = []
-    next_chunk_id = get_next_global_chunk_id()
-
-    for key in tqdm(json_keys, desc=f"Uploading {session_prefix}"):
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        data = json.loads(obj["Body"].read())
-        data["id"] = next_chunk_id
-        batch.append(PointStruct(id=next_chunk_id, vector=data["vector"], payload=data["payload"]))
-        next_chunk_id += 1
-
+    # Points are upserted as they arrive. A key (one chunk or a whole shard) is deleted
+    # only once every point it holds is in a confirmed upsert.
+    remaining, failed_keys, uploaded_keys = {}, set(), []
+    batch, uploaded = [], 0
+
+    def send():
+        nonlocal batch, uploaded
+        ok = upsert_batch([point for _, point in batch], collection)
+        for key, _ in batch:
+            if not ok:
+                failed_keys.add(key)
+            remaining[key] -= 1
+            if remaining[key] == 0 and key not in failed_keys:
+                uploaded_keys.append(key)
+        uploaded += len(batch) if ok else 0
+        if ok and bulk is not None:
+            bulk["ids"].update(point.id for _, point in batch)
+        batch = []
+
+    for key, points in tqdm(iter_fetched(chunk_keys), total=len(chunk_keys), desc=f"Uploading {session_prefix}"):
+        if points is None:
+            failed_keys.add(key)
+            continue
+        remaining[key] = len(points)
+        if not points:
+            uploaded_keys.append(key)
+        for point in points:
+            batch.append((key, point))
+            if len(batch) >= S3_UPLOAD_BATCH:
+                send()
     if batch:
-        qdrant.upload_points(collection_name=COLLECTION_NAME, points=batch)
-        save_global_chunk_id(next_chunk_id - 1)
-
-        print(f"✅ Uploaded {len(batch)} chunks from {session_prefix}")
-
-    # Cleanup
-    for key in json_keys:
-        s3.delete_object(Bucket=bucket, Key=key)
-        # Remove crawl_done.flag if present
-        s3.delete_object(Bucket=bucket, Key=f"{session_prefix}crawl_done.flag")
-
-        # Remove the prefix folder marker if any
-        try:
-            s3.delete_object(Bucket=bucket, Key=session_prefix)
-        except:
-            pass
-
-    print(f"🧹 Deleted session folder from S3: {session_prefix}")
-    return len(batch)
-
-def run_upload():
-    paginator = s3.get_paginator("list_objects_v2")
+        send()
+    print(f"✅ Uploaded {uploaded} chunks from {session_prefix}")
+
+    # Cleanup: the flag, manifests and folder marker go only once the whole session is in Qdrant
+    to_delete = list(uploaded_keys)
+    if not failed_keys:
+        to_delete += [key for key in keys if not is_chunk_key(key)]
+        if session_prefix not in to_delete:
+            to_delete.append(session_prefix)  # folder marker, if the console created one
+    if bulk is not None:
+        bulk["deferred"].extend(to_delete)
+        bulk["failed"].extend(sorted(failed_keys))
+        return uploaded
+    deleted = delete_keys(to_delete)
+    if failed_keys:
+        print(f"⚠️ {len(failed_keys)} objects under {session_prefix} were not fully uploaded "
+              f"and stay in S3 for the next run")
+    else:
+        print(f"🧹 Deleted session folder from S3: {session_prefix} ({deleted} objects)")
+    return uploaded
+
+def run_upload(bulk=False, force=False):
+    # bulk: load into a copy of the live collection with indexing off, then swap the alias
+    # (qdrant_bulk.py); the sessions are removed from S3 only after the swap. A load with
+    # objects that failed to upload is not published unless force is set.
+    paginator = get_s3().get_paginator("list_objects_v2")
     session_folders = set()
     for page in paginator.paginate(Bucket=bucket, Prefix="session_"):
         for obj in page.get("Contents", []):
@@ -76,13 +171,37 @@ def run_upload():
             if folder.startswith("session_"):
                 session_folders.add(folder)
 
+    if bulk and not session_folders:
+        print("⚠️ No sessions to bulk load.")
+        return 0
+    collection, state = None, None
+    if bulk:
+        collection, copied = shadow_of(get_qdrant(), COLLECTION_NAME)
+        state = {"ids": set(copied), "deferred": [], "failed": []}
+
     total_uploaded = 0
     for folder in sorted(session_folders):
-        count = upload_session_from_s3(folder + "/")
+        count = upload_session_from_s3(folder + "/", collection, state)
         total_uploaded += count
 
+    if bulk and state["failed"] and not force:
+        print(f"⚠️ {len(state['failed'])} objects failed to upload; {collection} was not published and "
+              f"the sessions stay in S3. Re-run, or pass --force to publish without them.")
+    elif bulk:
+        finish_shadow(get_qdrant(), COLLECTION_NAME, collection, expected=len(state["ids"]))
+        deleted = delete_keys(state["deferred"])
+        print(f"🧹 Deleted {deleted} uploaded objects from S3")
+
     print(f"\n✅ Total {total_uploaded} chunks uploaded to Qdrant.")
     return total_uploaded
 
 if __name__ == "__main__":
-    run_upload()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Upload S3 session chunks to Qdrant")
+    parser.add_argument("--bulk", action="store_true",
+                        help="load into a shadow copy of the collection and swap the alias when it is ready")
+    parser.add_argument("--force", action="store_true",
+                        help="with --bulk, publish even if some objects failed to upload")
+    args = parser.parse_args()
+    run_upload(bulk=args.bulk, force=args.force)
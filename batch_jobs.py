@@ -0,0 +1,353 @@
+# batch_jobs.py
+# Deferred (OpenAI Batch API) mode for large sitemap backfills.
+#
+#   python ingest_chunks.py --deferred        crawl + chunk, write summary_requests_*.jsonl
+#   python batch_jobs.py submit               upload pending request files as batches
+#   python batch_jobs.py fetch                download ended batches as *_results_*.jsonl (what an
+#                                             expired or cancelled batch did not finish is queued again)
+#   python batch_jobs.py local-run            (testing) fake results from the request files
+#   python batch_jobs.py finish               summary results -> embedding_requests_*.jsonl,
+#                                             embedding results -> chunk JSON files
+#
+# Every step only appends or skips work that is already recorded in the job
+# directory, so any of them can be interrupted and re-run.
+
+import os
+import json
+import glob
+import random
+import asyncio
+import argparse
+from hashlib import md5, sha256
+from urllib.parse import urlparse
+
+import ingest_chunks
+from ingest_chunks import (postprocess_text, chunk_text, crawl_single_page, save_chunk,
+                           get_title_summary, get_embedding, summary_prompt, SUMMARY_SYSTEM_PROMPT,
+                           EMBEDDING_MODEL, dedup)
+from llm_cache import cache
+from doc_manifest import manifest, text_fingerprint
+from html_extract import extract_page
+from lang_detect import DocumentLanguage
+
+JOB_DIR = os.getenv("BATCH_JOB_DIR", "final_data/batch_jobs")
+MAX_REQUESTS_PER_FILE = 50_000  # OpenAI Batch API limit per input file
+ENDPOINTS = {"summary": "/v1/chat/completions", "embedding": "/v1/embeddings"}
+FINAL_BATCH_STATES = {"completed", "expired", "cancelled", "failed"}
+RESUBMIT_STATES = {"expired", "cancelled"}  # requests without a result go into a new request file
+
+
+# ------------------ JOB FILES ------------------
+
+def _path(job_dir, name):
+    return os.path.join(job_dir, name)
+
+
+def _read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _append_jsonl(path, rows):
+    with open(path, "a", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def _request_files(job_dir, kind):
+    return sorted(glob.glob(_path(job_dir, f"{kind}_requests_*.jsonl")))
+
+
+def _requested_ids(job_dir, kind) -> set:
+    return {r["custom_id"] for path in _request_files(job_dir, kind) for r in _read_jsonl(path)}
+
+
+def _sealed(job_dir, path):
+    # A request file that was submitted or already has results must not grow any more
+    return os.path.exists(path.replace("_requests_", "_results_")) or \
+        os.path.basename(path) in _batches_state(job_dir)
+
+
+def _append_requests(job_dir, kind, requests):
+    # Fill the newest open part file, rolling over at the Batch API's per-file request limit
+    files = _request_files(job_dir, kind)
+    part = len(files) - 1 if files else 0
+    count = len(_read_jsonl(files[-1])) if files else 0
+    if files and _sealed(job_dir, files[-1]):
+        part, count = part + 1, 0
+    for request in requests:
+        if count >= MAX_REQUESTS_PER_FILE:
+            part, count = part + 1, 0
+        _append_jsonl(_path(job_dir, f"{kind}_requests_{part:03d}.jsonl"), [request])
+        count += 1
+
+
+def _load_results(job_dir, kind):
+    # custom_id -> response body, or None when the request failed inside the batch
+    results = {}
+    for path in sorted(glob.glob(_path(job_dir, f"{kind}_results_*.jsonl"))):
+        for row in _read_jsonl(path):
+            response = row.get("response") or {}
+            ok = response.get("status_code") == 200 and not row.get("error")
+            results[row["custom_id"]] = response.get("body") if ok else None
+    return results
+
+
+def _summary_request(custom_id, chunk, url):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": ENDPOINTS["summary"],
+        "body": {
+            "model": os.getenv("LLM_MODEL", "gpt-4o-mini"),
+            "messages": [
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": summary_prompt(chunk, url)}
+            ],
+            "response_format": {"type": "json_object"}
+        }
+    }
+
+
+def _embedding_request(custom_id, text):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": ENDPOINTS["embedding"],
+        "body": {"model": EMBEDDING_MODEL, "input": text}
+    }
+
+
+# ------------------ PREPARE ------------------
+
+async def prepare_jobs(urls: list, job_dir: str = JOB_DIR):
+    os.makedirs(job_dir, exist_ok=True)
+    done = {doc["url"] for doc in _read_jsonl(_path(job_dir, "documents.jsonl"))}
+    pending = [u for u in urls if u not in done]
+    print(f"🗂️ {len(done)} URLs already prepared, {len(pending)} to crawl")
+    # A run interrupted between the chunk rows and the documents.jsonl row leaves chunks and
+    # requests behind; the Batch API rejects a file with a repeated custom_id, so skip them
+    queued = {row["custom_id"] for row in _read_jsonl(_path(job_dir, "chunks.jsonl"))}
+    requested = _requested_ids(job_dir, "summary")
+
+    async def collect(url, html):
+        clean = postprocess_text(extract_page(html)[0])
+        fingerprint = text_fingerprint(clean)
+        if await asyncio.to_thread(manifest.is_unchanged, url, fingerprint):
+            print(f"⏭ Unchanged, skipping: {url}")
+            return
+        chunks = chunk_text(clean)
+        doc_id = md5(url.encode()).hexdigest()[:12]
+        orphaned = await asyncio.to_thread(dedup.begin_document, url)
+        await asyncio.to_thread(manifest.forget, orphaned)
+        admitted = await asyncio.to_thread(lambda: [dedup.admit(url, i, chunk) for i, chunk in enumerate(chunks)])
+        # The chunk's hash is part of the ID: a page that changed between runs gets new IDs
+        rows = [{"custom_id": f"{doc_id}_{i}_{md5(chunk.encode()).hexdigest()[:8]}", "url": url,
+                 "chunk_number": i, "chunk": chunk}
+                for i, chunk in enumerate(chunks) if admitted[i]]
+        _append_jsonl(_path(job_dir, "chunks.jsonl"), [r for r in rows if r["custom_id"] not in queued])
+        _append_requests(job_dir, "summary", [_summary_request(r["custom_id"], r["chunk"], url)
+                                              for r in rows if r["custom_id"] not in requested])
+        queued.update(r["custom_id"] for r in rows)
+        requested.update(r["custom_id"] for r in rows)
+        # Written last: a URL listed here has all of its chunks and requests on disk
+        _append_jsonl(_path(job_dir, "documents.jsonl"),
+                      [{"url": url, "fingerprint": fingerprint, "chunk_ids": [r["custom_id"] for r in rows]}])
+        print(f"📝 Queued {len(rows)} chunks: {url}")
+
+    if pending:
+        await crawl_single_page(pending, handle=collect)
+
+
+# ------------------ SUBMIT / FETCH ------------------
+
+def _batches_state(job_dir):
+    path = _path(job_dir, "batches.json")
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def _save_batches_state(job_dir, state):
+    with open(_path(job_dir, "batches.json"), "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+
+
+def submit(job_dir: str = JOB_DIR):
+    from openai import OpenAI
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    state = _batches_state(job_dir)
+    for kind in ENDPOINTS:
+        for path in _request_files(job_dir, kind):
+            name = os.path.basename(path)
+            if name in state:
+                continue
+            with open(path, "rb") as f:
+                uploaded = client.files.create(file=f, purpose="batch")
+            batch = client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINTS[kind],
+                                          completion_window="24h")
+            state[name] = {"batch_id": batch.id, "downloaded": False}
+            _save_batches_state(job_dir, state)
+            print(f"📤 Submitted {name} as batch {batch.id}")
+
+
+def fetch(job_dir: str = JOB_DIR):
+    from openai import OpenAI
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    state = _batches_state(job_dir)
+    for name, entry in state.items():
+        if entry["downloaded"]:
+            continue
+        batch = client.batches.retrieve(entry["batch_id"])
+        if batch.status not in FINAL_BATCH_STATES:
+            print(f"⏳ {name}: {batch.status}")
+            continue
+        # Expired and cancelled batches still have the output of the requests they finished
+        rows = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                rows += [json.loads(line) for line in client.files.content(file_id).text.splitlines() if line.strip()]
+        answered = {row["custom_id"] for row in rows}
+        missing = [r for r in _read_jsonl(_path(job_dir, name)) if r["custom_id"] not in answered]
+        if missing and batch.status not in RESUBMIT_STATES:
+            # A failed batch would fail again as is: its requests go to the live API in `finish`
+            errors = getattr(batch, "errors", None)
+            print(f"❌ {name}: batch {batch.status}, {len(missing)} requests without a result | {errors}")
+            rows += [{"custom_id": r["custom_id"], "response": None, "error": {"message": f"batch {batch.status}"}}
+                     for r in missing]
+        results_path = _path(job_dir, name.replace("_requests_", "_results_"))
+        with open(results_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+        print(f"📥 Downloaded {len(answered)} results for {name} ({batch.status})")
+        if missing and batch.status in RESUBMIT_STATES:
+            # The results file seals this request file, so they land in a new one for `submit`
+            kind = name.split("_requests_")[0]
+            elsewhere = {r["custom_id"] for path in _request_files(job_dir, kind) if os.path.basename(path) != name
+                         for r in _read_jsonl(path)}
+            _append_requests(job_dir, kind, [r for r in missing if r["custom_id"] not in elsewhere])
+            print(f"🔁 {len(missing)} requests from {name} queued again; run `submit`")
+        entry["downloaded"], entry["status"] = True, batch.status
+        _save_batches_state(job_dir, state)
+
+
+def local_run(job_dir: str = JOB_DIR):
+    # Offline stand-in for the Batch API: deterministic fake results for every request file
+    dimension = ingest_chunks.embedding_provider.dimension
+    for kind in ENDPOINTS:
+        for path in _request_files(job_dir, kind):
+            out_path = path.replace("_requests_", "_results_")
+            if os.path.exists(out_path):
+                continue
+            rows = []
+            for request in _read_jsonl(path):
+                body = request["body"]
+                if kind == "summary":
+                    text = body["messages"][-1]["content"].split("Content:\n", 1)[-1]
+                    content = json.dumps({"title": " ".join(text.split()[:8]), "summary": text[:200]},
+                                         ensure_ascii=False)
+                    response = {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+                else:
+                    rng = random.Random(sha256(body["input"].encode("utf-8")).hexdigest())
+                    response = {"data": [{"index": 0, "embedding": [rng.uniform(-1, 1) for _ in range(dimension)]}]}
+                rows.append({"id": f"batch_req_{request['custom_id']}", "custom_id": request["custom_id"],
+                             "response": {"status_code": 200, "body": response}, "error": None})
+            _append_jsonl(out_path, rows)
+            print(f"🧪 Wrote {len(rows)} local results: {out_path}")
+
+
+# ------------------ FINISH ------------------
+
+def _meta_from(body):
+    return json.loads(body["choices"][0]["message"]["content"])
+
+
+async def finish(job_dir: str = JOB_DIR):
+    chunks = {row["custom_id"]: row for row in _read_jsonl(_path(job_dir, "chunks.jsonl"))}
+    summaries = _load_results(job_dir, "summary")
+    waiting_summaries = sum(1 for cid in chunks if cid not in summaries)
+    if waiting_summaries:
+        print(f"⏳ {waiting_summaries} of {len(chunks)} summary results missing. Run `fetch` (or `local-run`).")
+
+    # Failed batch lines fall back to the live API (which has its own fallback)
+    metas = {}
+    for cid, row in chunks.items():
+        if cid not in summaries:
+            continue
+        if summaries[cid] is not None:
+            metas[cid] = _meta_from(summaries[cid])
+            await cache.aput_json(os.getenv("LLM_MODEL", "gpt-4o-mini"),
+                                  SUMMARY_SYSTEM_PROMPT + "\n" + summary_prompt(row["chunk"], row["url"]), metas[cid])
+        else:
+            metas[cid] = await get_title_summary(row["chunk"], row["url"])
+
+    # A local embedding provider is free, so only OpenAI embeddings go through the Batch API
+    local_embeddings = ingest_chunks.embedding_provider.name != "openai"
+    requested = _requested_ids(job_dir, "embedding")
+    new_requests = [_embedding_request(cid, metas[cid]["summary"] + " " + chunks[cid]["chunk"])
+                    for cid in metas if cid not in requested]
+    if new_requests and not local_embeddings:
+        _append_requests(job_dir, "embedding", new_requests)
+        print(f"🗂️ Wrote {len(new_requests)} embedding requests. Submit them, then run `finish` again.")
+
+    vectors = _load_results(job_dir, "embedding")
+    finished_path = _path(job_dir, "finished_urls.txt")
+    finished = set()
+    if os.path.exists(finished_path):
+        with open(finished_path, encoding="utf-8") as f:
+            finished = {line.strip() for line in f if line.strip()}
+
+    waiting = 0
+    for doc in _read_jsonl(_path(job_dir, "documents.jsonl")):
+        url = doc["url"]
+        if url in finished:
+            continue
+        if any(cid not in metas or (cid not in vectors and not local_embeddings) for cid in doc["chunk_ids"]):
+            waiting += 1
+            continue
+
+        parsed = urlparse(url)
+        slug = parsed.netloc.replace(".", "_")
+        path_hash = md5(parsed.path.encode()).hexdigest()[:6]
+        saved, doc_lang = [], DocumentLanguage()
+        for cid in doc["chunk_ids"]:
+            row, meta = chunks[cid], metas[cid]
+            text = meta["summary"] + " " + row["chunk"]
+            if vectors.get(cid) is not None:
+                vector = vectors[cid]["data"][0]["embedding"]
+                await cache.aput_vector(EMBEDDING_MODEL, text, vector)
+            else:
+                vector = await get_embedding(text)
+            saved.append(await save_chunk(row["chunk"], meta, url, row["chunk_number"], "web_crawl",
+                                          slug, path_hash, vector=vector, lang=doc_lang.detect(row["chunk"])))
+            await asyncio.to_thread(dedup.stored, url, row["chunk_number"], row["chunk"])
+        await asyncio.to_thread(manifest.replace, url, doc["fingerprint"], [pid for pid, _ in saved],
+                                [path for _, path in saved])
+        with open(finished_path, "a", encoding="utf-8") as f:
+            f.write(url + "\n")
+        finished.add(url)
+
+    if waiting:
+        print(f"⏳ {waiting} documents still waiting for batch results.")
+    else:
+        print(f"✅ {len(finished)} batch-job documents written to {ingest_chunks.CHUNK_DIR}")
+
+
+# ------------------ MAIN ------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deferred OpenAI batch mode for sitemap backfills")
+    parser.add_argument("command", choices=["submit", "fetch", "local-run", "finish"])
+    parser.add_argument("--job-dir", default=JOB_DIR)
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        submit(args.job_dir)
+    elif args.command == "fetch":
+        fetch(args.job_dir)
+    elif args.command == "local-run":
+        local_run(args.job_dir)
+    else:
+        asyncio.run(finish(args.job_dir))
@@ -0,0 +1,89 @@
+# bench_normalize.py
+# Micro-benchmark: the old five-pass postprocess_text against the precompiled one in
+# text_normalize.py. Checks the outputs are identical (on the demo chunks and on
+# large synthetic inputs built from them), then times both.
+#
+#   python bench_normalize.py [size_mb] > bench_output.txt
+
+import re
+import sys
+import glob
+import json
+import random
+import timeit
+
+from text_normalize import postprocess_text
+
+DEMO_DIR = "qdrant_chunks_output demo"
+
+
+def postprocess_text_old(text: str) -> str:
+    text = re.sub(r'\\[nrt]', ' ', text)
+    text = re.sub(r'\\+', '', text)
+    text = text.replace('\n', ' ')
+    text = re.sub(r'https?://\S+', '', text)
+    text = re.sub(r'\s{2,}', ' ', text)
+    return text.strip()
+
+
+def load_demo_texts() -> list:
+    texts = []
+    for path in sorted(glob.glob(f"{DEMO_DIR}/*.json")):
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)["payload"]
+        texts.append(payload["content"])
+        texts.append(payload.get("summary", ""))
+    return texts
+
+
+def pdf_like(words: list, rng) -> str:
+    # Hard-wrapped lines, blank lines between paragraphs, stray double spaces
+    out = []
+    for i, word in enumerate(words):
+        out.append(word)
+        r = rng.random()
+        out.append("\n" if r < 0.08 else "\n\n" if r < 0.1 else "  " if r < 0.13 else " ")
+    return "".join(out)
+
+
+def web_like(words: list, rng) -> str:
+    # Scraped text: escaped newlines/tabs, stray backslashes and links mixed in
+    extras = ["\\n", "\\t", "\\\\", "https://example.org/path?q=1", "http://vi.wikipedia.org/wiki/L%C3%BAa",
+              "\n", "\t", " \\ "]
+    out = []
+    for word in words:
+        out.append(word)
+        out.append(rng.choice(extras) if rng.random() < 0.05 else " ")
+    return "".join(out)
+
+
+def build_inputs(texts: list, size_mb: float) -> dict:
+    rng = random.Random(0)
+    words = " ".join(texts).split()
+    target = int(size_mb * 1024 * 1024)
+    corpus = []
+    while sum(len(w) + 1 for w in corpus) < target:
+        corpus.extend(words)
+    return {
+        "demo (joined)": "\n".join(texts) * max(1, target // max(1, len("\n".join(texts)))),
+        "pdf-like": pdf_like(corpus, rng),
+        "web-like": web_like(corpus, rng),
+    }
+
+
+def bench(fn, text: str, repeat: int = 5) -> float:
+    return min(timeit.repeat(lambda: fn(text), number=1, repeat=repeat))
+
+
+if __name__ == "__main__":
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    texts = load_demo_texts()
+
+    mismatches = sum(postprocess_text_old(t) != postprocess_text(t) for t in texts)
+    print(f"demo chunks: {len(texts)} texts, {mismatches} mismatches")
+
+    for name, text in build_inputs(texts, size_mb).items():
+        same = postprocess_text_old(text) == postprocess_text(text)
+        old, new = bench(postprocess_text_old, text), bench(postprocess_text, text)
+        print(f"{name:14s} {len(text) / 1e6:7.1f} MB  old {old * 1000:8.1f} ms  new {new * 1000:8.1f} ms  "
+              f"x{old / new:4.2f}  identical={same}")
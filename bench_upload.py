@@ -0,0 +1,99 @@
+# bench_upload.py
+# Benchmark: the old upload loop (read 25 JSON files, blocking upsert, repeat) against
+# the pipelined uploader in upload_to_qdrant.py, on synthetic chunks shaped like the
+# demo ones. Runs against an in-memory Qdrant unless --url points at a real server
+# (e.g. docker run -p 6333:6333 qdrant/qdrant), which is where overlap pays off.
+# The in-memory client is not thread-safe, so there one upsert runs at a time and
+# only reading/decoding overlaps with it.
+#
+#   python bench_upload.py [--points 2000] [--url http://localhost:6333] > bench_upload.txt
+
+import os
+import glob
+import json
+import time
+import random
+import argparse
+import tempfile
+
+os.environ.setdefault("QDRANT_COLLECTION_NAME", "bench_upload")
+
+import upload_to_qdrant
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct, VectorParams, Distance
+from chunk_shards import convert_json_dir, list_shards
+
+DEMO_DIR = "qdrant_chunks_output demo"
+DIM = 1536
+
+
+def write_chunk_files(directory: str, count: int):
+    # Demo payloads with random unit vectors, written the way save_chunk used to (indent=2)
+    payloads = []
+    for path in sorted(glob.glob(f"{DEMO_DIR}/*.json")):
+        with open(path, encoding="utf-8") as f:
+            payloads.append(json.load(f)["payload"])
+    rng = random.Random(0)
+    for i in range(count):
+        vector = [rng.gauss(0, 1) for _ in range(DIM)]
+        with open(os.path.join(directory, f"chunk{i}.json"), "w", encoding="utf-8") as f:
+            json.dump({"id": i + 1, "vector": vector, "payload": payloads[i % len(payloads)]}, f,
+                      ensure_ascii=False, indent=2)
+
+
+def old_upload(client, files, batch_size=25):
+    # upload_in_batches as it was: sequential read, then a blocking upsert
+    for i in range(0, len(files), batch_size):
+        points = []
+        for path in files[i:i + batch_size]:
+            with open(path, encoding="utf-8") as f:
+                obj = json.load(f)
+            points.append(PointStruct(id=obj["id"], vector=obj["vector"], payload=obj["payload"]))
+        client.upsert(collection_name=upload_to_qdrant.COLLECTION_NAME, points=points)
+
+
+def fresh_collection(client):
+    name = upload_to_qdrant.COLLECTION_NAME
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(name, vectors_config=VectorParams(size=DIM, distance=Distance.COSINE))
+
+
+def timed(label, client, fn, expected):
+    fresh_collection(client)
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    count = client.count(upload_to_qdrant.COLLECTION_NAME, exact=True).count
+    print(f"{label:32s} {elapsed:7.2f} s  {expected / elapsed:8.0f} points/s  count={count}/{expected}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=2000)
+    parser.add_argument("--url", help="Qdrant server (default: in-memory)")
+    args = parser.parse_args()
+
+    client = QdrantClient(url=args.url) if args.url else QdrantClient(":memory:")
+    in_flight = upload_to_qdrant.UPLOAD_IN_FLIGHT if args.url else 1
+    upload_to_qdrant._client = client
+    upload_to_qdrant.print = lambda *a, **k: None  # keep per-batch logging out of the timings
+
+    with tempfile.TemporaryDirectory() as json_dir, tempfile.TemporaryDirectory() as shard_dir:
+        write_chunk_files(json_dir, args.points)
+        files = sorted(glob.glob(os.path.join(json_dir, "*.json")))
+        convert_json_dir(json_dir, shard_dir)
+        shards = list_shards(shard_dir)
+        print(f"{args.points} points, {'server ' + args.url if args.url else 'in-memory Qdrant'}")
+
+        timed("old: 25 files, blocking upsert", client, lambda: old_upload(client, files), args.points)
+        timed("new: JSON files", client,
+              lambda: upload_to_qdrant.upload_points(upload_to_qdrant.iter_points(files, set()), in_flight),
+              args.points)
+        timed("new: shards", client,
+              lambda: upload_to_qdrant.upload_points(upload_to_qdrant.iter_points(shards, set()), in_flight),
+              args.points)
+        if args.url:
+            timed("new: shards, wait=False", client,
+                  lambda: upload_to_qdrant.upload_points(upload_to_qdrant.iter_points(shards, set()), wait=False),
+                  args.points)
@@ -0,0 +1,258 @@
+# chunk_dedup.py
+# Drops repeated chunks (sidebars, disclaimers, syndicated articles) before they are
+# summarized and embedded.
+#
+# Exact duplicates are found by a hash of the normalized text (case, punctuation and
+# whitespace ignored). Near-duplicates are found by MinHash over word shingles with
+# LSH banding: a chunk is only compared with chunks sharing at least one band bucket,
+# and counts as a duplicate when the estimated Jaccard similarity reaches
+# DEDUP_THRESHOLD. Each pipeline has its own SQLite index under DEDUP_DIR
+# (dedup_index), since each stores and replaces its chunks in its own place; the
+# index persists across runs.
+#
+# A chunk becomes the canonical copy only once it is saved (stored()), so a run that
+# dies between admit() and the save never makes other documents drop that content.
+# Until then the process keeps it in memory as in flight, and admit() matches against
+# those too: copies within one pipeline window or in documents processed at the same
+# time are caught before either is saved.
+#
+# DEDUP_MODE=alias (default) skips duplicates and records them as aliases of the
+# canonical chunk (doc_key + chunk number); skip only drops them; off disables dedup.
+
+import os
+import re
+import time
+import random
+import sqlite3
+import threading
+from array import array
+from hashlib import sha256, blake2b
+
+DEDUP_DIR = os.getenv("DEDUP_DIR", "final_data")
+DEDUP_MODE = os.getenv("DEDUP_MODE", "alias")
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+DEDUP_MIN_TOKENS = 20  # shorter chunks are only matched exactly
+SHINGLE_SIZE = 5
+NUM_BANDS, BAND_ROWS = 16, 4  # 64 permutations; pairs at ~0.5 Jaccard and above become candidates
+
+_PRIME = 4294967291  # largest prime below 2**32, so a * h + b fits in 64 bits
+_rng = random.Random(1)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_BANDS * BAND_ROWS)]
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_tokens(text: str) -> list:
+    return _NON_WORD.sub(" ", text.lower()).split()
+
+
+def _shingle_hash(shingle: str) -> int:
+    return int.from_bytes(blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little") % _PRIME
+
+
+def minhash(tokens: list) -> array:
+    shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))}
+    hashes = [_shingle_hash(s) for s in shingles]
+    return array("I", [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS])
+
+
+def band_keys(signature: array) -> list:
+    # One 63-bit key per band; equal keys mean the band's rows all agree
+    keys = []
+    for band in range(NUM_BANDS):
+        rows = signature[band * BAND_ROWS:(band + 1) * BAND_ROWS].tobytes()
+        digest = blake2b(bytes([band]) + rows, digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "little") >> 1)
+    return keys
+
+
+def similarity(a: array, b: array) -> float:
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class ChunkDedupIndex:
+    def __init__(self, db_path: str, mode: str = DEDUP_MODE, threshold: float = DEDUP_THRESHOLD):
+        if mode not in ("alias", "skip", "off"):
+            raise ValueError(f"Unknown DEDUP_MODE: {mode} (expected 'alias', 'skip' or 'off')")
+        self.db_path = db_path
+        self.mode = mode
+        self.threshold = threshold
+        self.duplicates = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = {}  # doc_key -> {chunk_number: fingerprint}, admitted but not stored yet
+        self._pending_hashes = {}  # text_hash -> (doc_key, chunk_number) of those
+        self._pending_bands = {}  # band key -> {text_hash} of those
+
+    def _connect(self):
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS chunks (
+                text_hash TEXT PRIMARY KEY, doc_key TEXT, chunk_number INTEGER, signature BLOB)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc ON chunks (doc_key)")
+            conn.execute("CREATE TABLE IF NOT EXISTS bands (band_key INTEGER, text_hash TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS bands_key ON bands (band_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS bands_hash ON bands (text_hash)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS aliases (
+                doc_key TEXT, chunk_number INTEGER, canonical_hash TEXT, similarity REAL, created REAL,
+                PRIMARY KEY (doc_key, chunk_number))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS aliases_canonical ON aliases (canonical_hash)")
+            conn.commit()
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def begin_document(self, doc_key: str, keep_shared: bool = False) -> list:
+        # Forget what an earlier version of this document contributed, so a re-ingest is
+        # not deduplicated against itself.
+        # keep_shared=False (the pipeline deletes a document's old points when it is
+        # replaced): returns the other documents that had chunks aliased to it. Their
+        # content goes with the old points, so callers must let them be re-ingested
+        # (manifest.forget).
+        # keep_shared=True (old points are never deleted): chunks other documents alias
+        # stay canonical, since their points stay stored; nothing is orphaned.
+        if self.mode == "off":
+            return []
+        with self._lock:
+            for chunk_number in list(self._pending.get(doc_key, ())):
+                self._drop_pending(doc_key, chunk_number)
+            conn = self._connect()
+            hashes = "SELECT text_hash FROM chunks WHERE doc_key = ?"
+            shared = "SELECT canonical_hash FROM aliases WHERE doc_key != ?"
+            if keep_shared:
+                orphaned = []
+                dropped = f"{hashes} AND text_hash NOT IN ({shared})"
+                conn.execute("DELETE FROM aliases WHERE doc_key = ?", (doc_key,))
+                conn.execute(f"DELETE FROM bands WHERE text_hash IN ({dropped})", (doc_key, doc_key))
+                conn.execute(f"DELETE FROM chunks WHERE text_hash IN ({dropped})", (doc_key, doc_key))
+            else:
+                orphaned = [doc for (doc,) in conn.execute(
+                    f"SELECT DISTINCT doc_key FROM aliases WHERE canonical_hash IN ({hashes}) AND doc_key != ?",
+                    (doc_key, doc_key))]
+                conn.execute(f"DELETE FROM aliases WHERE canonical_hash IN ({hashes}) OR doc_key = ?",
+                             (doc_key, doc_key))
+                conn.execute(f"DELETE FROM bands WHERE text_hash IN ({hashes})", (doc_key,))
+                conn.execute("DELETE FROM chunks WHERE doc_key = ?", (doc_key,))
+            conn.commit()
+        return orphaned
+
+    def _find(self, conn, text_hash: str, signature, keys: list):
+        row = conn.execute("SELECT doc_key, chunk_number FROM chunks WHERE text_hash = ?", (text_hash,)).fetchone()
+        if row is not None:
+            return text_hash, 1.0, row
+        if signature is None:
+            return None
+        marks = ",".join("?" * len(keys))
+        best = None
+        for other_hash, doc_key, chunk_number, blob in conn.execute(
+                f"""SELECT DISTINCT c.text_hash, c.doc_key, c.chunk_number, c.signature FROM bands b
+                    JOIN chunks c ON c.text_hash = b.text_hash WHERE b.band_key IN ({marks})""", keys):
+            if blob is None:
+                continue
+            score = similarity(signature, array("I", blob))
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = other_hash, score, (doc_key, chunk_number)
+        return best
+
+    def _find_pending(self, text_hash: str, signature, keys: list):
+        # _find over the chunks in flight
+        if text_hash in self._pending_hashes:
+            return text_hash, 1.0, self._pending_hashes[text_hash]
+        if signature is None:
+            return None
+        best = None
+        for other_hash in set().union(*(self._pending_bands.get(key, ()) for key in keys)):
+            doc_key, chunk_number = self._pending_hashes[other_hash]
+            score = similarity(signature, self._pending[doc_key][chunk_number][1])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = other_hash, score, (doc_key, chunk_number)
+        return best
+
+    def _add_pending(self, doc_key: str, chunk_number: int, fingerprint: tuple):
+        self._drop_pending(doc_key, chunk_number)
+        text_hash, _, keys = fingerprint
+        self._pending.setdefault(doc_key, {})[chunk_number] = fingerprint
+        self._pending_hashes[text_hash] = (doc_key, chunk_number)
+        for key in keys:
+            self._pending_bands.setdefault(key, set()).add(text_hash)
+
+    def _drop_pending(self, doc_key: str, chunk_number: int):
+        # -> the fingerprint if the chunk was in flight
+        chunks = self._pending.get(doc_key, {})
+        fingerprint = chunks.pop(chunk_number, None)
+        if not chunks:
+            self._pending.pop(doc_key, None)
+        if fingerprint is None:
+            return None
+        text_hash, _, keys = fingerprint
+        if self._pending_hashes.get(text_hash) == (doc_key, chunk_number):
+            del self._pending_hashes[text_hash]
+        for key in keys:
+            hashes = self._pending_bands.get(key)
+            if hashes is not None:
+                hashes.discard(text_hash)
+                if not hashes:
+                    del self._pending_bands[key]
+        return fingerprint
+
+    @staticmethod
+    def _fingerprint(chunk: str) -> tuple:
+        # -> (text_hash, signature or None, band keys)
+        tokens = normalize_tokens(chunk)
+        text_hash = sha256(" ".join(tokens).encode("utf-8")).hexdigest()
+        signature = minhash(tokens) if len(tokens) >= DEDUP_MIN_TOKENS else None
+        return text_hash, signature, band_keys(signature) if signature is not None else []
+
+    def admit(self, doc_key: str, chunk_number: int, chunk: str) -> bool:
+        # True: no stored or in-flight chunk matches, go on and summarize it (then call stored()).
+        # False: a duplicate of one (alias recorded).
+        if self.mode == "off":
+            return True
+        text_hash, signature, keys = fingerprint = self._fingerprint(chunk)
+
+        with self._lock:
+            conn = self._connect()
+            match = self._find(conn, text_hash, signature, keys) or self._find_pending(text_hash, signature, keys)
+            if match is None:
+                self._add_pending(doc_key, chunk_number, fingerprint)
+                return True
+            canonical_hash, score, (canonical_doc, canonical_number) = match
+            if self.mode == "alias":
+                conn.execute("INSERT OR REPLACE INTO aliases VALUES (?, ?, ?, ?, ?)",
+                             (doc_key, chunk_number, canonical_hash, score, time.time()))
+                conn.commit()
+            self.duplicates += 1
+        print(f"⏭ Duplicate chunk ({score:.2f}) {doc_key} #{chunk_number} of {canonical_doc} #{canonical_number}")
+        return False
+
+    def stored(self, doc_key: str, chunk_number: int, chunk: str):
+        # The chunk is saved: from now on it is the canonical copy duplicates are matched against
+        if self.mode == "off":
+            return
+        with self._lock:
+            fingerprint = self._pending.get(doc_key, {}).get(chunk_number)
+        text_hash, signature, keys = fingerprint or self._fingerprint(chunk)
+        blob = signature.tobytes() if signature is not None else None
+        with self._lock:
+            conn = self._connect()
+            # Two processes admitted the same text at once: the first one stored stays canonical
+            added = conn.execute("INSERT OR IGNORE INTO chunks VALUES (?, ?, ?, ?)",
+                                 (text_hash, doc_key, chunk_number, blob)).rowcount
+            if added:
+                conn.executemany("INSERT INTO bands VALUES (?, ?)", [(key, text_hash) for key in keys])
+            conn.commit()
+            self._drop_pending(doc_key, chunk_number)  # only now that _find sees it
+
+    def aliases(self, doc_key: str) -> list:
+        # -> [(chunk_number, canonical_doc_key, canonical_chunk_number, similarity)]
+        with self._lock:
+            return self._connect().execute(
+                """SELECT a.chunk_number, c.doc_key, c.chunk_number, a.similarity FROM aliases a
+                   JOIN chunks c ON c.text_hash = a.canonical_hash WHERE a.doc_key = ?
+                   ORDER BY a.chunk_number""", (doc_key,)).fetchall()
+
+
+def dedup_index(pipeline: str) -> ChunkDedupIndex:
+    return ChunkDedupIndex(os.path.join(DEDUP_DIR, f"chunk_dedup_{pipeline}.sqlite"))
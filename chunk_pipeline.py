@@ -0,0 +1,63 @@
+# chunk_pipeline.py
+# Shared summarize -> save fan-out behind save_chunks() / save_chunks_to_s3().
+
+import os
+import asyncio
+
+CHUNK_WINDOW = int(os.getenv("CHUNK_WINDOW", "64"))
+
+
+async def _aiter(items):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def run_chunk_pipeline(chunk_iter, summarize, save, concurrency: int, window: int = CHUNK_WINDOW,
+                             admit=None, stored=None):
+    # chunk_iter yields chunk strings or (chunk, extra_payload) pairs and may be lazy
+    # (a generator, or an async generator such as pdf_extract.iter_pdf_chunks_parallel).
+    # Summaries start as chunks arrive; every `window` chunks they are awaited and the
+    # chunks saved together (so their embeddings share batches). Memory is bounded by
+    # the window, not by the document.
+    #   summarize(chunk) -> meta      save(chunk_number, chunk, meta, extra) -> result
+    #   admit(chunk_number, chunk) -> bool, optional: False drops the chunk before it is
+    #   summarized (chunk_dedup); chunk numbers still count it, results do not
+    #   stored(chunk_number, chunk), optional: called once a chunk's save has returned
+    limit = asyncio.Semaphore(concurrency)
+    results, pending = [], []
+
+    async def summarize_limited(chunk):
+        async with limit:
+            return await summarize(chunk)
+
+    async def save_one(i, chunk, meta, extra):
+        result = await save(i, chunk, meta, extra)
+        if stored is not None:
+            await asyncio.to_thread(stored, i, chunk)
+        return result
+
+    async def drain():
+        metas = await asyncio.gather(*(task for *_, task in pending))
+        results.extend(await asyncio.gather(*(save_one(i, chunk, meta, extra)
+                                              for (i, chunk, extra, _), meta in zip(pending, metas))))
+        pending.clear()
+
+    i = 0
+    async for item in _aiter(chunk_iter):
+        chunk, extra = item if isinstance(item, tuple) else (item, None)
+        # admit/stored hash and query SQLite: worker threads, not the event loop
+        if admit is not None and not await asyncio.to_thread(admit, i, chunk):
+            i += 1
+            continue
+        pending.append((i, chunk, extra, asyncio.create_task(summarize_limited(chunk))))
+        i += 1
+        await asyncio.sleep(0)
+        if len(pending) >= window:
+            await drain()
+    if pending:
+        await drain()
+    return results
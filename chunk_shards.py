@@ -0,0 +1,235 @@
+# chunk_shards.py
+# Compact on-disk format for embedded chunks, replacing one pretty-printed JSON
+# file per chunk. A shard is three files:
+#
+#   shard-<...>.f32             float32 vectors, row-major, no header (np.memmap)
+#   shard-<...>.jsonl           one {"id", "payload"} line per row, same order
+#   shard-<...>.manifest.json   {"format", "dim", "dtype", "rows", "vectors", "payloads"}
+#
+# The writer appends both data files row by row, so an interrupted run loses at
+# most the row being written; "rows" is filled in when the shard is sealed (full
+# or at exit) and readers of an unsealed shard take the rows present in both files.
+# A shard left unsealed by a writer that crashed is sealed after the fact with `seal`.
+#
+#   python chunk_shards.py convert final_data/qdrant_chunks [--out DIR] [--delete]
+#   python chunk_shards.py seal final_data/qdrant_chunks
+
+import os
+import re
+import sys
+import json
+import glob
+import time
+import argparse
+from array import array
+
+SHARD_MAX_ROWS = int(os.getenv("SHARD_MAX_ROWS", "4096"))
+SHARD_FORMAT = 1
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def _write_json(path: str, obj: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+
+
+class ShardWriter:
+    def __init__(self, directory: str, max_rows: int = SHARD_MAX_ROWS):
+        self.directory = directory
+        self.max_rows = max_rows
+        self._seq = 0
+        self._rows = 0
+        self._manifest = None
+        self._manifest_path = None
+        self._vectors = None
+        self._payloads = None
+
+    def _open(self, dim: int):
+        os.makedirs(self.directory, exist_ok=True)
+        self._seq += 1
+        # pid + start time keep concurrent ingest processes from sharing a shard
+        name = f"shard-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._seq:04d}"
+        self._manifest = {"format": SHARD_FORMAT, "dim": dim, "dtype": "float32", "rows": None,
+                          "vectors": name + ".f32", "payloads": name + ".jsonl"}
+        self._manifest_path = os.path.join(self.directory, name + MANIFEST_SUFFIX)
+        self._rows = 0
+        self._vectors = open(os.path.join(self.directory, name + ".f32"), "ab")
+        self._payloads = open(os.path.join(self.directory, name + ".jsonl"), "a", encoding="utf-8")
+        self._write_manifest()
+
+    def _write_manifest(self):
+        _write_json(self._manifest_path, self._manifest)
+
+    def append(self, point_id: int, vector: list, payload: dict) -> str:
+        # -> "<payload file>#<row>", a reference to the row for logs and doc_manifest
+        if self._manifest is not None and len(vector) != self._manifest["dim"]:
+            self.close()  # embedding provider changed: start a shard with the new width
+        if self._manifest is None:
+            self._open(len(vector))
+        self._vectors.write(array("f", vector).tobytes())
+        self._vectors.flush()
+        self._payloads.write(json.dumps({"id": point_id, "payload": payload}, ensure_ascii=False) + "\n")
+        self._payloads.flush()
+        ref = f"{os.path.join(self.directory, self._manifest['payloads'])}#{self._rows}"
+        self._rows += 1
+        if self._rows >= self.max_rows:
+            self.close()
+        return ref
+
+    def close(self):
+        if self._manifest is None:
+            return
+        self._vectors.close()
+        self._payloads.close()
+        self._manifest["rows"] = self._rows
+        self._write_manifest()
+        self._manifest = None
+
+
+def chunk_json_files(directory: str) -> list:
+    # The old one-file-per-chunk layout (shard manifests are .json too)
+    return sorted(p for p in glob.glob(os.path.join(directory, "*.json")) if not p.endswith(MANIFEST_SUFFIX))
+
+
+def list_shards(directory: str) -> list:
+    return sorted(glob.glob(os.path.join(directory, "shard-*" + MANIFEST_SUFFIX)))
+
+
+def open_shard(manifest_path: str):
+    # -> (ids, vectors, payloads); vectors is a read-only (rows, dim) float32 memmap
+    import numpy as np
+
+    directory = os.path.dirname(manifest_path)
+    with open(manifest_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    ids, payloads = [], []
+    with open(os.path.join(directory, meta["payloads"]), encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break  # torn last line of an interrupted writer
+            row = json.loads(line)
+            ids.append(row["id"])
+            payloads.append(row["payload"])
+    vectors_path = os.path.join(directory, meta["vectors"])
+    rows = meta["rows"]
+    if rows is None:
+        rows = min(len(ids), os.path.getsize(vectors_path) // (4 * meta["dim"]))
+    if rows == 0:
+        return [], np.zeros((0, meta["dim"]), dtype=np.float32), []
+    vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(rows, meta["dim"]))
+    return ids[:rows], vectors, payloads[:rows]
+
+
+def writer_running(manifest_path: str) -> bool:
+    # The writer's pid is part of the shard name (ShardWriter._open)
+    import psutil
+
+    match = re.match(r"shard-\d{8}-\d{6}-(\d+)-\d+", os.path.basename(manifest_path))
+    return match is None or psutil.pid_exists(int(match.group(1)))
+
+
+def unsealed_shards(directory: str) -> list:
+    out = []
+    for manifest_path in list_shards(directory):
+        with open(manifest_path, encoding="utf-8") as f:
+            if json.load(f)["rows"] is None:
+                out.append(manifest_path)
+    return out
+
+
+def seal_shard(manifest_path: str) -> int:
+    # Seals a shard whose writer died: both data files are cut back to the rows present
+    # in both (dropping a torn last row) and "rows" is recorded. -> rows kept
+    with open(manifest_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["rows"] is not None:
+        return meta["rows"]
+    directory = os.path.dirname(manifest_path)
+    payloads_path = os.path.join(directory, meta["payloads"])
+    vectors_path = os.path.join(directory, meta["vectors"])
+    ends = [0]
+    with open(payloads_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            ends.append(ends[-1] + len(line))
+    rows = min(len(ends) - 1, os.path.getsize(vectors_path) // (4 * meta["dim"]))
+    with open(payloads_path, "r+b") as f:
+        f.truncate(ends[rows])
+    with open(vectors_path, "r+b") as f:
+        f.truncate(rows * 4 * meta["dim"])
+    meta["rows"] = rows
+    _write_json(manifest_path, meta)
+    return rows
+
+
+def seal_orphaned(directory: str) -> list:
+    # Seals the unsealed shards whose writer process is gone; -> the sealed manifests
+    sealed = []
+    for manifest_path in unsealed_shards(directory):
+        if writer_running(manifest_path):
+            print(f"⏭ Shard still being written, left alone: {manifest_path}")
+            continue
+        rows = seal_shard(manifest_path)
+        print(f"🔒 Sealed {manifest_path} ({rows} rows)")
+        sealed.append(manifest_path)
+    return sealed
+
+
+def shard_files(manifest_path: str) -> list:
+    with open(manifest_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    directory = os.path.dirname(manifest_path)
+    return [manifest_path, os.path.join(directory, meta["vectors"]), os.path.join(directory, meta["payloads"])]
+
+
+# ------------------ CONVERT ------------------
+
+def convert_json_dir(src: str, dest: str = None, delete: bool = False, max_rows: int = SHARD_MAX_ROWS) -> int:
+    # One-JSON-per-chunk directory (final_data/qdrant_chunks) -> shards
+    dest = dest or src
+    files = chunk_json_files(src)
+    writer = ShardWriter(dest, max_rows)
+    converted, json_bytes = [], 0
+    for path in files:
+        try:
+            with open(path, encoding="utf-8") as f:
+                obj = json.load(f)
+        except Exception as e:
+            print(f"❌ JSON read failed, left in place: {path} | {e}")
+            continue
+        writer.append(obj["id"], obj["vector"], obj["payload"])
+        converted.append(path)
+        json_bytes += os.path.getsize(path)
+    writer.close()
+
+    # Only after every shard is sealed
+    if delete:
+        for path in converted:
+            os.remove(path)
+    shard_bytes = sum(os.path.getsize(p) for m in list_shards(dest) for p in shard_files(m))
+    print(f"📦 Converted {len(converted)} chunk files ({json_bytes / 1e6:.1f} MB) into shards in {dest} "
+          f"({shard_bytes / 1e6:.1f} MB in all shards there)")
+    return len(converted)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk shard tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    convert = sub.add_parser("convert", help="pack a directory of per-chunk JSON files into shards")
+    convert.add_argument("src")
+    convert.add_argument("--out", help="shard directory (default: the source directory)")
+    convert.add_argument("--delete", action="store_true", help="remove the JSON files once converted")
+    convert.add_argument("--rows", type=int, default=SHARD_MAX_ROWS, help="rows per shard")
+    seal = sub.add_parser("seal", help="seal shards left unsealed by a writer that is no longer running")
+    seal.add_argument("src")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.src):
+        sys.exit(f"❌ Not a directory: {args.src}")
+    if args.command == "convert":
+        convert_json_dir(args.src, args.out, args.delete, args.rows)
+    elif args.command == "seal":
+        seal_orphaned(args.src)
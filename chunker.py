@@ -0,0 +1,118 @@
+# chunker.py
+# Token-sized, sentence-aligned chunking. Replaces the fixed 3000-char /
+# 200-char-overlap splitter that was copied into each ingest module.
+#
+# iter_chunks() is a generator: it takes a string or an iterable of paragraphs
+# (which may itself be lazy) and yields each chunk as soon as it is full.
+
+import os
+import re
+
+from embedding_batcher import count_tokens
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "800"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "60"))
+MIN_FILL = 0.5  # close a chunk early at a paragraph break once it is at least this full
+
+# Sentence end followed by whitespace and an upper-case / digit start, incl. Vietnamese capitals
+_SENTENCE_END = re.compile(r'[.!?…]+["”’)\]]*\s+(?=["“‘(\[]?[0-9A-ZÀ-ÝĂĐĨŨƠƯẠ-Ỹ])')
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+
+
+def split_paragraphs(text: str) -> list:
+    return _PARAGRAPH_BREAK.split(text)
+
+
+def split_sentences(text: str):
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            yield sentence
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        yield tail
+
+
+def _split_long(sentence: str, max_tokens: int):
+    # A "sentence" longer than a whole chunk (tables, reference lists): fall back to word packing
+    piece, piece_tokens = [], 0
+    for word in sentence.split():
+        tokens = count_tokens(" " + word)
+        if piece and piece_tokens + tokens > max_tokens:
+            yield " ".join(piece), piece_tokens
+            piece, piece_tokens = [], 0
+        piece.append(word)
+        piece_tokens += tokens
+    if piece:
+        yield " ".join(piece), piece_tokens
+
+
+def _units(paragraphs, max_tokens):
+    # -> (text, tokens, span, ends_paragraph) for every sentence-sized unit.
+    # A paragraph is a str or a (str, span) pair; span is carried through untouched.
+    if isinstance(paragraphs, str):
+        paragraphs = split_paragraphs(paragraphs)
+    for paragraph in paragraphs:
+        paragraph, span = paragraph if isinstance(paragraph, tuple) else (paragraph, None)
+        sentences = list(split_sentences(paragraph))
+        for sentence in sentences:
+            tokens = count_tokens(sentence)
+            pieces = _split_long(sentence, max_tokens) if tokens > max_tokens else [(sentence, tokens)]
+            for piece, piece_tokens in pieces:
+                yield piece, piece_tokens, span, False
+        if sentences:
+            yield "", 0, span, True
+
+
+def _pack(paragraphs, max_tokens, overlap_tokens):
+    # Yields the list of (text, tokens, span) units that make up each chunk
+    current, current_tokens = [], 0
+    fresh = 0  # units in `current` that are not overlap carried from the previous chunk
+
+    for text, tokens, span, ends_paragraph in _units(paragraphs, max_tokens):
+        if ends_paragraph:
+            if fresh and current_tokens >= max_tokens * MIN_FILL:
+                yield current
+                current, current_tokens, fresh = [], 0, 0
+            continue
+
+        if fresh and current_tokens + tokens > max_tokens:
+            yield current
+            # Carry whole trailing sentences (up to overlap_tokens) into the next chunk
+            carried, carried_tokens = [], 0
+            for unit in reversed(current):
+                if carried_tokens + unit[1] > overlap_tokens:
+                    break
+                carried.insert(0, unit)
+                carried_tokens += unit[1]
+            current, current_tokens, fresh = carried, carried_tokens, 0
+
+        while not fresh and current and current_tokens + tokens > max_tokens:
+            current_tokens -= current.pop(0)[1]  # overlap must not push the chunk past max_tokens
+
+        current.append((text, tokens, span))
+        current_tokens += tokens
+        fresh += 1
+
+    if fresh:
+        yield current
+
+
+def iter_chunks(paragraphs, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+    for units in _pack(paragraphs, max_tokens, overlap_tokens):
+        yield " ".join(text for text, _, _ in units)
+
+
+def iter_spanned_chunks(paragraphs, max_tokens: int = CHUNK_MAX_TOKENS,
+                        overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+    # paragraphs: (text, (first, last)) pairs, e.g. page numbers -> yields (chunk, (first, last))
+    for units in _pack(paragraphs, max_tokens, overlap_tokens):
+        spans = [span for _, _, span in units if span is not None]
+        span = (min(s[0] for s in spans), max(s[1] for s in spans)) if spans else None
+        yield " ".join(text for text, _, _ in units), span
+
+
+def chunk_text(text, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list:
+    return list(iter_chunks(text, max_tokens, overlap_tokens))
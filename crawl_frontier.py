@@ -0,0 +1,195 @@
+# crawl_frontier.py
+# URL frontier for recursive crawls. URLs are canonicalized and deduplicated when
+# they are enqueued (not after they are fetched), popped shallowest-first from a
+# heap, and capped per domain. Everything is O(1) (seen set, budgets) or O(log n)
+# (heap), so a frontier of 100k+ URLs costs a few hundred bytes per URL.
+#
+# With a db_path the frontier is also kept in SQLite: the queue survives an
+# interrupted crawl, and the next run with the same path resumes it. Pages that
+# were in flight when the crawl stopped are fetched again. The file is removed
+# once the crawl completes.
+
+import os
+import re
+import heapq
+import sqlite3
+import posixpath
+from itertools import count
+from collections import Counter
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+CRAWL_FRONTIER_DIR = os.getenv("CRAWL_FRONTIER_DIR", "final_data/crawl_frontier")
+CRAWL_DOMAIN_BUDGET = int(os.getenv("CRAWL_DOMAIN_BUDGET", "10000"))  # pages per domain, 0 = no limit
+
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "dclid", "yclid", "igshid", "mc_cid", "mc_eid", "_ga", "_gl",
+                   "spm", "sessionid", "phpsessid", "jsessionid"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Links to these are never pages worth summarizing
+SKIP_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".svg", ".webp", ".ico", ".css", ".js", ".woff", ".woff2",
+                   ".ttf", ".mp3", ".mp4", ".avi", ".mov", ".zip", ".rar", ".gz", ".exe", ".dmg")
+
+QUEUED, DONE, FAILED = 0, 1, 2
+
+
+def _is_tracking(param: str) -> bool:
+    param = param.lower()
+    return param.startswith("utm_") or param in TRACKING_PARAMS
+
+
+def canonicalize(url: str) -> str:
+    # Case of scheme/host, default ports, dot segments, duplicate and trailing slashes,
+    # fragments, tracking parameters and query order don't make a different page
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    port = parts.port
+    netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+    path = re.sub(r"%[0-9a-fA-F]{2}", lambda m: m.group(0).upper(), parts.path) or "/"
+    if "/." in path or "//" in path:
+        path = "/" + posixpath.normpath(path).lstrip("/")
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                             if not _is_tracking(k)))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+def priority(key: str, depth: int) -> float:
+    # Shallower first; at the same depth, query-string pages (listings, filters, paging) last
+    return depth + (0.5 if "?" in key else 0.0)
+
+
+def frontier_path(seed_url: str) -> str:
+    host = urlsplit(seed_url).netloc.lower()
+    return os.path.join(CRAWL_FRONTIER_DIR, re.sub(r"[^a-z0-9]+", "_", host) + ".sqlite")
+
+
+class CrawlFrontier:
+    def __init__(self, max_depth: int, domain_budget: int = CRAWL_DOMAIN_BUDGET, db_path: str = None):
+        self.max_depth = max_depth
+        self.domain_budget = domain_budget
+        self.db_path = db_path
+        self._heap = []            # (priority, seq, key, url, depth)
+        self._seen = set()         # canonical keys ever enqueued
+        self._in_flight = {}       # url -> (key, depth), popped but not done
+        self._per_domain = Counter()
+        self._seq = count()
+        self._conn = None
+        self.stats = Counter()
+        if db_path:
+            self._load()
+
+    # ---- persistence ----
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS frontier (
+                key TEXT PRIMARY KEY, url TEXT, depth INTEGER, priority REAL, seq INTEGER, state INTEGER)""")
+            self._conn.commit()
+        return self._conn
+
+    def _load(self):
+        # Rows never marked done or failed (queued, or in flight when the crawl stopped) go back in the queue
+        rows = self._connect().execute("SELECT key, url, depth, priority, seq, state FROM frontier").fetchall()
+        last_seq = -1
+        for key, url, depth, prio, seq, state in rows:
+            self._seen.add(key)
+            self._per_domain[urlsplit(key).netloc] += 1
+            if state == QUEUED:
+                self._heap.append((prio, seq, key, url, depth))
+            last_seq = max(last_seq, seq)
+        heapq.heapify(self._heap)
+        self._seq = count(last_seq + 1)
+        if rows:
+            print(f"⏯️ Resuming crawl frontier {self.db_path}: {len(self._heap)} queued, "
+                  f"{len(rows) - len(self._heap)} already crawled")
+
+    def close(self):
+        # Completed crawls leave nothing behind; interrupted ones keep their state for resuming
+        if self._conn is None:
+            return
+        self._conn.commit()
+        self._conn.close()
+        self._conn = None
+        if self.finished:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.db_path + suffix):
+                    os.remove(self.db_path + suffix)
+
+    # ---- queue ----
+
+    def _admit(self, url: str, depth: int):
+        # -> (key, priority) if the URL should be enqueued
+        if depth > self.max_depth:
+            self.stats["too_deep"] += 1
+            return None
+        try:
+            key = canonicalize(url)
+        except ValueError:
+            self.stats["invalid"] += 1
+            return None
+        if key in self._seen:
+            self.stats["duplicate"] += 1
+            return None
+        parts = urlsplit(key)
+        if parts.path.lower().endswith(SKIP_EXTENSIONS):
+            self.stats["skipped"] += 1
+            return None
+        domain = parts.netloc
+        if self.domain_budget and self._per_domain[domain] >= self.domain_budget:
+            self.stats["over_budget"] += 1
+            return None
+        self._seen.add(key)
+        self._per_domain[domain] += 1
+        return key, priority(key, depth)
+
+    def push_many(self, urls, depth: int) -> int:
+        # -> number of URLs newly enqueued
+        rows = []
+        for url in urls:
+            admitted = self._admit(url, depth)
+            if admitted is None:
+                continue
+            key, prio = admitted
+            seq = next(self._seq)
+            heapq.heappush(self._heap, (prio, seq, key, url, depth))
+            rows.append((key, url, depth, prio, seq, QUEUED))
+        if rows and self.db_path:
+            conn = self._connect()
+            conn.executemany("INSERT OR IGNORE INTO frontier VALUES (?, ?, ?, ?, ?, ?)", rows)
+            conn.commit()
+        self.stats["enqueued"] += len(rows)
+        return len(rows)
+
+    def push(self, url: str, depth: int = 0) -> bool:
+        return self.push_many([url], depth) == 1
+
+    def pop(self):
+        # -> the next URL to fetch, or None when the queue is empty
+        if not self._heap:
+            return None
+        _, _, key, url, depth = heapq.heappop(self._heap)
+        self._in_flight[url] = (key, depth)
+        return url
+
+    def depth_of(self, url: str) -> int:
+        return self._in_flight[url][1]
+
+    def done(self, url: str, ok: bool = True):
+        key, _ = self._in_flight.pop(url)
+        self.stats["crawled" if ok else "failed"] += 1
+        if self.db_path:
+            conn = self._connect()
+            conn.execute("UPDATE frontier SET state = ? WHERE key = ?", (DONE if ok else FAILED, key))
+            conn.commit()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    @property
+    def finished(self) -> bool:
+        return not self._heap and not self._in_flight
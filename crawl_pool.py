@@ -0,0 +1,252 @@
+# crawl_pool.py
+# Concurrent crawl scheduler. CRAWL_WORKERS fetchers pull URLs (fetch_strategy.py:
+# plain HTTP first, a few browser tabs for pages that need JavaScript), and fetched
+# pages go through a bounded queue to CRAWL_PROCESSORS tasks that run the
+# summary/embedding pipeline. Fetching the next pages therefore overlaps with the
+# model calls for the previous ones, and a full queue stops the fetchers when
+# processing falls behind.
+#
+# Politeness, per host: at most CRAWL_PER_HOST fetches at a time, request starts at
+# least CRAWL_HOST_DELAY seconds apart (or the robots.txt Crawl-delay / Request-rate
+# if that is longer), and robots.txt Disallow rules are honoured.
+
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+from fetch_strategy import HybridFetcher
+
+CRAWL_WORKERS = int(os.getenv("CRAWL_WORKERS", "8"))
+CRAWL_PROCESSORS = int(os.getenv("CRAWL_PROCESSORS", "4"))
+CRAWL_QUEUE_SIZE = int(os.getenv("CRAWL_QUEUE_SIZE", "16"))  # fetched pages waiting for processing
+CRAWL_PER_HOST = int(os.getenv("CRAWL_PER_HOST", "2"))
+CRAWL_HOST_DELAY = float(os.getenv("CRAWL_HOST_DELAY", "1.0"))  # seconds between request starts
+CRAWL_MAX_HOST_DELAY = 60.0  # cap on robots.txt crawl delays
+CRAWL_USER_AGENT = os.getenv("CRAWL_USER_AGENT", "RiceKnowledgeBot")
+ROBOTS_TIMEOUT = 10
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+def interleave_hosts(urls) -> list:
+    # Round-robin over hosts, so a sitemap that lists one site after another keeps
+    # every worker busy instead of queueing them all behind one host's limit
+    by_host = {}
+    for url in urls:
+        by_host.setdefault(host_of(url), deque()).append(url)
+    queues, ordered = deque(by_host.values()), []
+    while queues:
+        q = queues.popleft()
+        ordered.append(q.popleft())
+        if q:
+            queues.append(q)
+    return ordered
+
+
+# ------------------ ROBOTS.TXT ------------------
+
+def parse_crawl_delay(lines: list, user_agent: str):
+    # urllib.robotparser only understands whole-second Crawl-delay values; sites also write "0.5"
+    delays, agents, in_rules = {}, [], False
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if ":" not in line:
+            continue
+        field, value = (part.strip() for part in line.split(":", 1))
+        field = field.lower()
+        if field == "user-agent":
+            if in_rules:
+                agents, in_rules = [], False
+            agents.append(value.lower())
+            continue
+        in_rules = True
+        if field == "crawl-delay":
+            try:
+                for agent in agents:
+                    delays[agent] = float(value)
+            except ValueError:
+                pass
+    ua = user_agent.lower()
+    for agent, delay in delays.items():
+        if agent != "*" and agent in ua:
+            return delay
+    return delays.get("*")
+
+
+class RobotsCache:
+    # One robots.txt fetch per host; unreachable or missing robots.txt allows everything
+    def __init__(self, user_agent: str = CRAWL_USER_AGENT):
+        self.user_agent = user_agent
+        self._rules = {}
+        self._locks = {}
+
+    async def rules(self, url: str) -> RobotFileParser:
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        if host in self._rules:
+            return self._rules[host]
+        async with self._locks.setdefault(host, asyncio.Lock()):
+            if host not in self._rules:
+                self._rules[host] = await asyncio.to_thread(self._fetch, f"{parsed.scheme}://{parsed.netloc}/robots.txt")
+        return self._rules[host]
+
+    def _fetch(self, robots_url: str) -> RobotFileParser:
+        import requests
+
+        parser = RobotFileParser(robots_url)
+        lines = []
+        try:
+            resp = requests.get(robots_url, timeout=ROBOTS_TIMEOUT, headers={"User-Agent": self.user_agent})
+            # 401/403 would mean "disallow all" to urllib; treat any error status as no rules
+            if resp.status_code == 200:
+                lines = resp.text.splitlines()
+        except Exception as e:
+            print(f"⚠️ robots.txt unavailable, crawling without it: {robots_url} | {e}")
+        parser.parse(lines)
+        parser.delay = parse_crawl_delay(lines, self.user_agent)
+        return parser
+
+    async def allowed(self, url: str) -> bool:
+        return (await self.rules(url)).can_fetch(self.user_agent, url)
+
+    async def delay(self, url: str, default: float) -> float:
+        rules = await self.rules(url)
+        delay = rules.delay
+        rate = rules.request_rate(self.user_agent)
+        if delay is None and rate is not None and rate.requests:
+            delay = rate.seconds / rate.requests
+        return min(max(default, float(delay or 0)), CRAWL_MAX_HOST_DELAY)
+
+
+# ------------------ PER-HOST LIMITS ------------------
+
+class HostLimiter:
+    def __init__(self, per_host: int = CRAWL_PER_HOST):
+        self.per_host = per_host
+        self._slots = {}
+        self._locks = {}
+        self._next_start = {}
+
+    @asynccontextmanager
+    async def slot(self, host: str, delay: float):
+        async with self._slots.setdefault(host, asyncio.Semaphore(self.per_host)):
+            # Space request starts; the lock makes concurrent slots of one host take turns
+            async with self._locks.setdefault(host, asyncio.Lock()):
+                wait = self._next_start.get(host, 0) - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._next_start[host] = time.monotonic() + delay
+            yield
+
+
+# ------------------ POOL ------------------
+
+class CrawlPool:
+    # fetch(url, worker) -> html or None; handle(url, html) processes one page
+    def __init__(self, fetch, handle, workers: int = CRAWL_WORKERS, processors: int = CRAWL_PROCESSORS,
+                 queue_size: int = CRAWL_QUEUE_SIZE, per_host: int = CRAWL_PER_HOST,
+                 host_delay: float = CRAWL_HOST_DELAY, robots: RobotsCache = None):
+        self.fetch = fetch
+        self.handle = handle
+        self.workers = workers
+        self.processors = processors
+        self.queue_size = queue_size
+        self.host_delay = host_delay
+        self.limiter = HostLimiter(per_host)
+        self.robots = robots or RobotsCache()
+        self.stats = {"fetched": 0, "failed": 0, "disallowed": 0, "processed": 0, "errors": 0}
+        self.frontier = None
+        self._active = 0
+        self._wake = None
+
+    async def _next_url(self, urls):
+        # A URL list is a shared iterator: each URL goes to exactly one worker. A frontier
+        # (crawl_frontier.py) can be empty while pages in flight are still adding links,
+        # so a worker only stops once nothing is in flight.
+        if self.frontier is None:
+            return next(urls, None)
+        while True:
+            url = self.frontier.pop()
+            if url is not None:
+                self._active += 1
+                return url
+            if self._active == 0:
+                self._wake.set()  # let the other idle workers see it too
+                return None
+            self._wake.clear()
+            await self._wake.wait()
+
+    def _finished(self, url: str, ok: bool):
+        if self.frontier is not None:
+            self.frontier.done(url, ok)
+            self._active -= 1
+            self._wake.set()
+
+    async def _fetcher(self, worker: int, urls, pages: asyncio.Queue):
+        while (url := await self._next_url(urls)) is not None:
+            if not await self.robots.allowed(url):
+                self.stats["disallowed"] += 1
+                print(f"🚫 Disallowed by robots.txt: {url}")
+                self._finished(url, False)
+                continue
+            delay = await self.robots.delay(url, self.host_delay)
+            try:
+                async with self.limiter.slot(host_of(url), delay):
+                    html = await self.fetch(url, worker)
+            except Exception as e:
+                html = None
+                print(f"❌ Fetch failed: {url} | {e}")
+            if not html:
+                self.stats["failed"] += 1
+                self._finished(url, False)
+                continue
+            self.stats["fetched"] += 1
+            await pages.put((url, html))  # blocks while processing is CRAWL_QUEUE_SIZE pages behind
+
+    async def _processor(self, pages: asyncio.Queue):
+        while True:
+            item = await pages.get()
+            if item is None:
+                return
+            url, html = item
+            try:
+                await self.handle(url, html)
+                self.stats["processed"] += 1
+                self._finished(url, True)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"❌ Processing failed: {url} | {e}")
+                self._finished(url, False)
+
+    async def run(self, urls=(), frontier=None) -> dict:
+        # urls: a list or iterator; frontier: a CrawlFrontier that handle() pushes new links into
+        urls = iter(urls)
+        self.frontier, self._active, self._wake = frontier, 0, asyncio.Event()
+        pages = asyncio.Queue(maxsize=self.queue_size)
+        start = time.time()
+        processors = [asyncio.create_task(self._processor(pages)) for _ in range(self.processors)]
+        try:
+            await asyncio.gather(*(self._fetcher(n, urls, pages) for n in range(self.workers)))
+            for _ in processors:
+                await pages.put(None)
+            await asyncio.gather(*processors)
+        finally:
+            for task in processors:
+                task.cancel()
+        print(f"🕸️ Crawl done in {time.time() - start:.1f}s: {self.stats}")
+        return self.stats
+
+
+async def crawl_urls(urls: list, handle, workers: int = CRAWL_WORKERS, frontier=None, **pool_options) -> dict:
+    # Crawl of a URL list, or of a frontier, through a CrawlPool
+    fetcher = HybridFetcher(CRAWL_USER_AGENT)
+    try:
+        return await CrawlPool(fetcher.fetch, handle, workers, **pool_options).run(interleave_hosts(urls), frontier)
+    finally:
+        await fetcher.close()
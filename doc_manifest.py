@@ -0,0 +1,106 @@
+# doc_manifest.py
+# Remembers a content fingerprint and the produced point IDs / chunk files for
+# every ingested document, so unchanged PDFs and pages are skipped on re-runs
+# and changed ones replace (rather than duplicate) their old Qdrant points.
+
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from hashlib import sha256
+
+MANIFEST_DB = os.getenv("DOC_MANIFEST_DB", "final_data/doc_manifest.sqlite")
+FORCE_REINGEST = os.getenv("FORCE_REINGEST", "0") == "1"
+
+
+def file_fingerprint(filepath: str) -> str:
+    h = sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def text_fingerprint(text: str) -> str:
+    # Whitespace/case-insensitive so cosmetic re-renders of a page don't count as changes
+    normalized = re.sub(r"\s+", " ", text).strip().lower()
+    return sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class DocumentManifest:
+    def __init__(self, db_path: str = MANIFEST_DB):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()  # async pipelines call in from worker threads
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS documents (
+                doc_key TEXT PRIMARY KEY, fingerprint TEXT, point_ids TEXT, chunk_files TEXT, updated REAL)""")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS stale_points (point_id INTEGER PRIMARY KEY)")
+            # Every ID ever replaced, kept after the Qdrant delete (stale_points is cleared then)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS retired_points (point_id INTEGER PRIMARY KEY)")
+            self._conn.commit()
+        return self._conn
+
+    def is_unchanged(self, doc_key: str, fingerprint: str) -> bool:
+        if FORCE_REINGEST:
+            return False
+        with self._lock:
+            row = self._connect().execute("SELECT fingerprint FROM documents WHERE doc_key = ?",
+                                          (doc_key,)).fetchone()
+        return row is not None and row[0] == fingerprint
+
+    def replace(self, doc_key: str, fingerprint: str, point_ids: list, chunk_files: list):
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT point_ids, chunk_files FROM documents WHERE doc_key = ?",
+                               (doc_key,)).fetchone()
+            if row is not None:
+                old_ids = set(json.loads(row[0])) - set(point_ids)
+                conn.executemany("INSERT OR IGNORE INTO stale_points VALUES (?)", [(pid,) for pid in old_ids])
+                conn.executemany("INSERT OR IGNORE INTO retired_points VALUES (?)", [(pid,) for pid in old_ids])
+                for path in set(json.loads(row[1])) - set(chunk_files):
+                    # Shard rows ("<shard>.jsonl#<row>") stay on disk; uploads skip retired IDs
+                    if path.endswith(".json") and os.path.exists(path):
+                        os.remove(path)
+                if old_ids:
+                    print(f"♻️ Replaced {doc_key}: {len(old_ids)} old points queued for deletion")
+            conn.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                         (doc_key, fingerprint, json.dumps(point_ids), json.dumps(chunk_files), time.time()))
+            conn.commit()
+
+    def forget(self, doc_keys: list):
+        # The next run re-ingests these even if their content has not changed
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("UPDATE documents SET fingerprint = NULL WHERE doc_key = ?", [(k,) for k in doc_keys])
+            conn.commit()
+
+    def max_point_id(self) -> int:
+        max_id = -1
+        with self._lock:
+            for (point_ids,) in self._connect().execute("SELECT point_ids FROM documents"):
+                max_id = max([max_id, *json.loads(point_ids)])
+        return max_id
+
+    def stale_point_ids(self) -> list:
+        with self._lock:
+            return [pid for (pid,) in self._connect().execute("SELECT point_id FROM stale_points")]
+
+    def retired_point_ids(self) -> set:
+        with self._lock:
+            return {pid for (pid,) in self._connect().execute("SELECT point_id FROM retired_points")}
+
+    def clear_stale(self, point_ids: list):
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("DELETE FROM stale_points WHERE point_id = ?", [(pid,) for pid in point_ids])
+            conn.commit()
+
+manifest = DocumentManifest()
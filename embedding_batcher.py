@@ -0,0 +1,99 @@
+# embedding_batcher.py
+# Collects texts from concurrent callers and sends them to a list-input endpoint
+# in one request, then hands each caller its own result. Used for embeddings
+# (get_embedding) and for translation (translation.py).
+
+import os
+import asyncio
+
+import tiktoken
+
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "128"))
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "100000"))
+EMBED_BATCH_MAX_WAIT = float(os.getenv("EMBED_BATCH_MAX_WAIT", "0.05"))  # seconds
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+class RequestBatcher:
+    def __init__(self, send_many, max_items: int = EMBED_BATCH_MAX_ITEMS,
+                 max_tokens: int = EMBED_BATCH_MAX_TOKENS, max_wait: float = EMBED_BATCH_MAX_WAIT):
+        # send_many: async (list[str]) -> list of results, one per input, same order
+        self.send_many = send_many
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.max_wait = max_wait
+        self._loop = None
+        self._reset()
+
+    def _reset(self):
+        self._pending = []
+        self._pending_tokens = 0
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, text: str):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Streamlit / asyncio.run() give us a fresh loop per run
+            self._loop = loop
+            self._reset()
+
+        tokens = count_tokens(text)
+        if self._pending and self._pending_tokens + tokens > self.max_tokens:
+            self._flush()
+
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self._pending_tokens += tokens
+
+        if len(self._pending) >= self.max_items or self._pending_tokens >= self.max_tokens:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    async def flush(self):
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        if not batch:
+            return
+        task = self._loop.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            results = await self.send_many(texts)
+            if len(results) != len(batch):
+                # zip() would leave the callers past the end waiting forever
+                raise ValueError(f"got {len(results)} results for {len(batch)} inputs")
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # One bad input fails the whole request; retry one by one so only it fails
+            print(f"⚠️ Batch of {len(batch)} failed, retrying individually: {e}")
+            await asyncio.gather(*(self._send([item]) for item in batch))
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,104 @@
+# embedding_providers.py
+# Embedding backends behind one small interface:
+#   provider.name / provider.model          identify the vector space (also the cache key)
+#   provider.dimension / provider.distance  used when the Qdrant collection is created
+#   await provider.embed_many(texts)        list of vectors, same order as texts
+#
+# EMBEDDING_PROVIDER=openai (default) or local. A collection holds one vector
+# space, so switch provider together with QDRANT_COLLECTION_NAME. local needs the
+# optional sentence-transformers package (see requirements.txt).
+
+import os
+import asyncio
+
+from rate_governor import governor, estimate_tokens
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL",
+                                  "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+LOCAL_EMBEDDING_BACKEND = os.getenv("LOCAL_EMBEDDING_BACKEND", "torch")  # or "onnx"
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "64"))
+
+OPENAI_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+# Known sizes so the uploader can create a collection without loading the model
+LOCAL_DIMENSIONS = {
+    "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2": 384,
+    "intfloat/multilingual-e5-small": 384,
+    "BAAI/bge-m3": 1024,
+}
+
+
+class OpenAIEmbeddingProvider:
+    name = "openai"
+    distance = "Cosine"
+
+    def __init__(self, model: str = OPENAI_EMBEDDING_MODEL, client=None):
+        self.model = model
+        self.dimension = OPENAI_DIMENSIONS.get(model, 1536)
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return self._client
+
+    async def embed_many(self, texts: list) -> list:
+        response = await governor.call("openai", self.model, lambda: self.client.embeddings.create(
+            model=self.model,
+            input=texts
+        ), est_tokens=sum(estimate_tokens(t) for t in texts))
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+
+class LocalEmbeddingProvider:
+    # sentence-transformers on CPU; whole batches are encoded into one NumPy array
+    name = "local"
+    distance = "Cosine"
+
+    def __init__(self, model: str = LOCAL_EMBEDDING_MODEL, backend: str = LOCAL_EMBEDDING_BACKEND):
+        self.model = model
+        self.backend = backend
+        self._encoder = None
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                raise ImportError("EMBEDDING_PROVIDER=local needs sentence-transformers, which is optional: "
+                                  "pip install sentence-transformers (see requirements.txt)") from e
+            kwargs = {"backend": self.backend} if self.backend != "torch" else {}
+            self._encoder = SentenceTransformer(self.model, device="cpu", **kwargs)
+        return self._encoder
+
+    @property
+    def dimension(self) -> int:
+        if self.model in LOCAL_DIMENSIONS:
+            return LOCAL_DIMENSIONS[self.model]
+        return self.encoder.get_sentence_embedding_dimension()
+
+    def encode(self, texts: list):
+        # -> float32 ndarray of shape (len(texts), dimension), L2-normalized
+        return self.encoder.encode(texts, batch_size=LOCAL_EMBEDDING_BATCH_SIZE, convert_to_numpy=True,
+                                   normalize_embeddings=True, show_progress_bar=False).astype("float32")
+
+    async def embed_many(self, texts: list) -> list:
+        # Off the event loop so crawling and API calls keep going while the CPU encodes
+        vectors = await asyncio.to_thread(self.encode, texts)
+        return vectors.tolist()
+
+
+def get_embedding_provider(name: str = EMBEDDING_PROVIDER, openai_client=None):
+    if name == "openai":
+        return OpenAIEmbeddingProvider(client=openai_client)
+    if name == "local":
+        return LocalEmbeddingProvider()
+    raise ValueError(f"Unknown EMBEDDING_PROVIDER: {name} (expected 'openai' or 'local')")
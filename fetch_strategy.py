@@ -0,0 +1,267 @@
+# fetch_strategy.py
+# How crawled pages are fetched. Most of our sources are static HTML, so a page is
+# first requested with a pooled aiohttp session (keep-alive, gzip/deflate, HTTP
+# caching with ETag / Last-Modified revalidation). The headless browser (crawl4ai)
+# is started only when a page looks like it needs JavaScript, and only for that page:
+#
+#   - too little visible text, or SPA / "enable JavaScript" markers
+#   - bot challenges (403/429/503 with a challenge page), network errors
+#   - the host is in BROWSER_DOMAINS, or BROWSER_LEARN_AFTER of its pages in a row
+#     needed the browser (the rest of that host then goes straight to it)
+#
+# FETCH_MODE=browser restores the old browser-only behaviour, FETCH_MODE=http never
+# starts a browser.
+
+import os
+import re
+import time
+import zlib
+import asyncio
+import sqlite3
+import threading
+from collections import Counter
+from urllib.parse import urlparse
+
+FETCH_MODE = os.getenv("FETCH_MODE", "auto")  # auto | http | browser
+BROWSER_DOMAINS = {d.strip().lower() for d in os.getenv("BROWSER_DOMAINS", "").split(",") if d.strip()}
+BROWSER_PAGES = int(os.getenv("BROWSER_PAGES", "4"))  # tabs open at once
+BROWSER_LEARN_AFTER = 3
+HTTP_CONNECTIONS = int(os.getenv("HTTP_CONNECTIONS", "64"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "20"))
+HTTP_MAX_BYTES = 10 * 1024 * 1024
+HTTP_CACHE_DB = os.getenv("HTTP_CACHE_DB", "final_data/http_cache.sqlite")
+HTTP_CACHE_MAX_BYTES = int(float(os.getenv("HTTP_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+HTTP_CACHE_EVICT_EVERY = 200  # puts between size checks
+MIN_TEXT_CHARS = int(os.getenv("FETCH_MIN_TEXT_CHARS", "300"))  # less visible text than this -> browser
+
+_SPA_MARKERS = re.compile(
+    r'<div[^>]+id=["\'](root|app|__next|__nuxt|svelte)["\'][^>]*>\s*</div>'
+    r"|enable javascript|javascript is (required|disabled)|ng-app=|data-reactroot",
+    re.I)
+_CHALLENGE_MARKERS = re.compile(r"cf-chl|just a moment\.\.\.|captcha|checking your browser", re.I)
+_INVISIBLE = re.compile(r"<(script|style|noscript|template|svg)\b.*?</\1\s*>|<!--.*?-->", re.I | re.S)
+_TAG = re.compile(r"<[^>]+>")
+
+
+def visible_text_length(html: str) -> int:
+    # Rough count of non-whitespace characters a reader would see
+    return len(re.sub(r"\s+", "", _TAG.sub(" ", _INVISIBLE.sub(" ", html))))
+
+
+def needs_browser(html: str) -> bool:
+    return visible_text_length(html) < MIN_TEXT_CHARS or bool(_SPA_MARKERS.search(html))
+
+
+# ------------------ HTTP CACHE ------------------
+
+def _expires(cache_control: str) -> float:
+    # -> time until which the stored page can be used without asking the server (0: revalidate)
+    directives = {d.strip().split("=")[0].lower(): d.strip() for d in cache_control.split(",") if d.strip()}
+    if "no-cache" in directives:
+        return 0
+    age = directives.get("s-maxage") or directives.get("max-age")
+    try:
+        return time.time() + int(age.split("=", 1)[1]) if age else 0
+    except ValueError:
+        return 0
+
+
+class HttpCache:
+    # Size-bounded like llm_cache.py: least recently used pages go first ("updated" is
+    # the last time a page was stored, revalidated or served). Blocking SQLite calls;
+    # HybridFetcher runs them in worker threads.
+    def __init__(self, db_path: str = HTTP_CACHE_DB, max_bytes: int = HTTP_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._puts = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, expires REAL, body BLOB, updated REAL)""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS pages_updated ON pages (updated)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, url: str):
+        # -> (etag, last_modified, expires, html) or None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT etag, last_modified, expires, body FROM pages WHERE url = ?",
+                               (url,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE pages SET updated = ? WHERE url = ?", (time.time(), url))
+            conn.commit()
+        return row[0], row[1], row[2], zlib.decompress(row[3]).decode("utf-8")
+
+    def put(self, url: str, headers, html: str):
+        cache_control = headers.get("Cache-Control", "")
+        if "no-store" in cache_control.lower():
+            return
+        body = zlib.compress(html.encode("utf-8"), 6)
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                         (url, headers.get("ETag"), headers.get("Last-Modified"), _expires(cache_control),
+                          body, time.time()))
+            conn.commit()
+            self._puts += 1
+            if self._puts % HTTP_CACHE_EVICT_EVERY == 0:
+                self._evict(conn)
+
+    def touch(self, url: str, headers):
+        # 304: the stored copy is still current; a new Cache-Control may extend its lifetime
+        with self._lock:
+            conn = self._connect()
+            conn.execute("UPDATE pages SET expires = ?, updated = ? WHERE url = ?",
+                         (_expires(headers.get("Cache-Control", "")), time.time(), url))
+            conn.commit()
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(length(body)), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used pages until we are back under 90% of the budget
+        target = total - int(self.max_bytes * 0.9)
+        freed, doomed = 0, []
+        for url, size in conn.execute("SELECT url, length(body) FROM pages ORDER BY updated"):
+            doomed.append((url,))
+            freed += size
+            if freed >= target:
+                break
+        conn.executemany("DELETE FROM pages WHERE url = ?", doomed)
+        conn.commit()
+        print(f"🧹 HTTP cache evicted {len(doomed)} pages ({freed // 1024} KB)")
+
+
+# ------------------ FETCHER ------------------
+
+class HybridFetcher:
+    # fetch(url, worker) -> html or None, the signature CrawlPool expects
+    def __init__(self, user_agent: str, mode: str = FETCH_MODE, cache: HttpCache = None):
+        self.user_agent = user_agent
+        self.mode = mode
+        self.cache = cache or HttpCache()
+        self.stats = Counter()
+        self._session = None
+        self._crawler = None
+        self._crawler_lock = asyncio.Lock()
+        self._tabs = None
+        self._fallbacks = Counter()  # host -> pages in a row that needed the browser
+
+    async def _get_session(self):
+        import aiohttp
+
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=HTTP_CONNECTIONS, ttl_dns_cache=300, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+                headers={"User-Agent": f"Mozilla/5.0 (compatible; {self.user_agent})",
+                         "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.5",
+                         "Accept-Encoding": "gzip, deflate"})
+        return self._session
+
+    def _browser_first(self, host: str) -> bool:
+        return (self.mode == "browser" or host in BROWSER_DOMAINS
+                or self._fallbacks[host] >= BROWSER_LEARN_AFTER)
+
+    async def fetch(self, url: str, worker: int = 0):
+        host = urlparse(url).netloc.lower()
+        if self.mode != "http" and self._browser_first(host):
+            return await self._fetch_browser(url)
+        html, fallback = await self._fetch_http(url)
+        if not fallback:
+            self._fallbacks[host] = 0
+            return html
+        if self.mode == "http":
+            self.stats["http_failed"] += 1
+            return None
+        self._fallbacks[host] += 1
+        if self._fallbacks[host] == BROWSER_LEARN_AFTER:
+            print(f"🧭 {host}: {BROWSER_LEARN_AFTER} pages in a row needed JavaScript, using the browser for it")
+        return await self._fetch_browser(url)
+
+    async def _fetch_http(self, url: str):
+        # -> (html or None, whether to try the browser)
+        cached = await asyncio.to_thread(self.cache.get, url)
+        if cached and cached[2] > time.time():
+            self.stats["cache_fresh"] += 1
+            return cached[3], False
+        headers = {}
+        if cached:
+            if cached[0]:
+                headers["If-None-Match"] = cached[0]
+            if cached[1]:
+                headers["If-Modified-Since"] = cached[1]
+        session = await self._get_session()
+        try:
+            async with session.get(url, headers=headers, allow_redirects=True) as resp:
+                if resp.status == 304 and cached:
+                    await asyncio.to_thread(self.cache.touch, url, resp.headers)
+                    self.stats["cache_revalidated"] += 1
+                    return cached[3], False
+                if resp.status in (404, 410):
+                    self.stats["http_gone"] += 1
+                    return None, False
+                content_type = resp.headers.get("Content-Type", "")
+                if resp.status == 200 and content_type and "html" not in content_type:
+                    self.stats["not_html"] += 1
+                    print(f"⏭ Not an HTML page ({content_type}): {url}")
+                    return None, False
+                if resp.content_length and resp.content_length > HTTP_MAX_BYTES:
+                    return None, False
+                html = (await resp.read()).decode(resp.get_encoding(), errors="replace")
+        except Exception as e:
+            print(f"⚠️ HTTP fetch failed, trying the browser: {url} | {e}")
+            return None, True
+        if resp.status != 200:
+            # 403/429/503 are often bot walls a real browser gets through
+            return None, resp.status in (401, 403, 429, 503) or bool(_CHALLENGE_MARKERS.search(html))
+        if needs_browser(html):
+            self.stats["needs_js"] += 1
+            return None, True
+        await asyncio.to_thread(self.cache.put, url, resp.headers, html)
+        self.stats["http"] += 1
+        return html, False
+
+    async def _get_crawler(self):
+        from crawl4ai import AsyncWebCrawler, BrowserConfig
+
+        async with self._crawler_lock:
+            if self._crawler is None:
+                self._crawler = AsyncWebCrawler(config=BrowserConfig(headless=True))
+                await self._crawler.start()
+                self._tabs = asyncio.Queue()
+                for tab in range(BROWSER_PAGES):
+                    self._tabs.put_nowait(tab)
+        return self._crawler
+
+    async def _fetch_browser(self, url: str):
+        # The browser starts with the first page that needs it; one crawl4ai session per tab
+        from crawl4ai import CrawlerRunConfig, CacheMode
+
+        crawler = await self._get_crawler()
+        tab = await self._tabs.get()
+        try:
+            result = await crawler.arun(url=url, config=CrawlerRunConfig(cache_mode=CacheMode.BYPASS),
+                                        session_id=f"crawl_tab_{tab}")
+        finally:
+            self._tabs.put_nowait(tab)
+        self.stats["browser"] += 1
+        return result.html if result.success else None
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._crawler is not None:
+            await self._crawler.close()
+            self._crawler = None
+        if self.stats:
+            print(f"📡 Fetch strategy: {dict(self.stats)}")
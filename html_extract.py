@@ -0,0 +1,159 @@
+# html_extract.py
+# One lxml parse per crawled page -> (main-content text, outbound links).
+# Used by every web ingest path in place of the BeautifulSoup clean_html /
+# extract_internal_links pair, which parsed each page twice with html.parser.
+#
+# HTML_BOILERPLATE: "heuristic" (default) drops menus, cookie banners, share
+# bars and other link-heavy blocks; "trafilatura" hands the parsed tree to
+# trafilatura for its main-content extraction; "off" keeps all visible text.
+
+import os
+import re
+from urllib.parse import urljoin, urldefrag, urlparse
+
+from lxml import etree, html as lxml_html
+
+HTML_BOILERPLATE = os.getenv("HTML_BOILERPLATE", "heuristic")
+
+DROP_TAGS = ["script", "style", "noscript", "template", "svg", "iframe", "head"]
+CHROME_TAGS = ["header", "footer", "nav", "aside", "form"]
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "ul", "ol", "table", "tr", "td", "th",
+              "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "br", "dd", "dt", "figcaption",
+              "header", "footer", "nav", "aside"}
+
+# class/id/role fragments that mark page chrome rather than content
+_BOILERPLATE_ATTR = re.compile(
+    r"(^|[\s_-])(nav|navbar|menu|breadcrumbs?|sidebar|footer|cookies?|consent|banner|"
+    r"share|social|related|comments?|advert|ads|promo|newsletter|subscribe|popup|modal|skip)([\s_-]|$)",
+    re.I)
+MAX_LINK_DENSITY = 0.5     # share of a block's text that sits inside <a>
+MIN_MENU_LINKS = 2         # a block with a single link is a sentence that links, not a menu
+SHORT_BLOCK_CHARS = 300    # link-heavy blocks longer than this are kept (e.g. link-rich articles)
+
+_parser = lxml_html.HTMLParser(encoding="utf-8", remove_comments=True, remove_pis=True)
+
+
+def _parse(raw_html: str):
+    # bytes + explicit encoding: lxml rejects str input that carries an XML encoding declaration
+    return lxml_html.document_fromstring(raw_html.encode("utf-8", "replace"), parser=_parser)
+
+
+def _links(root, base_url: str) -> list:
+    # Absolute, fragment-free http(s) links in document order, deduplicated
+    seen, links = set(), []
+    for href in root.xpath("//a/@href"):
+        href = href.strip()
+        if not href or href.startswith(("#", "mailto:", "tel:", "javascript:")):
+            continue
+        url = urldefrag(urljoin(base_url, href))[0]
+        if urlparse(url).scheme in ("http", "https") and url not in seen:
+            seen.add(url)
+            links.append(url)
+    return links
+
+
+def _drop(el):
+    parent = el.getparent()
+    if parent is not None:
+        el.drop_tree()  # keeps the element's tail text
+
+
+def _paragraph_chars(el) -> int:
+    # Text an element holds as running prose: its own text plus that of its <p> children
+    if el.tag == "p":
+        return len(el.text_content().strip())
+    own = len((el.text or "").strip()) + sum(len((child.tail or "").strip()) for child in el)
+    return own + sum(len(child.text_content().strip()) for child in el if child.tag == "p")
+
+
+def _text_anchor(body):
+    # -> the element with the most prose and all its ancestors, which are never dropped:
+    # wrappers like <div class="content with-sidebar"> or an ASP.NET page-wide <form>
+    # would otherwise take the article with them
+    best, best_chars = None, 0
+    for el in body.iter():
+        if isinstance(el.tag, str):
+            chars = _paragraph_chars(el)
+            if chars > best_chars:
+                best, best_chars = el, chars
+    if best is None:
+        return set()
+    return {best, *best.iterancestors()}
+
+
+def _strip_boilerplate(body):
+    keep = _text_anchor(body)
+    for el in list(body.iter(*CHROME_TAGS)):
+        if el not in keep:
+            _drop(el)
+    for el in list(body.iter()):
+        if not isinstance(el.tag, str) or el.getparent() is None or el in keep:
+            continue
+        if el.tag in ("main", "article"):
+            continue
+        marker = " ".join(filter(None, (el.get("class"), el.get("id"), el.get("role"))))
+        if marker and _BOILERPLATE_ATTR.search(marker):
+            _drop(el)
+    for el in list(body.iter("div", "section", "ul", "ol", "p", "td", "li")):
+        if el.getparent() is None or el in keep:
+            continue
+        text = " ".join(el.text_content().split())
+        if not text or len(text) > SHORT_BLOCK_CHARS:
+            continue
+        anchors = list(el.iter("a"))
+        if len(anchors) < MIN_MENU_LINKS:
+            continue
+        link_chars = sum(len(" ".join(a.text_content().split())) for a in anchors)
+        if link_chars / len(text) > MAX_LINK_DENSITY:
+            _drop(el)
+
+
+def _main_content(root):
+    # Prefer an explicit main region when the page declares one
+    found = root.xpath("//main | //*[@role='main'] | //article")
+    if len(found) == 1 or (found and found[0].tag == "main"):
+        return found[0]
+    body = root.find("body")
+    return body if body is not None else root
+
+
+def _text(el) -> str:
+    # One line per block element, whitespace inside a line collapsed
+    for block in el.iter(*BLOCK_TAGS):
+        block.tail = "\n" + (block.tail or "")
+    lines = (" ".join(line.split()) for line in el.text_content().splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _trafilatura_text(root) -> str:
+    import trafilatura
+    return trafilatura.extract(root, include_comments=False, include_tables=True, favor_precision=True) or ""
+
+
+def extract_page(raw_html: str, base_url: str = "", boilerplate: str = HTML_BOILERPLATE):
+    # -> (text, links). Links are collected before any element is removed, so
+    # navigation menus still feed the crawler even when their text is dropped.
+    if not raw_html or not raw_html.strip():
+        return "", []
+    try:
+        root = _parse(raw_html)
+    except (etree.ParserError, ValueError):
+        return "", []
+    links = _links(root, base_url) if base_url else []
+
+    etree.strip_elements(root, *DROP_TAGS, with_tail=False)
+    if boilerplate == "trafilatura":
+        text = _trafilatura_text(root)
+        if text:
+            return text, links
+    if boilerplate == "off":
+        body = root.find("body")
+        return _text(body if body is not None else root), links
+    content = _main_content(root)
+    _strip_boilerplate(content)
+    return _text(content), links
+
+
+def internal_links(links: list, base_url: str) -> list:
+    base_domain = urlparse(base_url).netloc
+    return [link for link in links if urlparse(link).netloc == base_domain]
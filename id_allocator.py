@@ -0,0 +1,134 @@
+# id_allocator.py
+# Qdrant point IDs handed out in leased blocks.
+#
+# The counter (the highest ID leased so far) lives in a text file or an S3
+# object. A worker atomically advances it by ID_BLOCK_SIZE and then hands out
+# IDs from its block locally, so there is one coordination round trip per block
+# instead of one write per chunk, and concurrent workers never share an ID.
+# IDs left in a block when the process exits are simply skipped.
+#
+#   LocalIdAllocator(path)       exclusive lock on <path>.lock, then read/replace <path>
+#   S3IdAllocator(bucket, key)   conditional PUT (If-Match on the ETag, If-None-Match
+#                                for the first write), retried when another worker won
+#   BlockIdAllocator(backend)    next_id() -> int, leases a new block when one runs out
+
+import os
+import time
+import random
+import threading
+
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "1000"))
+S3_LEASE_RETRIES = 20
+
+
+def _lock_file(f):
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:  # LK_LOCK gives up after ~10s; keep waiting
+                continue
+    import fcntl
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock_file(f):
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        return
+    import fcntl
+    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _parse(value: str, floor: int) -> int:
+    try:
+        return max(int(value.strip()), floor)
+    except ValueError:
+        return floor
+
+
+class LocalIdAllocator:
+    def __init__(self, path: str, floor: int = 0):
+        # floor: the counter never starts below this (IDs already used elsewhere)
+        self.path = path
+        self.floor = floor
+
+    def lease(self, count: int) -> int:
+        # -> first ID of a block of `count` fresh IDs
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a+") as lock:
+            _lock_file(lock)
+            try:
+                last = self.floor - 1
+                if os.path.exists(self.path):
+                    with open(self.path, encoding="utf-8") as f:
+                        last = _parse(f.read(), self.floor - 1)
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(str(last + count))
+                os.replace(tmp, self.path)
+            finally:
+                _unlock_file(lock)
+        return last + 1
+
+
+class S3IdAllocator:
+    def __init__(self, bucket: str, key: str, s3=None, floor: int = 0):
+        self.bucket = bucket
+        self.key = key
+        self.floor = floor
+        self._s3 = s3
+
+    @property
+    def s3(self):
+        if self._s3 is None:
+            import boto3
+            self._s3 = boto3.client("s3")
+        return self._s3
+
+    def _read(self):
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=self.key)
+        except self.s3.exceptions.NoSuchKey:
+            return self.floor - 1, None
+        return _parse(obj["Body"].read().decode("utf-8"), self.floor - 1), obj["ETag"]
+
+    def lease(self, count: int) -> int:
+        from botocore.exceptions import ClientError
+
+        for attempt in range(S3_LEASE_RETRIES):
+            last, etag = self._read()
+            condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+            try:
+                self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=str(last + count).encode("utf-8"),
+                                   **condition)
+                return last + 1
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                    raise
+            # Another worker advanced the counter between our read and write
+            time.sleep(random.uniform(0, min(2.0, 0.05 * 2 ** attempt)))
+        raise RuntimeError(f"Could not lease IDs from s3://{self.bucket}/{self.key} after {S3_LEASE_RETRIES} tries")
+
+
+class BlockIdAllocator:
+    def __init__(self, backend, block_size: int = ID_BLOCK_SIZE):
+        self.backend = backend
+        self.block_size = block_size
+        self._next = 0
+        self._stop = 0
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            if self._next >= self._stop:
+                self._next = self.backend.lease(self.block_size)
+                self._stop = self._next + self.block_size
+            point_id = self._next
+            self._next += 1
+            return point_id
@@ -1,55 +1,103 @@
-import os, json, asyncio
-import fitz
-import re
+import os, asyncio
 import boto3
 import io
+import shutil
+import tempfile
 from hashlib import md5
 from pathlib import Path
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from urllib.parse import urlparse
-from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
-from ingest_chunks import get_embedding, get_title_summary, detect_lang, translate_vi_en, postprocess_text, chunk_text
+from ingest_chunks import get_embedding, get_title_summary, postprocess_text, SUMMARY_CONCURRENCY
+from chunker import iter_chunks, split_paragraphs
+from chunk_pipeline import run_chunk_pipeline
+from chunk_dedup import dedup_index
+from pdf_extract import iter_pdf_chunks_parallel
+from html_extract import extract_page
+from lang_detect import detect_lang, DocumentLanguage
+from translation import translate_summary
+from id_allocator import S3IdAllocator, BlockIdAllocator
+from s3_session_writer import S3ShardWriter
+from crawl_pool import crawl_urls
 
 load_dotenv()
-s3 = boto3.client("s3")
 bucket = os.getenv("S3_BUCKET_NAME")
 region = os.getenv("AWS_REGION")
 
-def get_last_global_id():
-    try:
-        obj = s3.get_object(Bucket=bucket, Key="last_chunk_id.txt")
-        return int(obj["Body"].read().decode().strip())
-    except:
-        return 0
-
-GLOBAL_CHUNK_ID = get_last_global_id()
+# The S3 client, the ID counter and the session prefix are resolved on first use so
+# importing this module (app.py does it on every Streamlit rerun) makes no S3 calls
+_s3 = None
+_id_allocator = None
+SESSION_PREFIX = None
+_session_writer = None
+CHUNK_ID_KEY = "last_chunk_id.txt"
+dedup = dedup_index("s3_sessions")
 
+def get_s3():
+    global _s3
+    if _s3 is None:
+        _s3 = boto3.client("s3")
+    return _s3
 
-def update_last_global_id(new_id: int):
-    s3.put_object(Body=str(new_id), Bucket=bucket, Key="last_chunk_id.txt")
+def claim_point_id() -> int:
+    # last_chunk_id.txt holds the highest ID leased by any worker; each worker leases a
+    # block with a conditional PUT, so there is one S3 round trip per ID_BLOCK_SIZE chunks
+    global _id_allocator
+    if _id_allocator is None:
+        _id_allocator = BlockIdAllocator(S3IdAllocator(bucket, CHUNK_ID_KEY, get_s3(), floor=1))
+    return _id_allocator.next_id()
 
 
 
 def get_next_session_prefix():
-    existing = s3.list_objects_v2(Bucket=bucket, Prefix="session_")
+    existing = get_s3().list_objects_v2(Bucket=bucket, Prefix="session_")
     if "Contents" not in existing:
         return "session_1/"
     sessions = [obj["Key"].split("/")[0] for obj in existing["Contents"] if obj["Key"].startswith("session_")]
     max_id = max([int(s.split("_")[1]) for s in sessions if s.split("_")[1].isdigit()], default=0)
     return f"session_{max_id + 1}/"
 
-SESSION_PREFIX = get_next_session_prefix()
-
-async def save_chunk_to_s3(chunk, meta, url, chunk_id, source, slug, path_hash):
-    global GLOBAL_CHUNK_ID  # <- ensure we reference the global
-    lang = detect_lang(chunk)
-    translated = translate_vi_en(meta["summary"]) if lang == "vi" else meta["summary"]
+def get_session_prefix():
+    global SESSION_PREFIX
+    if SESSION_PREFIX is None:
+        SESSION_PREFIX = get_next_session_prefix()
+    return SESSION_PREFIX
+
+def get_session_writer() -> S3ShardWriter:
+    global _session_writer
+    if _session_writer is None:
+        _session_writer = S3ShardWriter(get_s3(), bucket, get_session_prefix())
+    return _session_writer
+
+async def start_session(prefix: str):
+    # Pins the session prefix chosen by the caller (app.py writes it to session_config.json).
+    # A writer left over from a run that raised before close_session() is closed first,
+    # under its own prefix, so its buffered chunks (IDs already leased) land in their own
+    # session. If that upload fails the old writer stays current and the error propagates.
+    global SESSION_PREFIX, _session_writer
+    if _session_writer is not None:
+        stale = _session_writer
+        print(f"⚠️ Closing the unclosed writer of {stale.prefix} before starting {prefix}")
+        await stale.close_orphaned()
+        _session_writer = None
+    SESSION_PREFIX = prefix
+
+async def close_session():
+    # Flushes the buffered chunks and writes the session manifest; the next chunk
+    # saved by this process starts a new session
+    global _session_writer, SESSION_PREFIX
+    if _session_writer is not None:
+        await _session_writer.close()
+    _session_writer, SESSION_PREFIX = None, None
+
+async def save_chunk_to_s3(chunk, meta, url, chunk_id, source, slug, path_hash, extra=None, lang=None):
+    point_id = claim_point_id()  # claimed before any await so concurrent chunks get distinct IDs
+    lang = lang or detect_lang(chunk)
     parsed = urlparse(url)
-    vector = await get_embedding(meta["summary"] + " " + chunk)
+    vector, translated = await asyncio.gather(get_embedding(meta["summary"] + " " + chunk),
+                                              translate_summary(meta["summary"], lang))
 
     payload = {
-        "id": GLOBAL_CHUNK_ID,
+        "id": point_id,
         "vector": vector,
         "payload": {
             "title": meta["title"],
@@ -59,60 +107,65 @@ async def save_chunk_to_s3(chunk, meta, url, chunk_id, source, slug, path_hash):
             "url": url,
             "source": source,
             "lang": lang,
-            "chunk_number": GLOBAL_CHUNK_ID,
+            "chunk_number": point_id,
             "url_path": parsed.path,
-            "chunk_id": f"{slug}_{path_hash}_chunk{GLOBAL_CHUNK_ID}"
+            "chunk_id": f"{slug}_{path_hash}_chunk{point_id}"
         }
     }
-
-    key = f"{SESSION_PREFIX}{slug}_{path_hash}_chunk{GLOBAL_CHUNK_ID}.json"
-    s3.put_object(Body=json.dumps(payload, ensure_ascii=False), Bucket=bucket, Key=key)
-    print(f"✅ Uploaded: {key}")
-
-    GLOBAL_CHUNK_ID += 1
-    update_last_global_id(GLOBAL_CHUNK_ID)
+    if extra:
+        payload["payload"].update(extra)
+
+    # Buffered into a compressed session shard; close_session() uploads the rest. The chunk
+    # only counts as stored for dedup once its shard is in S3.
+    key = await get_session_writer().add(payload, on_stored=lambda: dedup.stored(url, chunk_id, chunk))
+    print(f"✅ Buffered: {slug}_{path_hash}_chunk{point_id} -> {key}")
+
+async def save_chunks_to_s3(chunk_iter, url, source, slug, path_hash):
+    # Concurrent chunks let the shared embedding batcher send list requests
+    doc_lang = DocumentLanguage()
+    # Sessions never delete a document's earlier points, so shared chunks stay canonical
+    await asyncio.to_thread(dedup.begin_document, url, keep_shared=True)
+    return await run_chunk_pipeline(
+        chunk_iter,
+        lambda chunk: get_title_summary(chunk, url),
+        lambda i, chunk, meta, extra: save_chunk_to_s3(chunk, meta, url, i, source, slug, path_hash, extra,
+                                                       doc_lang.detect(chunk)),
+        SUMMARY_CONCURRENCY,
+        admit=lambda i, chunk: dedup.admit(url, i, chunk))
 
 async def process_pdf_file(file_stream: io.BytesIO, filename: str):
     ext = Path(filename).suffix.lower()
 
-    if ext == ".pdf":
-        doc = fitz.open(stream=file_stream, filetype="pdf")
-        text = "\n".join([page.get_text() for page in doc])
-    elif ext == ".txt":
-        text = file_stream.read().decode("utf-8")
-    else:
+    if ext not in (".pdf", ".txt"):
         raise ValueError("Unsupported file type. Only .pdf and .txt are allowed.")
 
-    from ingest_chunks import chunk_text, postprocess_text, get_title_summary
-
-    chunks = chunk_text(postprocess_text(text))
-
     slug = Path(filename).stem.replace(" ", "_").lower()
     path_hash = md5(filename.encode()).hexdigest()[:6]
     url = f"{ext[1:]}://{slug}"
 
-    for i, chunk in enumerate(chunks):
-        meta = await get_title_summary(chunk, url)
-        await save_chunk_to_s3(chunk, meta, url, i, "pdf_import", slug, path_hash)
-
-async def process_single_urls(urls: list):
-    crawler = AsyncWebCrawler(config=BrowserConfig(headless=True))
-    await crawler.start()
+    if ext == ".txt":
+        text = file_stream.read().decode("utf-8")
+        chunks = iter_chunks(postprocess_text(p) for p in split_paragraphs(text))
+        await save_chunks_to_s3(chunks, url, "pdf_import", slug, path_hash)
+        return
+
+    # Spool the upload to disk: MuPDF then reads pages lazily from the file instead of
+    # keeping its own copy of the stream, and pool workers can open it by path
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        shutil.copyfileobj(file_stream, tmp)
     try:
-        for url in urls:
-            result = await crawler.arun(url=url, config=CrawlerRunConfig(cache_mode=CacheMode.BYPASS), session_id="single_page")
-            if result.success:
-                await process_and_save_web(url, result.html)
+        await save_chunks_to_s3(iter_pdf_chunks_parallel(tmp.name), url, "pdf_import", slug, path_hash)
     finally:
-        await crawler.close()
+        os.remove(tmp.name)
+
+async def process_single_urls(urls: list):
+    await crawl_urls(urls, process_and_save_web)
 
 async def process_and_save_web(url: str, html: str):
-    text = postprocess_text(BeautifulSoup(html, "html.parser").get_text())
-    chunks = chunk_text(text)
+    text = postprocess_text(extract_page(html)[0])
+    chunks = iter_chunks(text)
     parsed = urlparse(url)
     slug = parsed.netloc.replace(".", "_")
     path_hash = md5(parsed.path.encode()).hexdigest()[:6]
 
-    for i, chunk in enumerate(chunks):
-        meta = await get_title_summary(chunk, url)
-        await save_chunk_to_s3(chunk, meta, url, i, "web_crawl", slug, path_hash)
+    await save_chunks_to_s3(chunks, url, "web_crawl", slug, path_hash)
@@ -3,101 +3,136 @@
 import os
 import json
 import re
+import atexit
+import asyncio
 from pathlib import Path
 from xml.etree import ElementTree
 
 
-import fitz  # PyMuPDF
 import requests
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse
 from hashlib import md5
-from bs4 import BeautifulSoup
-from langdetect import detect
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
-from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
 
-from test_translate import translate_vi_en
+from embedding_batcher import RequestBatcher
+from chunk_pipeline import run_chunk_pipeline
+from chunk_dedup import dedup_index
+from pdf_extract import iter_pdf_chunks_parallel, PDF_FILE_CONCURRENCY
+from text_normalize import postprocess_text
+from html_extract import extract_page, internal_links
+from lang_detect import detect_lang, DocumentLanguage
+from translation import translate_summary
+from chunker import chunk_text, iter_chunks
+from embedding_providers import get_embedding_provider
+from rate_governor import governor, estimate_tokens
+from llm_cache import cache
+from doc_manifest import manifest, file_fingerprint, text_fingerprint
+from chunk_shards import ShardWriter
+from id_allocator import LocalIdAllocator, BlockIdAllocator
+from crawl_pool import crawl_urls
+from crawl_frontier import CrawlFrontier, frontier_path
 
 # ------------------ SETUP ------------------
 
+# Nothing here talks to the network or touches the disk at import time: clients,
+# the chunk directory and the ID counter are set up on first use (app.py and the
+# CLIs import this module just for its functions).
 load_dotenv()
-openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+_openai_client = None
 
 # gemini = ChatGoogleGenerativeAI(model="gemini-1.5-pro", google_api_key=os.getenv("GEMINI_API_KEY"))
 
 CHUNK_DIR = "final_data/qdrant_chunks"
-os.makedirs(CHUNK_DIR, exist_ok=True)
+# shard: append to float32 vector + JSONL payload shards (chunk_shards.py); json: one file per chunk
+CHUNK_FORMAT = os.getenv("CHUNK_FORMAT", "shard")
+_shard_writer = None
+# Near-duplicate index for this pipeline's chunks (batch_jobs.py writes here too)
+dedup = dedup_index("qdrant_chunks")
 
 PDF_DIR = "data"
-GLOBAL_CHUNK_COUNTER = 2727
+CHUNK_ID_TRACKER = "final_data/last_chunk_id.txt"  # shared with ingest_for_app.py
+_id_allocator = None
+
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "8"))
 
 
 # ------------------ UTILITIES ------------------
 
-def clean_html(raw_html: str) -> str:
-    soup = BeautifulSoup(raw_html, "html.parser")
-    for tag in soup(["script", "style", "header", "footer", "nav"]):
-        tag.decompose()
-    return soup.get_text(separator="\n", strip=True)
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        from openai import AsyncOpenAI
+        _openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _openai_client
+
+
+def get_shard_writer() -> ShardWriter:
+    global _shard_writer
+    if _shard_writer is None:
+        _shard_writer = ShardWriter(CHUNK_DIR)
+        atexit.register(_shard_writer.close)
+    return _shard_writer
+
 
+def claim_point_id() -> int:
+    # IDs come from blocks leased under a file lock, so parallel ingest processes never
+    # collide; the floor keeps re-runs above every ID the manifest has already seen
+    global _id_allocator
+    if _id_allocator is None:
+        floor = max(2727, manifest.max_point_id() + 1)
+        _id_allocator = BlockIdAllocator(LocalIdAllocator(CHUNK_ID_TRACKER, floor=floor))
+    return _id_allocator.next_id()
 
-def postprocess_text(text: str) -> str:
-    text = re.sub(r'\\[nrt]', ' ', text)
-    text = re.sub(r'\\+', '', text)
-    text = text.replace('\n', ' ')
-    text = re.sub(r'https?://\S+', '', text)
-    text = re.sub(r'\s{2,}', ' ', text)
-    return text.strip()
 
+SUMMARY_SYSTEM_PROMPT = "Extract a relevant title and concise English summary for this text chunk. Return JSON with 'title' and 'summary'."
 
-def chunk_text(text: str, chunk_size: int = 3000, overlap: int = 200) -> list:
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        start += chunk_size - overlap
-    return chunks
+
+def summary_prompt(chunk: str, url: str) -> str:
+    return f"URL: {url}\n\nContent:\n{chunk[:1000]}..."
 
 
 async def get_title_summary(chunk: str, url: str) -> dict:
-    system_prompt = "Extract a relevant title and concise English summary for this text chunk. Return JSON with 'title' and 'summary'."
+    system_prompt = SUMMARY_SYSTEM_PROMPT
+    model = os.getenv("LLM_MODEL", "gpt-4o-mini")
+    user_prompt = summary_prompt(chunk, url)
+    cached = await cache.aget_json(model, system_prompt + "\n" + user_prompt)
+    if cached is not None:
+        return cached
     try:
-        response = await openai_client.chat.completions.create(
-            model=os.getenv("LLM_MODEL", "gpt-4o-mini"),
+        response = await governor.call("openai", model, lambda: get_openai_client().chat.completions.create(
+            model=model,
             messages=[
                 {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"URL: {url}\n\nContent:\n{chunk[:1000]}..."}
+                {"role": "user", "content": user_prompt}
             ],
             response_format={"type": "json_object"}
-        )
-        return json.loads(response.choices[0].message.content)
+        ), est_tokens=estimate_tokens(system_prompt + user_prompt) + 300)
+        meta = json.loads(response.choices[0].message.content)
+        await cache.aput_json(model, system_prompt + "\n" + user_prompt, meta)
+        return meta
     except Exception as e:
         print(f"❌ GPT summary error: {e}")
         return {"title": "Error", "summary": chunk[:100]}
 
 
+embedding_provider = get_embedding_provider()
+EMBEDDING_MODEL = embedding_provider.model
+embedding_batcher = RequestBatcher(embedding_provider.embed_many)
+
+
 async def get_embedding(text: str) -> list:
+    cached = await cache.aget_vector(EMBEDDING_MODEL, text)
+    if cached is not None:
+        return cached
     try:
-        response = await openai_client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text
-        )
-        return response.data[0].embedding
+        vector = await embedding_batcher.submit(text)
+        await cache.aput_vector(EMBEDDING_MODEL, text, vector)
+        return vector
     except Exception as e:
         print(f"❌ Embedding error: {e}")
-        return [0.0] * 1536
+        return [0.0] * embedding_provider.dimension
 
 
-def detect_lang(text: str) -> str:
-    try:
-        return detect(text)
-    except:
-        return "en"
-
 def clean_id(text):
     return re.sub(r'[^a-zA-Z0-9_-]+', '_', text).strip('_')
 
@@ -112,21 +147,22 @@ def clean_id(text):
 
 # ------------------ MAIN SAVE FUNCTION ------------------
 
-async def save_chunk(chunk: str, meta: dict, url: str, chunk_number: int, source: str, slug: str, path_hash: str):
-    global GLOBAL_CHUNK_COUNTER
-    chunk_id = clean_id(f"{slug}_{path_hash}_chunk{GLOBAL_CHUNK_COUNTER}")
+async def save_chunk(chunk: str, meta: dict, url: str, chunk_number: int, source: str, slug: str, path_hash: str,
+                     extra: dict = None, vector: list = None, lang: str = None):
+    # Take the ID before the first await so concurrent chunks never share one
+    point_id = claim_point_id()
+    chunk_id = clean_id(f"{slug}_{path_hash}_chunk{point_id}")
     # chunk_id = f"{slug}_{path_hash}_chunk{GLOBAL_CHUNK_COUNTER}"
-    vector = await get_embedding(meta["summary"] + " " + chunk)
-    lang = detect_lang(chunk)
-    # translated_summary = meta["summary"] if lang == "en" else "[Vietnamese Translation Needed]"
-    if lang == "vi":
-        translated_summary = translate_vi_en(meta["summary"])
-    else:
-        translated_summary = meta["summary"]
+    lang = lang or detect_lang(chunk)
+    # Translation is batched across chunks and runs while the embedding is fetched
+    translation = asyncio.ensure_future(translate_summary(meta["summary"], lang))
+    if vector is None:
+        vector = await get_embedding(meta["summary"] + " " + chunk)
+    translated_summary = await translation
 
     parsed = urlparse(url)
     json_obj = {
-        "id": GLOBAL_CHUNK_COUNTER, #chunk_id,
+        "id": point_id, #chunk_id,
         "vector": vector,
         "payload": {
             "title": meta["title"],
@@ -141,27 +177,53 @@ async def save_chunk(chunk: str, meta: dict, url: str, chunk_number: int, source
             "chunk_id": chunk_id
         }
     }
+    if extra:
+        json_obj["payload"].update(extra)
+
+    if CHUNK_FORMAT == "shard":
+        ref = get_shard_writer().append(point_id, vector, json_obj["payload"])
+        print(f"✅ Saved: {chunk_id} -> {ref}")
+        return point_id, ref
 
+    os.makedirs(CHUNK_DIR, exist_ok=True)
     outpath = os.path.join(CHUNK_DIR, f"{chunk_id}.json")
     with open(outpath, "w", encoding="utf-8") as f:
         json.dump(json_obj, f, ensure_ascii=False, indent=2)
     print(f"✅ Saved: {outpath.replace('\\', '/')}")
-    GLOBAL_CHUNK_COUNTER += 1
+    return point_id, outpath
+
+
+async def save_chunks(chunk_iter, url: str, source: str, slug: str, path_hash: str):
+    # Summaries and embeddings for a document run concurrently so the embedding
+    # batcher can pack them into a few list requests instead of one call per chunk.
+    doc_lang = DocumentLanguage()
+    orphaned = await asyncio.to_thread(dedup.begin_document, url)
+    await asyncio.to_thread(manifest.forget, orphaned)
+    return await run_chunk_pipeline(
+        chunk_iter,
+        lambda chunk: get_title_summary(chunk, url),
+        lambda i, chunk, meta, extra: save_chunk(chunk, meta, url, i, source, slug, path_hash, extra=extra,
+                                                 lang=doc_lang.detect(chunk)),
+        SUMMARY_CONCURRENCY,
+        admit=lambda i, chunk: dedup.admit(url, i, chunk),
+        stored=lambda i, chunk: dedup.stored(url, i, chunk))
 
 
 # ------------------ PDF PARSER ------------------
 
 async def process_pdf_file(filepath: str):
-    doc = fitz.open(filepath)
-    text = "\n".join([page.get_text() for page in doc])
-    clean = postprocess_text(text)
-    chunks = chunk_text(clean)
     slug = Path(filepath).stem.replace(" ", "_").lower()
     path_hash = md5(filepath.encode()).hexdigest()[:6]
     url = f"pdf://{slug}"
-    for i, chunk in enumerate(chunks):
-        meta = await get_title_summary(chunk, url)
-        await save_chunk(chunk, meta, url, i, "pdf_import", slug, path_hash)
+    fingerprint = await asyncio.to_thread(file_fingerprint, filepath)
+    if await asyncio.to_thread(manifest.is_unchanged, url, fingerprint):
+        print(f"⏭ Unchanged, skipping: {filepath}")
+        return
+
+    # Page ranges are extracted and chunked in the process pool; each chunk records its pages
+    saved = await save_chunks(iter_pdf_chunks_parallel(filepath), url, "pdf_import", slug, path_hash)
+    await asyncio.to_thread(manifest.replace, url, fingerprint, [pid for pid, _ in saved],
+                            [path for _, path in saved])
 
 
 async def process_all_pdfs(pdf_dir: str = PDF_DIR):
@@ -172,57 +234,60 @@ async def process_all_pdfs(pdf_dir: str = PDF_DIR):
         print("⚠️  No PDF files found.\n")
         return
 
-    for file in pdf_files:
-        print(f"📘 Processing PDF: {file}")
-        filepath = os.path.join(pdf_dir, file)
-        await process_pdf_file(filepath)
+    # Several files in flight keep the extraction pool busy while earlier files wait on the API
+    limit = asyncio.Semaphore(PDF_FILE_CONCURRENCY)
+
+    async def process(file):
+        async with limit:
+            print(f"📘 Processing PDF: {file}")
+            await process_pdf_file(os.path.join(pdf_dir, file))
+
+    await asyncio.gather(*(process(file) for file in pdf_files))
     print(f"\n✅ Finished processing {len(pdf_files)} PDF files.\n")
 
 
 # ------------------ WEBSITE ------------------
 
-async def process_and_save_web(url: str, html: str):
-    clean = postprocess_text(clean_html(html))
-    chunks = chunk_text(clean)
+async def process_and_save_web(url: str, html: str) -> list:
+    # Returns the page's outbound links so crawl_recursive does not parse the page again
+    text, links = extract_page(html, url)
+    clean = postprocess_text(text)
+    fingerprint = text_fingerprint(clean)
+    if await asyncio.to_thread(manifest.is_unchanged, url, fingerprint):
+        print(f"⏭ Unchanged, skipping: {url}")
+        return links
+
+    chunks = iter_chunks(clean)
     parsed = urlparse(url)
     slug = parsed.netloc.replace(".", "_")
     path_hash = md5(parsed.path.encode()).hexdigest()[:6]
-    for i, chunk in enumerate(chunks):
-        meta = await get_title_summary(chunk, url)
-        await save_chunk(chunk, meta, url, i, "web_crawl", slug, path_hash)
+    saved = await save_chunks(chunks, url, "web_crawl", slug, path_hash)
+    await asyncio.to_thread(manifest.replace, url, fingerprint, [pid for pid, _ in saved],
+                            [path for _, path in saved])
+    return links
 
 
-async def crawl_single_page(urls: list):
-    crawler = AsyncWebCrawler(config=BrowserConfig(headless=True))
-    config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS)
-    await crawler.start()
-    try:
-        for url in urls:
-            result = await crawler.arun(url=url, config=config, session_id="single_page")
-            if result.success:
-                await process_and_save_web(url, result.html)
-    finally:
-        await crawler.close()
+async def crawl_single_page(urls: list, handle=None):
+    # handle(url, html) defaults to summarizing/embedding right away; batch_jobs.py defers it.
+    # Pages are fetched concurrently with per-host limits while earlier ones are processed (crawl_pool.py)
+    await crawl_urls(urls, handle or process_and_save_web)
+
 
+async def crawl_recursive(seed_url: str, max_depth: int = 2, persist: bool = False):
+    # persist: keep the frontier in CRAWL_FRONTIER_DIR, so an interrupted crawl of the
+    # same seed resumes where it stopped instead of starting over
+    frontier = CrawlFrontier(max_depth, db_path=frontier_path(seed_url) if persist else None)
+    frontier.push(seed_url, 0)
+
+    async def handle(url, html):
+        links = internal_links(await process_and_save_web(url, html), url)
+        frontier.push_many(links, frontier.depth_of(url) + 1)
 
-async def crawl_recursive(seed_url: str, max_depth: int = 2):
-    visited, to_visit = set(), [(seed_url, 0)]
-    crawler = AsyncWebCrawler(config=BrowserConfig(headless=True))
-    await crawler.start()
     try:
-        while to_visit:
-            url, depth = to_visit.pop(0)
-            if url in visited or depth > max_depth:
-                continue
-            result = await crawler.arun(url=url, config=CrawlerRunConfig(cache_mode=CacheMode.BYPASS),
-                                        session_id="recursive")
-            if result.success:
-                await process_and_save_web(url, result.html)
-                links = extract_internal_links(result.html, url)
-                to_visit.extend([(l, depth + 1) for l in links if l not in visited])
-                visited.add(url)
+        await crawl_urls([], handle, frontier=frontier)
     finally:
-        await crawler.close()
+        frontier.close()
+    print(f"🧭 Frontier: {dict(frontier.stats)}")
 
 def get_urls_from_sitemap(sitemap_url: str, seen=None):
     if seen is None:
@@ -247,24 +312,16 @@ def get_urls_from_sitemap(sitemap_url: str, seen=None):
     return urls
 
 
-def extract_internal_links(html: str, base_url: str):
-    soup = BeautifulSoup(html, "html.parser")
-    base_domain = urlparse(base_url).netloc
-    internal_links = set()
-    for a in soup.find_all("a", href=True):
-        href = a["href"]
-        if (href.startswith("/") or base_domain in href) and ":" not in href and "#" not in href:
-            full_url = urljoin(base_url, href)
-            if urlparse(full_url).netloc == base_domain:
-                internal_links.add(full_url)
-    return list(internal_links)
-
 # ------------------ MAIN ------------------
 
 if __name__ == "__main__":
+    import sys
     import time
     import asyncio
 
+    # --deferred: write the sitemap phase as OpenAI batch jobs instead (see batch_jobs.py)
+    DEFERRED = "--deferred" in sys.argv
+
     sitemap_urls = [
          "https://khuyennongvn.gov.vn/sitemap.xml",
          "https://viegoglobal.com/category-sitemap.xml"
@@ -302,7 +359,7 @@ if __name__ == "__main__":
             print(f"🌐 Phase 2: Crawling recursively from seed URLs...")
             for url in recursive_urls:
                 print(f"🔁 Crawling recursively from: {url}")
-                await crawl_recursive(url, max_depth=2)
+                await crawl_recursive(url, max_depth=2, persist=True)
             print("✅ Phase 2 complete\n")
 
         # Phase 3: Sitemap parsing
@@ -315,12 +372,18 @@ if __name__ == "__main__":
         print(f"📦 Collected {len(all_sitemap_urls)} total URLs from sitemaps\n")
 
         # Phase 4: Sitemap-based crawling
-        if all_sitemap_urls:
+        if all_sitemap_urls and DEFERRED:
+            from batch_jobs import prepare_jobs
+            print(f"🗂️ Phase 4 (deferred): Writing batch jobs for {len(all_sitemap_urls)} sitemap URLs...")
+            await prepare_jobs(all_sitemap_urls)
+            print("✅ Phase 4 requests written. Run `python batch_jobs.py finish` once results are in.\n")
+        elif all_sitemap_urls:
             print(f"🤖 Phase 4: Crawling {len(all_sitemap_urls)} sitemap URLs...")
             await crawl_single_page(all_sitemap_urls)
             print("✅ Phase 4 complete\n")
 
 
+        print(f"💾 Summary/embedding cache: {cache.stats()}")
         print("🎯 All ingestion phases completed. Ready for Qdrant upload or querying.\n")
 
 
@@ -1,120 +1,125 @@
-# ingest_chunks.py
+# ingest_for_app.py
 
 import os
 import json
 import re
+import asyncio
 from pathlib import Path
 from urllib.parse import urlparse
 from hashlib import md5
-import fitz  # PyMuPDF
-from bs4 import BeautifulSoup
-from langdetect import detect
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
-from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
 
-from test_translate import translate_vi_en
+from embedding_batcher import RequestBatcher
+from chunk_pipeline import run_chunk_pipeline
+from chunk_dedup import dedup_index
+from pdf_extract import iter_pdf_chunks_parallel, PDF_FILE_CONCURRENCY
+from text_normalize import postprocess_text
+from html_extract import extract_page
+from lang_detect import detect_lang, DocumentLanguage
+from translation import translate_summary
+from chunker import iter_chunks
+from embedding_providers import get_embedding_provider
+from rate_governor import governor, estimate_tokens
+from llm_cache import cache
+from id_allocator import LocalIdAllocator, BlockIdAllocator
+from crawl_pool import crawl_urls
 
 # Load env vars
 load_dotenv()
-openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+_openai_client = None  # created on first use, like the directories and the ID counter
+_embedding_provider = None
+_embedding_batcher = None
 
 # Paths and globals
 CHUNK_DIR = "final_data/app_qdrant_chunks"
+dedup = dedup_index("app_chunks")
 PDF_DIR = "data"
-os.makedirs(CHUNK_DIR, exist_ok=True)
-os.makedirs(PDF_DIR, exist_ok=True)
 
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "8"))
 
-CHUNK_ID_TRACKER = "final_data/last_chunk_id.txt"
-
-def get_next_global_chunk_id():
-    if os.path.exists(CHUNK_ID_TRACKER):
-        with open(CHUNK_ID_TRACKER, "r") as f:
-            try:
-                return int(f.read().strip()) + 1
-            except:
-                return 0
-    return 0
-
-def save_global_chunk_id(val):
-    with open(CHUNK_ID_TRACKER, "w") as f:
-        f.write(str(val))
 
-GLOBAL_CHUNK_COUNTER = get_next_global_chunk_id()
+# Highest point ID leased so far; IDs are leased in blocks, not written back per chunk
+CHUNK_ID_TRACKER = "final_data/last_chunk_id.txt"
+_id_allocator = None
 
 
 # -------------------- UTILS --------------------
-def clean_html(raw_html: str) -> str:
-    soup = BeautifulSoup(raw_html, "html.parser")
-    for tag in soup(["script", "style", "header", "footer", "nav"]):
-        tag.decompose()
-    return soup.get_text(separator="\n", strip=True)
-
-def postprocess_text(text: str) -> str:
-    text = re.sub(r'\\[nrt]', ' ', text)
-    text = re.sub(r'\\+', '', text)
-    text = text.replace('\n', ' ')
-    text = re.sub(r'https?://\S+', '', text)
-    text = re.sub(r'\s{2,}', ' ', text)
-    return text.strip()
-
-def chunk_text(text: str, chunk_size: int = 3000, overlap: int = 200) -> list:
-    chunks, start = [], 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        start += chunk_size - overlap
-    return chunks
-
-def detect_lang(text: str) -> str:
-    try:
-        return detect(text)
-    except:
-        return "en"
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        from openai import AsyncOpenAI
+        _openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _openai_client
+
+def get_embedder():
+    global _embedding_provider
+    if _embedding_provider is None:
+        _embedding_provider = get_embedding_provider()
+    return _embedding_provider
+
+def get_embedding_batcher() -> RequestBatcher:
+    global _embedding_batcher
+    if _embedding_batcher is None:
+        _embedding_batcher = RequestBatcher(get_embedder().embed_many)
+    return _embedding_batcher
+
+def claim_point_id() -> int:
+    global _id_allocator
+    if _id_allocator is None:
+        _id_allocator = BlockIdAllocator(LocalIdAllocator(CHUNK_ID_TRACKER))
+    return _id_allocator.next_id()
 
 def clean_id(text):
     return re.sub(r'[^a-zA-Z0-9_-]+', '_', text).strip('_')
 
 async def get_title_summary(chunk: str, url: str) -> dict:
     system_prompt = "Extract a relevant title and concise English summary for this text chunk. Return JSON with 'title' and 'summary'."
+    model = os.getenv("LLM_MODEL", "gpt-4o-mini")
+    user_prompt = f"URL: {url}\n\nContent:\n{chunk[:1000]}..."
+    cached = await cache.aget_json(model, system_prompt + "\n" + user_prompt)
+    if cached is not None:
+        return cached
     try:
-        response = await openai_client.chat.completions.create(
-            model=os.getenv("LLM_MODEL", "gpt-4o-mini"),
+        response = await governor.call("openai", model, lambda: get_openai_client().chat.completions.create(
+            model=model,
             messages=[
                 {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"URL: {url}\n\nContent:\n{chunk[:1000]}..."}
+                {"role": "user", "content": user_prompt}
             ],
             response_format={"type": "json_object"}
-        )
-        return json.loads(response.choices[0].message.content)
+        ), est_tokens=estimate_tokens(system_prompt + user_prompt) + 300)
+        meta = json.loads(response.choices[0].message.content)
+        await cache.aput_json(model, system_prompt + "\n" + user_prompt, meta)
+        return meta
     except Exception as e:
         print(f"❌ GPT summary error: {e}")
         return {"title": "Error", "summary": chunk[:100]}
 
 async def get_embedding(text: str) -> list:
+    embedder = get_embedder()
+    cached = await cache.aget_vector(embedder.model, text)
+    if cached is not None:
+        return cached
     try:
-        response = await openai_client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text
-        )
-        return response.data[0].embedding
+        vector = await get_embedding_batcher().submit(text)
+        await cache.aput_vector(embedder.model, text, vector)
+        return vector
     except Exception as e:
         print(f"❌ Embedding error: {e}")
-        return [0.0] * 1536
-
-async def save_chunk(chunk: str, meta: dict, url: str, chunk_number: int, source: str, slug: str, path_hash: str):
-    global GLOBAL_CHUNK_COUNTER
-    chunk_id = clean_id(f"{slug}_{path_hash}_chunk{GLOBAL_CHUNK_COUNTER}")
-    vector = await get_embedding(meta["summary"] + " " + chunk)
-    lang = detect_lang(chunk)
-    translated_summary = translate_vi_en(meta["summary"]) if lang == "vi" else meta["summary"]
+        return [0.0] * embedder.dimension
+
+async def save_chunk(chunk: str, meta: dict, url: str, chunk_number: int, source: str, slug: str, path_hash: str,
+                     extra: dict = None, lang: str = None):
+    # Take the ID before the first await so concurrent chunks never share one
+    point_id = claim_point_id()
+    chunk_id = clean_id(f"{slug}_{path_hash}_chunk{point_id}")
+    lang = lang or detect_lang(chunk)
+    vector, translated_summary = await asyncio.gather(get_embedding(meta["summary"] + " " + chunk),
+                                                      translate_summary(meta["summary"], lang))
     parsed = urlparse(url)
 
     json_obj = {
-        "id": GLOBAL_CHUNK_COUNTER,
+        "id": point_id,
         "vector": vector,
         "payload": {
             "title": meta["title"],
@@ -129,49 +134,53 @@ async def save_chunk(chunk: str, meta: dict, url: str, chunk_number: int, source
             "chunk_id": chunk_id
         }
     }
+    if extra:
+        json_obj["payload"].update(extra)
 
+    os.makedirs(CHUNK_DIR, exist_ok=True)
     outpath = os.path.join(CHUNK_DIR, f"{chunk_id}.json")
     with open(outpath, "w", encoding="utf-8") as f:
         json.dump(json_obj, f, ensure_ascii=False, indent=2)
     print(f"✅ Saved: {outpath.replace('\\', '/')}")
-    GLOBAL_CHUNK_COUNTER += 1
-    save_global_chunk_id(GLOBAL_CHUNK_COUNTER)
+
+async def save_chunks(chunk_iter, url: str, source: str, slug: str, path_hash: str):
+    # Run a document's chunks concurrently so get_embedding calls share list requests
+    doc_lang = DocumentLanguage()
+    # App sessions never delete a document's earlier points, so shared chunks stay canonical
+    await asyncio.to_thread(dedup.begin_document, url, keep_shared=True)
+    return await run_chunk_pipeline(
+        chunk_iter,
+        lambda chunk: get_title_summary(chunk, url),
+        lambda i, chunk, meta, extra: save_chunk(chunk, meta, url, i, source, slug, path_hash, extra=extra,
+                                                 lang=doc_lang.detect(chunk)),
+        SUMMARY_CONCURRENCY,
+        admit=lambda i, chunk: dedup.admit(url, i, chunk),
+        stored=lambda i, chunk: dedup.stored(url, i, chunk))
 
 
 # -------------------- PUBLIC FUNCTIONS --------------------
 async def process_pdf_file(filepath: str):
-    doc = fitz.open(filepath)
-    text = "\n".join([page.get_text() for page in doc])
-    chunks = chunk_text(postprocess_text(text))
     slug = Path(filepath).stem.replace(" ", "_").lower()
     path_hash = md5(filepath.encode()).hexdigest()[:6]
     url = f"pdf://{slug}"
-    for i, chunk in enumerate(chunks):
-        meta = await get_title_summary(chunk, url)
-        await save_chunk(chunk, meta, url, i, "pdf_import", slug, path_hash)
+    await save_chunks(iter_pdf_chunks_parallel(filepath), url, "pdf_import", slug, path_hash)
 
 async def process_multiple_pdfs(pdf_paths: list):
-    for path in pdf_paths:
-        await process_pdf_file(path)
+    limit = asyncio.Semaphore(PDF_FILE_CONCURRENCY)
+
+    async def process(path):
+        async with limit:
+            await process_pdf_file(path)
+
+    await asyncio.gather(*(process(path) for path in pdf_paths))
 
 async def process_single_urls(urls: list):
-    crawler = AsyncWebCrawler(config=BrowserConfig(headless=True))
-    await crawler.start()
-    try:
-        for url in urls:
-            result = await crawler.arun(url=url, config=CrawlerRunConfig(cache_mode=CacheMode.BYPASS),
-                                        session_id="single_page")
-            if result.success:
-                await process_and_save_web(url, result.html)
-    finally:
-        await crawler.close()
+    await crawl_urls(urls, process_and_save_web)
 
 async def process_and_save_web(url: str, html: str):
-    clean = postprocess_text(clean_html(html))
-    chunks = chunk_text(clean)
+    clean = postprocess_text(extract_page(html)[0])
+    chunks = iter_chunks(clean)
     parsed = urlparse(url)
     slug = parsed.netloc.replace(".", "_")
     path_hash = md5(parsed.path.encode()).hexdigest()[:6]
-    for i, chunk in enumerate(chunks):
-        meta = await get_title_summary(chunk, url)
-        await save_chunk(chunk, meta, url, i, "web_crawl", slug, path_hash)
+    await save_chunks(chunks, url, "web_crawl", slug, path_hash)
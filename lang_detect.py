@@ -0,0 +1,74 @@
+# lang_detect.py
+# Deterministic language detection, decided once per document.
+#
+# langdetect is randomized (a different answer on each run for short or mixed
+# text) and slow, and used to run on every chunk. Here it is seeded, looks at a
+# bounded sample, and caches results. DocumentLanguage detects the document once
+# and only re-runs langdetect on chunks whose Vietnamese diacritic density
+# clearly disagrees with the document language (e.g. an English abstract in a
+# Vietnamese report).
+
+import os
+import re
+from functools import lru_cache
+
+from langdetect import detect, DetectorFactory, LangDetectException
+
+LANG_SAMPLE_CHARS = int(os.getenv("LANG_SAMPLE_CHARS", "2000"))
+LANG_SEED = 0
+DEFAULT_LANG = "en"
+
+# Letters that only Vietnamese uses among the languages we ingest (ă â đ ê ô ơ ư + tone marks)
+_VI_CHARS = re.compile(r"[ăâđêôơưĂÂĐÊÔƠƯàảãáạằẳẵắặầẩẫấậèẻẽéẹềểễếệìỉĩíịòỏõóọồổỗốộờởỡớợùủũúụừửữứựỳỷỹýỵ"
+                       r"ÀẢÃÁẠẰẲẴẮẶẦẨẪẤẬÈẺẼÉẸỀỂỄẾỆÌỈĨÍỊÒỎÕÓỌỒỔỖỐỘỜỞỠỚỢÙỦŨÚỤỪỬỮỨỰỲỶỸÝỴ]")
+_LETTERS = re.compile(r"[^\W\d_]")
+VI_DENSE = 0.05   # share of letters; ordinary Vietnamese prose is ~0.2-0.3
+VI_SPARSE = 0.01  # below this a chunk is not Vietnamese prose (names, citations at most)
+
+DetectorFactory.seed = LANG_SEED  # every Detector copies the factory seed
+
+
+def sample_text(text: str, size: int = LANG_SAMPLE_CHARS) -> str:
+    # Start, middle and end of the text so one odd section does not decide the result
+    if len(text) <= size:
+        return text
+    part = size // 3
+    middle = (len(text) - part) // 2
+    return " ".join((text[:part], text[middle:middle + part], text[-part:]))
+
+
+def vietnamese_density(text: str) -> float:
+    letters = len(_LETTERS.findall(text))
+    return len(_VI_CHARS.findall(text)) / letters if letters else 0.0
+
+
+@lru_cache(maxsize=8192)
+def _detect_sample(sample: str) -> str:
+    try:
+        return detect(sample)
+    except LangDetectException:
+        return DEFAULT_LANG
+
+
+def detect_lang(text: str) -> str:
+    return _detect_sample(sample_text(text))
+
+
+class DocumentLanguage:
+    # One per document: the first chunk (or an explicit sample) sets the language
+    def __init__(self, text: str = None):
+        self.lang = detect_lang(text) if text else None
+
+    def _disagrees(self, chunk: str) -> bool:
+        density = vietnamese_density(chunk)
+        if self.lang == "vi":
+            return density < VI_SPARSE
+        return density > VI_DENSE
+
+    def detect(self, chunk: str) -> str:
+        if self.lang is None:
+            self.lang = detect_lang(chunk)
+            return self.lang
+        if self._disagrees(chunk):
+            return detect_lang(chunk)
+        return self.lang
@@ -0,0 +1,128 @@
+# llm_cache.py
+# Persistent content-addressed cache for summaries and embeddings, keyed by
+# sha256(model, input text). SQLite under final_data/, size-bounded with LRU eviction.
+# The a*-methods run the lookups in a worker thread, for callers on an event loop.
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from array import array
+from hashlib import sha256
+
+CACHE_DB = os.getenv("LLM_CACHE_DB", "final_data/llm_cache.sqlite")
+CACHE_MAX_BYTES = int(float(os.getenv("LLM_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+EVICT_CHECK_EVERY = 200  # puts between size checks
+ACCESS_RESOLUTION = 3600  # seconds; a hit rewrites last_access only when it is older than this
+
+
+def cache_key(model: str, text: str) -> str:
+    return sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class ContentCache:
+    def __init__(self, db_path: str = CACHE_DB, max_bytes: int = CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, kind TEXT, value BLOB, size INTEGER, last_access REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            conn.commit()
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _get(self, kind: str, model: str, text: str):
+        key = cache_key(model, text)
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value, last_access FROM entries WHERE key = ? AND kind = ?",
+                               (key, kind)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if now - row[1] > ACCESS_RESOLUTION:  # LRU order only needs coarse times
+                conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def _put(self, kind: str, model: str, text: str, value: bytes):
+        key = cache_key(model, text)
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                         (key, kind, value, len(value), time.time()))
+            conn.commit()
+            self._puts += 1
+            if self._puts % EVICT_CHECK_EVERY == 0:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until we are back under 90% of the budget
+        target = total - int(self.max_bytes * 0.9)
+        freed, doomed = 0, []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            doomed.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+        conn.commit()
+        print(f"🧹 Cache evicted {len(doomed)} entries ({freed // 1024} KB)")
+
+    def get_json(self, model: str, prompt: str):
+        value = self._get("json", model, prompt)
+        return None if value is None else json.loads(value)
+
+    def put_json(self, model: str, prompt: str, obj):
+        self._put("json", model, prompt, json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+    def get_vector(self, model: str, text: str):
+        value = self._get("vector", model, text)
+        if value is None:
+            return None
+        vector = array("f")
+        vector.frombytes(value)
+        return vector.tolist()
+
+    def put_vector(self, model: str, text: str, vector: list):
+        self._put("vector", model, text, array("f", vector).tobytes())
+
+    async def aget_json(self, model: str, prompt: str):
+        return await asyncio.to_thread(self.get_json, model, prompt)
+
+    async def aput_json(self, model: str, prompt: str, obj):
+        await asyncio.to_thread(self.put_json, model, prompt, obj)
+
+    async def aget_vector(self, model: str, text: str):
+        return await asyncio.to_thread(self.get_vector, model, text)
+
+    async def aput_vector(self, model: str, text: str, vector: list):
+        await asyncio.to_thread(self.put_vector, model, text, vector)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0.0
+        return f"{self.hits} hits / {self.misses} misses ({rate:.1f}% hit rate)"
+
+
+cache = ContentCache()
@@ -0,0 +1,73 @@
+# pdf_extract.py
+# Runs the CPU-bound part of PDF ingestion (page.get_text, postprocess_text,
+# chunking) in a process pool. Large files are split into page ranges so one
+# big PDF also spreads over all cores; chunks stream back to the event loop
+# range by range, in page order.
+
+import os
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+from pdf_stream import iter_pdf_chunks
+from text_normalize import postprocess_text
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "50"))
+PDF_FILE_CONCURRENCY = int(os.getenv("PDF_FILE_CONCURRENCY", "4"))
+
+_executor = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=max(1, PDF_WORKERS))
+    return _executor
+
+
+def extract_page_range(filepath: str, start: int, stop: int) -> list:
+    # Worker: (chunk, {"page_start", "page_end"}) for pages [start, stop).
+    # Chunks do not span range boundaries.
+    doc = fitz.open(filepath)
+    try:
+        return list(iter_pdf_chunks(doc, postprocess_text, start, stop))
+    finally:
+        doc.close()
+
+
+def page_ranges(page_count: int, pages_per_task: int = PDF_PAGES_PER_TASK) -> list:
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+
+async def iter_pdf_chunks_parallel(filepath: str, ahead: int = None):
+    # Async generator over a file's chunks. Keeps at most `ahead` page ranges queued
+    # in the pool so a huge document does not pile up finished chunks in memory.
+    loop = asyncio.get_running_loop()
+    ahead = ahead or max(2, PDF_WORKERS)
+    doc = fitz.open(filepath)
+    page_count = doc.page_count
+    doc.close()
+
+    ranges = deque(page_ranges(page_count))
+    window = deque()
+
+    def submit():
+        start, stop = ranges.popleft()
+        window.append(loop.run_in_executor(get_executor(), extract_page_range, filepath, start, stop))
+
+    try:
+        while ranges and len(window) < ahead:
+            submit()
+        while window:
+            chunks = await window.popleft()
+            if ranges:
+                submit()
+            for item in chunks:
+                yield item
+    finally:
+        # Consumer stopped early or failed: ranges not started yet are dropped from the pool
+        for future in window:
+            future.cancel()
@@ -0,0 +1,50 @@
+# pdf_stream.py
+# Page-at-a-time PDF text for the chunker. Only the current page (plus a
+# paragraph cut by the page break) is held in memory, instead of the
+# "\n".join(all pages) string, and every chunk knows which pages it came from.
+
+import re
+
+from chunker import iter_spanned_chunks, split_paragraphs
+
+_SENTENCE_CLOSED = re.compile(r'[.!?…:]["”’)\]]*\s*$')
+MAX_CARRY_CHARS = 20_000  # pages without sentence ends (tables, figures) are not carried forever
+
+
+def iter_pdf_pages(doc, start: int = 0, stop: int = None):
+    # -> (1-based page number, raw page text)
+    stop = doc.page_count if stop is None else min(stop, doc.page_count)
+    for index in range(start, stop):
+        yield index + 1, doc.load_page(index).get_text()
+
+
+def iter_page_paragraphs(pages, normalize):
+    # -> (normalized paragraph, (first_page, last_page)); a paragraph that runs over a
+    # page break is joined with the start of the next page instead of being cut in two
+    carry, carry_span = "", None
+    for page_number, text in pages:
+        paragraphs = [p for p in (normalize(p) for p in split_paragraphs(text)) if p]
+        if not paragraphs:
+            continue
+        spans = [(page_number, page_number)] * len(paragraphs)
+        if carry:
+            paragraphs[0] = carry + " " + paragraphs[0]
+            spans[0] = (carry_span[0], page_number)
+            carry, carry_span = "", None
+
+        for paragraph, span in zip(paragraphs[:-1], spans[:-1]):
+            yield paragraph, span
+        if _SENTENCE_CLOSED.search(paragraphs[-1]) or len(paragraphs[-1]) > MAX_CARRY_CHARS:
+            yield paragraphs[-1], spans[-1]
+        else:
+            carry, carry_span = paragraphs[-1], spans[-1]
+
+    if carry:
+        yield carry, carry_span
+
+
+def iter_pdf_chunks(doc, normalize, start: int = 0, stop: int = None):
+    # -> (chunk, {"page_start", "page_end"}) ready for save_chunks()
+    paragraphs = iter_page_paragraphs(iter_pdf_pages(doc, start, stop), normalize)
+    for chunk, (first, last) in iter_spanned_chunks(paragraphs):
+        yield chunk, {"page_start": first, "page_end": last}
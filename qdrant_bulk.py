@@ -0,0 +1,212 @@
+# qdrant_bulk.py
+# Bulk loads behind a collection alias, so a full reindex never touches the
+# collection the app is serving from.
+#
+#   1. create <alias>_<timestamp> from the profile with HNSW indexing off
+#      (indexing_threshold=0: points are stored, no graph is built while writing)
+#   2. load it, usually starting from a copy of the live collection
+#   3. turn indexing back on and wait until the optimizers are done and stay done
+#      (status green, optimizer ok, indexed vector count unchanged between polls)
+#   4. check the point count, then repoint the alias in one update_collection_aliases call
+#   5. drop older <alias>_<timestamp> collections, keeping BULK_KEEP_OLD for rollback
+#
+# The app and the uploaders keep using QDRANT_COLLECTION_NAME, which has to be an
+# alias for this. A plain collection of that name can't be replaced without a gap, so
+# bulk loads refuse to start until it has been converted once, at a quiet moment:
+#
+#   python qdrant_bulk.py migrate [--collection NAME]
+#
+# Writes that go to the live alias while a bulk load runs land in the old collection
+# and are lost at the swap: pause other uploaders, or re-run them after the load.
+
+import os
+import re
+import time
+from qdrant_client import models
+
+from qdrant_profiles import create_collection, QDRANT_PROFILE
+
+BULK_INDEXING_THRESHOLD = int(os.getenv("BULK_INDEXING_THRESHOLD", "20000"))  # KB, Qdrant's default
+BULK_OPTIMIZE_TIMEOUT = int(os.getenv("BULK_OPTIMIZE_TIMEOUT", "3600"))  # seconds
+BULK_KEEP_OLD = int(os.getenv("BULK_KEEP_OLD", "1"))
+BULK_COPY_BATCH = 256
+BULK_POLL_SECONDS = 5
+BULK_STABLE_POLLS = 3  # consecutive settled polls before the index counts as built
+
+
+def alias_target(client, alias: str):
+    # -> the collection the alias points to, or None
+    for a in client.get_aliases().aliases:
+        if a.alias_name == alias:
+            return a.collection_name
+    return None
+
+
+def collection_or_alias_exists(client, name: str) -> bool:
+    return alias_target(client, name) is not None or client.collection_exists(name)
+
+
+def require_alias(client, alias: str):
+    # Checked before a bulk load starts, not when it is about to be published
+    if alias_target(client, alias) is None and client.collection_exists(alias):
+        raise RuntimeError(f"{alias} is a collection, not an alias; bulk loads can't replace it without "
+                           f"downtime. Convert it once with: python qdrant_bulk.py migrate --collection {alias}")
+
+
+def start_shadow(client, alias: str, dimension: int, distance: str, profile_name: str = QDRANT_PROFILE) -> str:
+    shadow = f"{alias}_{time.strftime('%Y%m%d_%H%M%S')}"
+    while client.collection_exists(shadow):  # two loads within the same second
+        time.sleep(1)
+        shadow = f"{alias}_{time.strftime('%Y%m%d_%H%M%S')}"
+    create_collection(client, shadow, dimension, distance, profile_name,
+                      optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0))
+    print(f"🏗️ Bulk load into shadow collection {shadow} (indexing off)")
+    return shadow
+
+
+def copy_points(client, source: str, target: str, skip=frozenset()) -> set:
+    # Seeds the shadow with the live collection, so points loaded by other pipelines
+    # (S3 sessions, the chunk files) survive a bulk load of one of them.
+    # skip: IDs not to carry over (points already replaced by re-ingested documents)
+    # -> the copied point IDs
+    copied, offset = set(), None
+    while True:
+        points, offset = client.scroll(collection_name=source, limit=BULK_COPY_BATCH, offset=offset,
+                                       with_payload=True, with_vectors=True)
+        points = [p for p in points if p.id not in skip]
+        if points:
+            client.upsert(collection_name=target, wait=True, points=[
+                models.PointStruct(id=p.id, vector=p.vector, payload=p.payload) for p in points])
+            copied.update(p.id for p in points)
+        if offset is None:
+            break
+    print(f"📋 Copied {len(copied)} points from {source} into {target}")
+    return copied
+
+
+def shadow_of(client, alias: str, profile_name: str = QDRANT_PROFILE, skip=frozenset()):
+    # Shadow with the live collection's vector size and distance, seeded with its points
+    # -> (shadow name, IDs copied into it)
+    require_alias(client, alias)
+    live = alias_target(client, alias)
+    if live is None:  # nothing loaded yet
+        raise RuntimeError(f"No collection {alias} to start a bulk load from")
+    params = client.get_collection(live).config.params.vectors
+    shadow = start_shadow(client, alias, params.size, params.distance.value, profile_name)
+    return shadow, copy_points(client, live, shadow, skip)
+
+
+def _settled(info) -> bool:
+    return (info.status == models.CollectionStatus.GREEN
+            and info.optimizer_status == models.OptimizersStatusOneOf.OK)
+
+
+def wait_for_index(client, collection: str, timeout: int = BULK_OPTIMIZE_TIMEOUT):
+    # Right after indexing is turned on the collection can still report green: the
+    # optimizer hasn't picked the segments up yet. Only a status that stays green with
+    # the same indexed vector count for BULK_STABLE_POLLS polls in a row counts.
+    client.update_collection(collection_name=collection,
+                             optimizers_config=models.OptimizersConfigDiff(indexing_threshold=BULK_INDEXING_THRESHOLD))
+    start, stable, last_indexed = time.time(), 0, None
+    while True:
+        info = client.get_collection(collection)
+        if _settled(info) and info.indexed_vectors_count == last_indexed:
+            stable += 1
+        else:
+            stable = 0
+        last_indexed = info.indexed_vectors_count if _settled(info) else None
+        if stable >= BULK_STABLE_POLLS - 1:
+            print(f"📈 {collection} indexed: {info.indexed_vectors_count} of {info.points_count} vectors in "
+                  f"{info.segments_count} segments ({time.time() - start:.0f}s)")
+            return info
+        if time.time() - start > timeout:
+            raise TimeoutError(f"{collection} still {info.status} (optimizer {info.optimizer_status}) "
+                               f"after {timeout}s of optimization")
+        time.sleep(BULK_POLL_SECONDS)
+
+
+def swap_alias(client, alias: str, shadow: str):
+    require_alias(client, alias)
+    old = alias_target(client, alias)
+    operations = []
+    if old is not None:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    operations.append(models.CreateAliasOperation(create_alias=models.CreateAlias(
+        collection_name=shadow, alias_name=alias)))
+    client.update_collection_aliases(change_aliases_operations=operations)
+    print(f"🔀 Alias {alias}: {old or '-'} -> {shadow}")
+    return old
+
+
+def collect_garbage(client, alias: str, keep: int = BULK_KEEP_OLD) -> list:
+    # Drops older bulk-load collections of this alias, newest `keep` (besides the live one) stay
+    live = alias_target(client, alias)
+    pattern = re.compile(rf"^{re.escape(alias)}_\d{{8}}_\d{{6}}$")
+    old = sorted((c.name for c in client.get_collections().collections
+                  if pattern.match(c.name) and c.name != live), reverse=True)
+    dropped = old[keep:]
+    for name in dropped:
+        client.delete_collection(name)
+        print(f"🗑️ Dropped old collection {name}")
+    return dropped
+
+
+def finish_shadow(client, alias: str, shadow: str, expected: int = None, allow_shrink: bool = False):
+    # Index, validate and publish a loaded shadow collection. On any failure the alias
+    # is left alone and the shadow kept for inspection.
+    # allow_shrink: the shadow may hold fewer points than the live collection (a
+    # deliberate rebuild that drops whatever isn't in the source being loaded)
+    info = wait_for_index(client, shadow)
+    count = client.count(collection_name=shadow, exact=True).count
+    if expected is not None and count != expected:
+        raise RuntimeError(f"{shadow} has {count} points, expected {expected}; alias {alias} not moved")
+    if count == 0:
+        raise RuntimeError(f"{shadow} is empty; alias {alias} not moved")
+    live = alias_target(client, alias)
+    live_count = client.count(collection_name=live, exact=True).count if live else 0
+    if live_count > count and not allow_shrink:
+        raise RuntimeError(f"{shadow} has {count} points but {alias} serves {live_count}; alias not moved "
+                           f"(a rebuild that drops points has to be asked for explicitly)")
+    swap_alias(client, alias, shadow)
+    collect_garbage(client, alias)
+    return info
+
+
+def migrate_to_alias(client, name: str, profile_name: str = QDRANT_PROFILE) -> str:
+    # One-time conversion of a plain collection into an alias of <name>_<timestamp>.
+    # The copy is built and indexed while the old collection keeps serving; the only gap
+    # is between deleting it and creating the alias, two calls back to back.
+    if alias_target(client, name) is not None:
+        print(f"✅ {name} is already an alias")
+        return alias_target(client, name)
+    if not client.collection_exists(name):
+        raise RuntimeError(f"No collection {name}")
+    params = client.get_collection(name).config.params.vectors
+    shadow = start_shadow(client, name, params.size, params.distance.value, profile_name)
+    copied = copy_points(client, name, shadow)
+    wait_for_index(client, shadow)
+    count = client.count(collection_name=shadow, exact=True).count
+    if count != len(copied) or count != client.count(collection_name=name, exact=True).count:
+        raise RuntimeError(f"{shadow} has {count} points, {name} changed while copying; run the migration again")
+    print(f"⚠️ Replacing collection {name} with an alias of {shadow} (brief unavailability)")
+    client.delete_collection(name)
+    client.update_collection_aliases(change_aliases_operations=[models.CreateAliasOperation(
+        create_alias=models.CreateAlias(collection_name=shadow, alias_name=name))])
+    print(f"🔀 Alias {name} -> {shadow}")
+    return shadow
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from qdrant_client import QdrantClient
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Bulk loads behind a collection alias")
+    parser.add_argument("command", choices=["migrate"], help="migrate: convert a plain collection into an alias, once")
+    parser.add_argument("--profile", default=QDRANT_PROFILE)
+    parser.add_argument("--collection", default=os.getenv("QDRANT_COLLECTION_NAME", "rice_knowledge"))
+    args = parser.parse_args()
+
+    client = QdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"))
+    migrate_to_alias(client, args.collection, args.profile)
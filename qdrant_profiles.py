@@ -0,0 +1,187 @@
+# qdrant_profiles.py
+# Declarative collection profiles: how vectors, the HNSW graph and payloads are
+# stored, quantization, and which payload fields are indexed. A new collection is
+# created from a profile; `reconcile` brings an existing one in line with it.
+#
+#   ram-fast    vectors and payload in RAM, int8 scalar quantization kept in RAM
+#               (rescored against the originals), denser graph
+#   disk-lean   original vectors, graph and payload on disk; 1-bit binary
+#               quantization in RAM is all that has to stay resident
+#
+#   python qdrant_profiles.py show [--profile NAME]
+#   python qdrant_profiles.py reconcile [--profile NAME] [--collection NAME] [--dry-run]
+
+import os
+import argparse
+from qdrant_client import models
+
+QDRANT_PROFILE = os.getenv("QDRANT_PROFILE", "ram-fast")
+
+# Fields filtered on by search (source, lang) and by the delete-by-document scripts (url, chunk_id)
+PAYLOAD_INDEXES = {
+    "source": "keyword",
+    "lang": "keyword",
+    "url": "keyword",
+    "chunk_id": "keyword",
+    "chunk_number": "integer",
+}
+
+PROFILES = {
+    "ram-fast": {
+        "on_disk_vectors": False,
+        "on_disk_payload": False,
+        "hnsw": {"m": 32, "ef_construct": 256, "on_disk": False},
+        "quantization": {"type": "scalar", "always_ram": True},
+        "index_on_disk": False,
+    },
+    "disk-lean": {
+        "on_disk_vectors": True,
+        "on_disk_payload": True,
+        "hnsw": {"m": 16, "ef_construct": 100, "on_disk": True},
+        "quantization": {"type": "binary", "always_ram": True},
+        "index_on_disk": True,
+    },
+}
+
+
+def get_profile(name: str = QDRANT_PROFILE) -> dict:
+    if name not in PROFILES:
+        raise ValueError(f"Unknown QDRANT_PROFILE: {name} (expected one of {', '.join(PROFILES)})")
+    return PROFILES[name]
+
+
+def quantization_config(profile: dict):
+    q = profile["quantization"]
+    if q is None:
+        return models.Disabled.DISABLED
+    if q["type"] == "scalar":
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8, quantile=0.99, always_ram=q["always_ram"]))
+    if q["type"] == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=q["always_ram"]))
+    raise ValueError(f"Unknown quantization type: {q['type']}")
+
+
+def index_schema(kind: str, on_disk: bool):
+    if kind == "keyword":
+        return models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, on_disk=on_disk)
+    if kind == "integer":
+        return models.IntegerIndexParams(type=models.IntegerIndexType.INTEGER, lookup=True, range=True,
+                                         on_disk=on_disk)
+    raise ValueError(f"Unknown payload index type: {kind}")
+
+
+def create_payload_indexes(client, collection: str, profile: dict, existing: dict = None) -> list:
+    # -> fields indexed now; fields already indexed (name -> schema info) are left alone
+    existing = existing or {}
+    created = []
+    for field, kind in PAYLOAD_INDEXES.items():
+        if field in existing:
+            continue
+        client.create_payload_index(collection_name=collection, field_name=field,
+                                    field_schema=index_schema(kind, profile["index_on_disk"]), wait=True)
+        created.append(field)
+    return created
+
+
+def create_collection(client, collection: str, dimension: int, distance: str, profile_name: str = QDRANT_PROFILE,
+                      **overrides):
+    # overrides go straight to client.create_collection (e.g. optimizers_config for bulk loads)
+    profile = get_profile(profile_name)
+    client.create_collection(
+        collection_name=collection,
+        vectors_config=models.VectorParams(size=dimension, distance=models.Distance(distance),
+                                           on_disk=profile["on_disk_vectors"]),
+        on_disk_payload=profile["on_disk_payload"],
+        hnsw_config=models.HnswConfigDiff(**profile["hnsw"]),
+        quantization_config=quantization_config(profile),
+        **overrides,
+    )
+    create_payload_indexes(client, collection, profile)
+    print(f"🆕 Created collection {collection} with profile {profile_name}")
+
+
+# ------------------ RECONCILE ------------------
+
+def _quantization_kind(config) -> str:
+    if config is None:
+        return None
+    if getattr(config, "scalar", None) is not None:
+        return "scalar"
+    if getattr(config, "binary", None) is not None:
+        return "binary"
+    return type(config).__name__
+
+
+def plan_changes(info, profile: dict) -> dict:
+    # Compares a collection's current config with the profile -> {setting: (current, wanted)}
+    params, hnsw = info.config.params, info.config.hnsw_config
+    vectors = params.vectors
+    changes = {}
+    if bool(vectors.on_disk) != profile["on_disk_vectors"]:
+        changes["on_disk_vectors"] = (vectors.on_disk, profile["on_disk_vectors"])
+    if bool(params.on_disk_payload) != profile["on_disk_payload"]:
+        changes["on_disk_payload"] = (params.on_disk_payload, profile["on_disk_payload"])
+    for key, wanted in profile["hnsw"].items():
+        current = getattr(hnsw, key, None)
+        if isinstance(wanted, bool):
+            current = bool(current)  # unset on_disk means False
+        if current != wanted:
+            changes[f"hnsw.{key}"] = (current, wanted)
+    wanted_q = profile["quantization"]["type"] if profile["quantization"] else None
+    current_q = _quantization_kind(info.config.quantization_config)
+    if current_q != wanted_q:
+        changes["quantization"] = (current_q, wanted_q)
+    missing = [field for field in PAYLOAD_INDEXES if field not in (info.payload_schema or {})]
+    if missing:
+        changes["payload_indexes"] = (sorted(info.payload_schema or {}), missing)
+    return changes
+
+
+def reconcile(client, collection: str, profile_name: str = QDRANT_PROFILE, dry_run: bool = False) -> dict:
+    # Applies the profile to an existing collection. Vector size and distance can't be
+    # changed in place; everything here can (Qdrant rebuilds segments in the background).
+    profile = get_profile(profile_name)
+    info = client.get_collection(collection)
+    changes = plan_changes(info, profile)
+    if not changes:
+        print(f"✅ {collection} already matches profile {profile_name}")
+        return changes
+    for setting, (current, wanted) in changes.items():
+        print(f"🔧 {setting}: {current} -> {wanted}")
+    if dry_run:
+        return changes
+
+    if any(k in changes for k in ("on_disk_vectors", "on_disk_payload", "quantization")) or \
+            any(k.startswith("hnsw.") for k in changes):
+        client.update_collection(
+            collection_name=collection,
+            vectors_config={"": models.VectorParamsDiff(on_disk=profile["on_disk_vectors"])},
+            collection_params=models.CollectionParamsDiff(on_disk_payload=profile["on_disk_payload"]),
+            hnsw_config=models.HnswConfigDiff(**profile["hnsw"]),
+            quantization_config=quantization_config(profile),
+        )
+    created = create_payload_indexes(client, collection, profile, info.payload_schema)
+    print(f"✅ Reconciled {collection} to profile {profile_name}"
+          + (f" (indexed {', '.join(created)})" if created else ""))
+    return changes
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from qdrant_client import QdrantClient
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Qdrant collection profiles")
+    parser.add_argument("command", choices=["show", "reconcile"])
+    parser.add_argument("--profile", default=QDRANT_PROFILE, choices=list(PROFILES))
+    parser.add_argument("--collection", default=os.getenv("QDRANT_COLLECTION_NAME", "rice_knowledge"))
+    parser.add_argument("--dry-run", action="store_true", help="only print what would change")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        print(f"{args.profile}: {get_profile(args.profile)}")
+        print(f"payload indexes: {PAYLOAD_INDEXES}")
+    else:
+        client = QdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"))
+        reconcile(client, args.collection, args.profile, args.dry_run)
@@ -0,0 +1,302 @@
+# rate_governor.py
+# Token-bucket + AIMD concurrency governor for every model call (OpenAI and
+# Anthropic). Budgets live in a small SQLite file, so all worker processes on
+# the host draw from the same per-provider, per-model buckets.
+
+import os
+import re
+import time
+import random
+import asyncio
+import sqlite3
+import threading
+
+import psutil
+
+GOVERNOR_DB = os.getenv("RATE_GOVERNOR_DB", "final_data/rate_governor.sqlite")
+LATENCY_TARGET = float(os.getenv("RATE_GOVERNOR_LATENCY_TARGET", "20"))  # seconds
+MAX_RETRIES = int(os.getenv("RATE_GOVERNOR_MAX_RETRIES", "6"))
+LEASE_TIMEOUT = 600  # seconds before an in-flight slot from a hung worker is reclaimed
+REAP_INTERVAL = 5.0  # seconds between scans for leases of dead processes, per key
+POLL_INTERVAL = 0.05  # first wait for a full key; doubles up to MAX_POLL_INTERVAL
+MAX_POLL_INTERVAL = 1.0
+
+# (requests/min, tokens/min, starting concurrency, max concurrency)
+DEFAULT_LIMITS = {
+    ("openai", "gpt-4o-mini"): (500, 200_000, 8, 64),
+    ("openai", "text-embedding-3-small"): (3000, 1_000_000, 4, 32),
+    ("anthropic", "claude-3-haiku-20240307"): (50, 50_000, 4, 16),
+}
+FALLBACK_LIMITS = (60, 60_000, 2, 8)
+
+
+def get_limits(provider: str, model: str) -> tuple:
+    # Override per model, e.g. RATE_LIMIT_OPENAI_GPT_4O_MINI="5000/2000000"
+    rpm, tpm, concurrency, max_concurrency = DEFAULT_LIMITS.get((provider, model), FALLBACK_LIMITS)
+    env_key = "RATE_LIMIT_" + re.sub(r"[^A-Z0-9]+", "_", f"{provider}_{model}".upper())
+    override = os.getenv(env_key)
+    if override:
+        rpm, tpm = (float(v) for v in override.split("/")[:2])
+    return rpm, tpm, concurrency, max_concurrency
+
+
+def estimate_tokens(text: str) -> int:
+    # Cheap upper-ish estimate; the bucket is corrected with the real usage afterwards
+    return len(text) // 3 + 1
+
+
+def _usage_tokens(response):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    total = getattr(usage, "total_tokens", None)
+    if total is None:
+        total = (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0)
+    return total
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def _outcome(error: BaseException) -> str:
+    if not isinstance(error, Exception):
+        return "cancelled"  # CancelledError, KeyboardInterrupt
+    return "throttled" if _is_rate_limited(error) else "error"
+
+
+def _retry_after(error: Exception) -> float:
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except Exception:
+        return 1.0
+
+
+class RateGovernor:
+    def __init__(self, db_path: str = GOVERNOR_DB):
+        self.db_path = db_path
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._reaped = {}  # key -> last scan for stale leases
+        self._waiters = {}  # key -> futures of this process's coroutines waiting for a slot
+
+    def _connect(self):
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY, requests REAL, tokens REAL, updated REAL,
+                concurrency REAL, cooldown_until REAL)""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS leases (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, pid INTEGER, started REAL)""")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _load(self, conn, key, limits, now):
+        rpm, tpm, concurrency, _ = limits
+        row = conn.execute("SELECT requests, tokens, updated, concurrency, cooldown_until FROM buckets WHERE key = ?",
+                           (key,)).fetchone()
+        if row is None:
+            return [rpm, tpm, now, concurrency, 0.0]
+        requests, tokens, updated, concurrency, cooldown_until = row
+        elapsed = max(0.0, now - updated)
+        return [min(rpm, requests + elapsed * rpm / 60), min(tpm, tokens + elapsed * tpm / 60),
+                now, concurrency, cooldown_until]
+
+    def _store(self, conn, key, state):
+        conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?, ?)", (key, *state))
+
+    def _in_flight(self, conn, key, now, limit):
+        # Leases of dead or hung workers are only looked for when the key is full, and at
+        # most every REAP_INTERVAL, so polling stays a single COUNT
+        count = conn.execute("SELECT COUNT(*) FROM leases WHERE key = ?", (key,)).fetchone()[0]
+        if count < limit or now - self._reaped.get(key, 0.0) < REAP_INTERVAL:
+            return count
+        self._reaped[key] = now
+        leases = conn.execute("SELECT id, pid, started FROM leases WHERE key = ?", (key,)).fetchall()
+        stale = [lid for lid, pid, started in leases
+                 if now - started > LEASE_TIMEOUT or not psutil.pid_exists(pid)]
+        if stale:
+            conn.executemany("DELETE FROM leases WHERE id = ?", [(lid,) for lid in stale])
+        return len(leases) - len(stale)
+
+    def _try_acquire(self, key, limits, est_tokens):
+        # Returns (lease_id, 0) when a slot was taken, (None, None) when the key is at its
+        # concurrency limit, otherwise (None, seconds_to_wait) for the buckets to refill
+        rpm, tpm, _, _ = limits
+        est_tokens = min(est_tokens, tpm)  # never wait for more than a full bucket
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                state = self._load(conn, key, limits, now)
+                requests, tokens, _, concurrency, cooldown_until = state
+                wait = 0.0
+                if now < cooldown_until:
+                    wait = cooldown_until - now
+                elif self._in_flight(conn, key, now, max(1, int(concurrency))) >= max(1, int(concurrency)):
+                    wait = None
+                elif requests < 1:
+                    wait = (1 - requests) * 60 / rpm
+                elif tokens < est_tokens:
+                    wait = (est_tokens - tokens) * 60 / tpm
+
+                lease_id = None
+                if wait == 0.0:
+                    state[0] -= 1
+                    state[1] -= est_tokens
+                    lease_id = conn.execute("INSERT INTO leases (key, pid, started) VALUES (?, ?, ?)",
+                                            (key, os.getpid(), now)).lastrowid
+                self._store(conn, key, state)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return lease_id, wait
+
+    def _release(self, key, limits, lease_id, est_tokens, used_tokens=None, latency=0.0,
+                 outcome="ok", retry_after=1.0):
+        # outcome: "ok", "throttled" (429), "error" (5xx, timeout, ...) or "cancelled".
+        # Only successes grow the concurrency; failures get their token estimate back.
+        _, tpm, _, max_concurrency = limits
+        if outcome != "ok":
+            used_tokens = 0
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+                state = self._load(conn, key, limits, now)
+                if used_tokens is not None:
+                    state[1] = min(tpm, state[1] + min(est_tokens, tpm) - used_tokens)
+                concurrency = state[3]
+                if outcome == "throttled":
+                    # AIMD: halve on 429 and pause the whole key until the provider's retry-after
+                    concurrency = max(1.0, concurrency / 2)
+                    state[0] = min(state[0], 0.0)
+                    state[4] = max(state[4], now + retry_after)
+                elif outcome == "error" or latency > LATENCY_TARGET:
+                    concurrency = max(1.0, concurrency * 0.9)
+                elif outcome == "cancelled":
+                    pass  # says nothing about the provider
+                else:
+                    concurrency = min(max_concurrency, concurrency + 1 / concurrency)
+                state[3] = concurrency
+                self._store(conn, key, state)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    async def _acquire(self, key, limits, est_tokens):
+        # The acquire thread runs on when the caller is cancelled, so wait for it and hand
+        # back any lease it took instead of leaking it until LEASE_TIMEOUT
+        task = asyncio.ensure_future(asyncio.to_thread(self._try_acquire, key, limits, est_tokens))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            while not task.done():
+                try:
+                    await asyncio.shield(task)
+                except asyncio.CancelledError:
+                    pass
+            if not task.cancelled() and task.exception() is None and task.result()[0] is not None:
+                await self._release_async(key, limits, task.result()[0], est_tokens, outcome="cancelled")
+            raise
+
+    async def _release_async(self, key, *args, **kwargs):
+        # Shielded: a cancellation must not leak the lease. A waiter in this process is
+        # woken as soon as the release commits.
+        release = asyncio.ensure_future(asyncio.to_thread(self._release, key, *args, **kwargs))
+        release.add_done_callback(lambda _: self._wake(key))
+        await asyncio.shield(release)
+
+    async def _wait_for_slot(self, key, timeout):
+        # Releases in this process wake one waiter; other processes' releases are only
+        # seen by polling, so the timeout still bounds the wait
+        waiter = asyncio.get_running_loop().create_future()
+        waiters = self._waiters.setdefault(key, [])
+        waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters.remove(waiter)
+
+    def _wake(self, key):
+        loop = asyncio.get_running_loop()
+        for waiter in self._waiters.get(key, ()):
+            if not waiter.done() and waiter.get_loop() is loop:
+                waiter.set_result(None)
+                return
+
+    async def call(self, provider: str, model: str, fn, est_tokens: int = 0):
+        # fn: zero-arg callable returning an awaitable API call. The SQLite work runs in a
+        # thread so a busy database never blocks the event loop.
+        key, limits = f"{provider}:{model}", get_limits(provider, model)
+        for attempt in range(MAX_RETRIES + 1):
+            poll = POLL_INTERVAL
+            lease_id, wait = await self._acquire(key, limits, est_tokens)
+            while lease_id is None:
+                if wait is None:  # key full: wait for a release, backing off the polling
+                    await self._wait_for_slot(key, poll * random.uniform(0.5, 1.0))
+                    poll = min(MAX_POLL_INTERVAL, poll * 2)
+                else:
+                    await asyncio.sleep(wait)
+                lease_id, wait = await self._acquire(key, limits, est_tokens)
+
+            start = time.monotonic()
+            try:
+                response = await fn()
+            except BaseException as e:
+                outcome = _outcome(e)
+                await self._release_async(key, limits, lease_id, est_tokens, outcome=outcome,
+                                          retry_after=_retry_after(e) if outcome == "throttled" else 0.0)
+                if outcome != "throttled" or attempt == MAX_RETRIES:
+                    raise
+                print(f"⏳ {key} rate limited, retry {attempt + 1}/{MAX_RETRIES}")
+                await asyncio.sleep(min(60, 2 ** attempt) * random.uniform(0.5, 1.0))
+                continue
+
+            await self._release_async(key, limits, lease_id, est_tokens, _usage_tokens(response),
+                                      time.monotonic() - start)
+            return response
+
+    def call_sync(self, provider: str, model: str, fn, est_tokens: int = 0):
+        # Blocking twin of call() for the synchronous Anthropic client
+        key, limits = f"{provider}:{model}", get_limits(provider, model)
+        for attempt in range(MAX_RETRIES + 1):
+            poll = POLL_INTERVAL
+            lease_id, wait = self._try_acquire(key, limits, est_tokens)
+            while lease_id is None:
+                if wait is None:
+                    time.sleep(poll * random.uniform(0.5, 1.0))
+                    poll = min(MAX_POLL_INTERVAL, poll * 2)
+                else:
+                    time.sleep(wait)
+                lease_id, wait = self._try_acquire(key, limits, est_tokens)
+
+            start = time.monotonic()
+            try:
+                response = fn()
+            except BaseException as e:
+                outcome = _outcome(e)
+                self._release(key, limits, lease_id, est_tokens, outcome=outcome,
+                              retry_after=_retry_after(e) if outcome == "throttled" else 0.0)
+                if outcome != "throttled" or attempt == MAX_RETRIES:
+                    raise
+                print(f"⏳ {key} rate limited, retry {attempt + 1}/{MAX_RETRIES}")
+                time.sleep(min(60, 2 ** attempt) * random.uniform(0.5, 1.0))
+                continue
+
+            self._release(key, limits, lease_id, est_tokens, _usage_tokens(response), time.monotonic() - start)
+            return response
+
+
+governor = RateGovernor()
@@ -3,7 +3,7 @@ import os
 import json
 import sys
 import asyncio
-from ingest_aws_for_app import process_single_urls
+from ingest_aws_for_app import process_single_urls, start_session, close_session
 from dotenv import load_dotenv
 import boto3
 
@@ -45,9 +45,13 @@ with open("session_config.json") as f:
     session_path = json.load(f)["current_session_dir"]  # e.g. session_5/
 
 async def run(urls):
+    await start_session(session_path)  # same prefix as the app's PDFs and crawl_done.flag
     print(f"🌐 Crawling {len(urls)} URLs...")
-    await process_single_urls(urls)
-    print(f"✅ Done! JSON chunks uploaded to S3 under {session_path}")
+    try:
+        await process_single_urls(urls)
+    finally:
+        await close_session()
+    print(f"✅ Done! Chunk shards uploaded to S3 under {session_path}")
 
     # ✅ Upload crawl_done.flag to S3
     s3.put_object(
@@ -0,0 +1,118 @@
+# s3_session_writer.py
+# Buffers a session's chunks and writes them to S3 as gzip-compressed NDJSON shards
+# instead of one small JSON object per chunk.
+#
+#   <session>/shard-<pid>-00001.ndjson.gz   one {"id", "vector", "payload"} per line
+#   <session>/session_manifest-<pid>.json   written by close(): shards, row counts, IDs
+#
+# A shard is flushed once S3_SHARD_MB of uncompressed NDJSON is buffered; uploads
+# above S3_MULTIPART_MB go up as multipart (boto3 managed transfer). Chunks still in
+# the buffer when a process dies are lost; their point IDs just become gaps.
+
+import io
+import os
+import gzip
+import json
+import time
+import asyncio
+
+S3_SHARD_MB = float(os.getenv("S3_SHARD_MB", "32"))
+S3_MULTIPART_MB = float(os.getenv("S3_MULTIPART_MB", "16"))
+S3_SHARD_SUFFIX = ".ndjson.gz"
+SESSION_MANIFEST = "session_manifest"  # one per writing process: app.py and the crawler share a session
+
+
+def is_manifest_key(key: str) -> bool:
+    return key.rsplit("/", 1)[-1].startswith(SESSION_MANIFEST)
+
+
+def read_shard(body: bytes) -> list:
+    # -> the chunk dicts of one shard object
+    return [json.loads(line) for line in gzip.decompress(body).splitlines() if line.strip()]
+
+
+def _call_all(callbacks):
+    for callback in callbacks:
+        callback()
+
+
+class S3ShardWriter:
+    def __init__(self, s3, bucket: str, prefix: str, shard_bytes: int = int(S3_SHARD_MB * 1024 * 1024)):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.shard_bytes = shard_bytes
+        self.shards = []
+        self._seq = 0
+        self._lock = asyncio.Lock()
+        self._new_buffer()
+
+    def _new_buffer(self):
+        self._raw = io.BytesIO()
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+        self._rows = 0
+        self._ids = []
+        self._size = 0
+        self._on_stored = []
+
+    async def add(self, record: dict, on_stored=None) -> str:
+        # -> the shard key the record will land in
+        # on_stored(): called once the shard holding the record is uploaded
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        self._gzip.write(line)
+        self._rows += 1
+        self._ids.append(record["id"])
+        if on_stored is not None:
+            self._on_stored.append(on_stored)
+        self._size += len(line)
+        key = self._key(self._seq + 1)
+        if self._size >= self.shard_bytes:
+            await self.flush()
+        return key
+
+    def _key(self, seq: int) -> str:
+        return f"{self.prefix}shard-{os.getpid()}-{seq:05d}{S3_SHARD_SUFFIX}"
+
+    async def flush(self):
+        if not self._rows:
+            return
+        # Swap the buffer before the upload so chunks saved meanwhile go into the next shard
+        self._gzip.close()
+        body, rows, ids, raw_size, on_stored = self._raw.getvalue(), self._rows, self._ids, self._size, self._on_stored
+        self._seq += 1
+        key = self._key(self._seq)
+        self._new_buffer()
+        async with self._lock:
+            await asyncio.to_thread(self._upload, key, body)
+            self.shards.append({"key": key, "rows": rows, "bytes": len(body), "raw_bytes": raw_size,
+                                "min_id": min(ids), "max_id": max(ids)})
+        if on_stored:
+            await asyncio.to_thread(_call_all, on_stored)  # dedup bookkeeping writes SQLite
+        print(f"📦 Uploaded shard {key}: {rows} chunks, {len(body) / 1e6:.1f} MB")
+
+    def _upload(self, key: str, body: bytes):
+        from boto3.s3.transfer import TransferConfig
+
+        part = int(S3_MULTIPART_MB * 1024 * 1024)
+        config = TransferConfig(multipart_threshold=part, multipart_chunksize=part)
+        self.s3.upload_fileobj(io.BytesIO(body), self.bucket, key, Config=config,
+                               ExtraArgs={"ContentType": "application/gzip"})
+
+    async def close(self) -> dict:
+        # Flushes the last shard and writes the session manifest
+        await self.flush()
+        async with self._lock:
+            pass  # an earlier flush may still be uploading
+        manifest = {"format": "ndjson.gz", "created": time.time(), "rows": sum(s["rows"] for s in self.shards),
+                    "shards": self.shards}
+        key = f"{self.prefix}{SESSION_MANIFEST}-{os.getpid()}.json"
+        await asyncio.to_thread(self.s3.put_object, Bucket=self.bucket, Key=key,
+                                Body=json.dumps(manifest, indent=2).encode("utf-8"))
+        print(f"🗂️ Session manifest: {manifest['rows']} chunks in {len(self.shards)} shards under {self.prefix}")
+        return manifest
+
+    async def close_orphaned(self) -> dict:
+        # For a writer whose run raised before close(): the event loop its lock belongs
+        # to may be gone (Streamlit runs each button press in a new one)
+        self._lock = asyncio.Lock()
+        return await self.close()
@@ -1,6 +1,7 @@
 import os
 import anthropic
 from dotenv import load_dotenv
+from rate_governor import governor, estimate_tokens
 
 load_dotenv()
 anthropic_client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
@@ -9,14 +10,16 @@ def translate_vi_en(text: str) -> str:
     system_prompt = "You are a helpful assistant that translates Vietnamese to English."
     user_prompt = f"Translate the following text from Vietnamese to English:\n\n{text}"
 
+    model = "claude-3-haiku-20240307"
+
     try:
-        response = anthropic_client.messages.create(
-            model="claude-3-haiku-20240307",
+        response = governor.call_sync("anthropic", model, lambda: anthropic_client.messages.create(
+            model=model,
             max_tokens=1000,
             temperature=0.2,
             system=system_prompt,
             messages=[{"role": "user", "content": user_prompt}],
-        )
+        ), est_tokens=estimate_tokens(system_prompt + user_prompt) + 1000)
         return response.content[0].text.strip()
     except Exception as e:
         print("Translation error:", e)
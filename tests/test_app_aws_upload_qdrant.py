@@ -0,0 +1,142 @@
+# app_aws_upload_qdrant.py against moto's S3 and an in-memory Qdrant:
+# fetch -> upsert -> delete_objects, over more than one page of keys, and bulk loads
+# that must not publish a shadow collection missing objects.
+
+import os
+import json
+import gzip
+
+import pytest
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+pytest.importorskip("qdrant_client")
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, VectorParams
+
+import qdrant_bulk
+import app_aws_upload_qdrant as upload
+
+BUCKET = "test-sessions"
+SESSION = "session_20260101_000000/"
+DIM = 4
+CHUNKS = 1100  # more than one list_objects_v2 / delete_objects page
+
+
+def record(point_id: int) -> dict:
+    return {"id": point_id, "vector": [float(point_id % 7), 1.0, 0.5, 0.25],
+            "payload": {"url": f"https://example.edu/{point_id}", "chunk": f"chunk {point_id}"}}
+
+
+@pytest.fixture
+def env(monkeypatch):
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=BUCKET)
+        qdrant = QdrantClient(":memory:")
+        qdrant.create_collection(upload.COLLECTION_NAME, vectors_config=VectorParams(size=DIM, distance=Distance.COSINE))
+        monkeypatch.setattr(upload, "bucket", BUCKET)
+        monkeypatch.setattr(upload, "_s3", s3)
+        monkeypatch.setattr(upload, "_qdrant", qdrant)
+        monkeypatch.setattr(upload, "S3_UPLOAD_BATCH", 64)
+        yield s3, qdrant
+
+
+def fill_session(s3, corrupt: bool = False):
+    s3.put_object(Bucket=BUCKET, Key=SESSION, Body=b"")  # folder marker
+    for i in range(CHUNKS):
+        s3.put_object(Bucket=BUCKET, Key=f"{SESSION}chunk_{i:05d}.json", Body=json.dumps(record(i)).encode())
+    shard = b"".join((json.dumps(record(i)) + "\n").encode() for i in range(CHUNKS, CHUNKS + 50))
+    s3.put_object(Bucket=BUCKET, Key=f"{SESSION}shard-1-00001{upload.S3_SHARD_SUFFIX}", Body=gzip.compress(shard))
+    s3.put_object(Bucket=BUCKET, Key=f"{SESSION}session_manifest-1.json", Body=b"{}")
+    s3.put_object(Bucket=BUCKET, Key=f"{SESSION}crawl_done.flag", Body=b"done")
+    if corrupt:
+        s3.put_object(Bucket=BUCKET, Key=f"{SESSION}chunk_broken.json", Body=b"{not json")
+
+
+def remaining_keys(s3) -> set:
+    keys = set()
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET, Prefix=SESSION):
+        keys.update(obj["Key"] for obj in page.get("Contents", []))
+    return keys
+
+
+def test_lists_more_than_one_page(env):
+    s3, _ = env
+    fill_session(s3)
+    assert len(upload.list_session_keys(SESSION)) == CHUNKS + 4
+
+
+def test_uploads_session_and_deletes_it(env):
+    s3, qdrant = env
+    fill_session(s3)
+
+    assert upload.upload_session_from_s3(SESSION) == CHUNKS + 50
+    assert qdrant.count(upload.COLLECTION_NAME, exact=True).count == CHUNKS + 50
+    assert qdrant.retrieve(upload.COLLECTION_NAME, [CHUNKS + 10])[0].payload["chunk"] == f"chunk {CHUNKS + 10}"
+    assert remaining_keys(s3) == set()
+
+
+def test_corrupt_object_keeps_flag_and_marker(env):
+    s3, qdrant = env
+    fill_session(s3, corrupt=True)
+
+    assert upload.upload_session_from_s3(SESSION) == CHUNKS + 50
+    assert qdrant.count(upload.COLLECTION_NAME, exact=True).count == CHUNKS + 50
+    # Only what was uploaded is gone; the session stays recognisable for the next run
+    assert remaining_keys(s3) == {SESSION, f"{SESSION}chunk_broken.json", f"{SESSION}session_manifest-1.json",
+                                  f"{SESSION}crawl_done.flag"}
+
+
+def test_failed_upsert_keeps_its_keys(env, monkeypatch):
+    s3, qdrant = env
+    fill_session(s3)
+    real_upsert = qdrant.upsert
+    calls = []
+
+    def flaky_upsert(**kwargs):
+        calls.append(len(kwargs["points"]))
+        if len(calls) == 2:
+            raise RuntimeError("qdrant unavailable")
+        return real_upsert(**kwargs)
+
+    monkeypatch.setattr(qdrant, "upsert", flaky_upsert)
+    monkeypatch.setattr(upload, "S3_UPLOAD_RETRIES", 1)
+
+    assert upload.upload_session_from_s3(SESSION) == CHUNKS + 50 - calls[1]
+    left = remaining_keys(s3)
+    # The second batch (chunks 64..127) failed: those keys, the flag and the marker stay
+    assert {f"{SESSION}chunk_{i:05d}.json" for i in range(64, 128)} <= left
+    assert {SESSION, f"{SESSION}crawl_done.flag"} <= left
+    assert f"{SESSION}chunk_00000.json" not in left
+
+
+def test_run_upload_finds_sessions(env):
+    s3, qdrant = env
+    fill_session(s3)
+
+    assert upload.run_upload() == CHUNKS + 50
+    assert remaining_keys(s3) == set()
+
+
+def test_bulk_load_with_failures_is_not_published(env, monkeypatch):
+    s3, qdrant = env
+    monkeypatch.setattr(qdrant_bulk, "BULK_POLL_SECONDS", 0)
+    qdrant_bulk.migrate_to_alias(qdrant, upload.COLLECTION_NAME)
+    live = qdrant_bulk.alias_target(qdrant, upload.COLLECTION_NAME)
+    fill_session(s3, corrupt=True)
+
+    upload.run_upload(bulk=True)
+    assert qdrant_bulk.alias_target(qdrant, upload.COLLECTION_NAME) == live
+    assert len(remaining_keys(s3)) == CHUNKS + 5  # nothing deleted
+
+    upload.run_upload(bulk=True, force=True)
+    assert qdrant_bulk.alias_target(qdrant, upload.COLLECTION_NAME) != live
+    assert qdrant.count(upload.COLLECTION_NAME, exact=True).count == CHUNKS + 50
+    assert remaining_keys(s3) == {SESSION, f"{SESSION}chunk_broken.json", f"{SESSION}session_manifest-1.json",
+                                  f"{SESSION}crawl_done.flag"}
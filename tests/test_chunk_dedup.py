@@ -0,0 +1,47 @@
+# ChunkDedupIndex: duplicates of stored chunks and of chunks still in flight (admitted,
+# not stored yet), and a re-ingest that starts the document over.
+
+import pytest
+
+from chunk_dedup import ChunkDedupIndex
+
+TEXT = ("Rice seedlings are transplanted about three weeks after sowing, when they have four "
+        "to five leaves, and the field is kept flooded with a few centimetres of water while "
+        "the roots establish themselves in the puddled soil of the paddy.")
+NEAR = TEXT.replace("of the paddy", "of the paddy field")
+
+
+@pytest.fixture
+def index(tmp_path):
+    return ChunkDedupIndex(str(tmp_path / "dedup.sqlite"), mode="alias")
+
+
+def test_stored_chunk_is_canonical(index):
+    assert index.admit("a", 0, TEXT)
+    index.stored("a", 0, TEXT)
+    assert not index.admit("b", 3, TEXT.upper())
+    assert not index.admit("b", 4, NEAR)
+    assert [row[:3] for row in index.aliases("b")] == [(3, "a", 0), (4, "a", 0)]
+
+
+def test_in_flight_duplicates(index):
+    assert index.admit("a", 0, TEXT)
+    assert not index.admit("a", 5, TEXT)  # same document, same window
+    assert not index.admit("b", 1, NEAR)  # another document processed at the same time
+    assert index.aliases("b") == []  # the canonical chunk isn't stored yet
+    index.stored("a", 0, TEXT)
+    assert [row[:3] for row in index.aliases("b")] == [(1, "a", 0)]
+    assert index._pending == {} and index._pending_hashes == {} and index._pending_bands == {}
+
+
+def test_begin_document_drops_in_flight(index):
+    assert index.admit("a", 0, TEXT)
+    index.begin_document("a")
+    assert index.admit("b", 0, TEXT)
+    index.stored("b", 0, TEXT)
+    assert not index.admit("a", 0, TEXT)
+
+
+def test_off_admits_everything(tmp_path):
+    index = ChunkDedupIndex(str(tmp_path / "dedup.sqlite"), mode="off")
+    assert index.admit("a", 0, TEXT) and index.admit("a", 1, TEXT)
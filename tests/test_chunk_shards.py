@@ -0,0 +1,80 @@
+# chunk_shards.py: sealing a shard left behind by a crashed writer, and reading shard
+# rows back as points in memmap blocks (upload_to_qdrant._read_shard).
+
+import os
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("psutil")
+pytest.importorskip("qdrant_client")
+
+from chunk_shards import ShardWriter, open_shard, seal_orphaned, unsealed_shards, writer_running
+import upload_to_qdrant
+
+DIM = 3
+DEAD_PID = 2 ** 22 + 1  # above Linux's pid_max
+
+
+def vector(i: int) -> list:
+    return [float(i), i + 0.5, -float(i)]
+
+
+def crashed_shard(directory, rows: int) -> str:
+    # Writes `rows` rows, then half a row into each file, and never seals the shard
+    writer = ShardWriter(str(directory))
+    for i in range(rows):
+        writer.append(i, vector(i), {"n": i})
+    writer._vectors.write(b"\0" * 6)
+    writer._payloads.write('{"id": 99, "pay')
+    writer._vectors.close()
+    writer._payloads.close()
+    old = writer._manifest_path
+    dead = old.replace(f"-{os.getpid()}-", f"-{DEAD_PID}-")
+    meta = dict(writer._manifest)
+    for field in ("vectors", "payloads"):
+        meta[field] = meta[field].replace(f"-{os.getpid()}-", f"-{DEAD_PID}-")
+        os.rename(os.path.join(directory, writer._manifest[field]), os.path.join(directory, meta[field]))
+    os.remove(old)
+    with open(dead, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return dead
+
+
+def test_seal_orphaned_shard(tmp_path):
+    dead = crashed_shard(tmp_path, 5)
+    live = ShardWriter(str(tmp_path))
+    live.append(1000, vector(1), {"n": 1000})  # unsealed, but its writer (this process) is running
+
+    assert writer_running(live._manifest_path) and not writer_running(dead)
+    assert seal_orphaned(str(tmp_path)) == [dead]
+    assert unsealed_shards(str(tmp_path)) == [live._manifest_path]
+
+    ids, vectors, payloads = open_shard(dead)
+    assert ids == [0, 1, 2, 3, 4]
+    assert vectors.tolist() == [vector(i) for i in range(5)]
+    assert payloads[4] == {"n": 4}
+    with open(dead, encoding="utf-8") as f:
+        meta = json.load(f)
+    assert meta["rows"] == 5
+    assert os.path.getsize(tmp_path / meta["vectors"]) == 5 * DIM * 4  # torn tail cut off
+    live.close()
+
+
+def test_read_shard_in_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_to_qdrant, "UPLOAD_MAX_BATCH_POINTS", 4)
+    writer = ShardWriter(str(tmp_path))
+    for i in range(10):
+        writer.append(i, vector(i), {"n": i})
+    writer.close()
+    manifest_path = writer._manifest_path
+
+    points = upload_to_qdrant._read_shard(manifest_path, retired={3, 7})
+    assert [p.id for _, p, _ in points] == [0, 1, 2, 4, 5, 6, 8, 9]
+    assert all(p.vector == vector(p.id) for _, p, _ in points)
+    assert points[3][0] == f"{manifest_path}#4"
+
+    replayed = upload_to_qdrant._read_shard(manifest_path, rows=[1, 2, 5, 9, 12])
+    assert [p.id for _, p, _ in replayed] == [1, 2, 5, 9]
+    assert list(upload_to_qdrant._row_runs([1, 2, 3, 4, 5, 8], 4)) == [(1, 5), (5, 6), (8, 9)]
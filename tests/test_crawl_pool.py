@@ -0,0 +1,108 @@
+# CrawlPool politeness against a local HTTP server: per-host concurrency cap, request
+# spacing (CRAWL_HOST_DELAY and robots.txt Crawl-delay) and robots.txt Disallow.
+# 127.0.0.1 and localhost are the same server but two hosts to the pool.
+
+import time
+import asyncio
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+from crawl_pool import CrawlPool, RobotsCache, interleave_hosts, parse_crawl_delay
+
+PAGE_SECONDS = 0.2
+ROBOTS = "User-agent: *\nCrawl-delay: 0.5\nDisallow: /private\n"
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        host = self.headers.get("Host", "").split(":")[0]
+        if self.path == "/robots.txt":
+            body, status = (ROBOTS.encode(), 200) if host == "127.0.0.1" else (b"", 404)
+        else:
+            time.sleep(PAGE_SECONDS)
+            body, status = f"<html><body>{self.path}</body></html>".encode(), 200
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def port():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address[1]
+    server.shutdown()
+
+
+class Recorder:
+    # fetch() for the pool that records when each host's requests start and how many overlap
+    def __init__(self):
+        self.starts = defaultdict(list)
+        self.active = defaultdict(int)
+        self.peak = defaultdict(int)
+        self.handled = []
+
+    async def fetch(self, url, worker):
+        host = url.split("/")[2]
+        self.starts[host].append(time.monotonic())
+        self.active[host] += 1
+        self.peak[host] = max(self.peak[host], self.active[host])
+        try:
+            return (await asyncio.to_thread(requests.get, url, timeout=10)).text
+        finally:
+            self.active[host] -= 1
+
+    async def handle(self, url, html):
+        self.handled.append(url)
+
+
+def gaps(starts):
+    return [b - a for a, b in zip(starts, starts[1:])]
+
+
+def crawl(urls, **options):
+    recorder = Recorder()
+    pool = CrawlPool(recorder.fetch, recorder.handle, robots=RobotsCache("TestBot"), **options)
+    stats = asyncio.run(pool.run(interleave_hosts(urls)))
+    return recorder, stats
+
+
+def test_per_host_cap_and_delay(port):
+    host = f"localhost:{port}"
+    urls = [f"http://{host}/page/{i}" for i in range(8)]
+    recorder, stats = crawl(urls, workers=6, processors=2, per_host=2, host_delay=0.1)
+
+    assert stats["fetched"] == 8 and stats["processed"] == 8
+    assert recorder.peak[host] == 2  # pages take 0.2s, so two do overlap, but never three
+    assert min(gaps(recorder.starts[host])) >= 0.1 - 0.01
+
+
+def test_robots_crawl_delay_and_disallow(port):
+    polite, other = f"127.0.0.1:{port}", f"localhost:{port}"
+    urls = ([f"http://{polite}/page/{i}" for i in range(4)] + [f"http://{polite}/private/secret"]
+            + [f"http://{other}/page/{i}" for i in range(4)])
+    recorder, stats = crawl(urls, workers=6, processors=2, per_host=4, host_delay=0.05)
+
+    assert stats["disallowed"] == 1
+    assert f"http://{polite}/private/secret" not in recorder.handled
+    assert len(recorder.starts[polite]) == 4 and stats["processed"] == 8
+    # Crawl-delay: 0.5 is longer than host_delay and wins for its host only
+    assert min(gaps(recorder.starts[polite])) >= 0.5 - 0.01
+    assert max(gaps(recorder.starts[other])) < 0.5
+
+
+def test_parse_crawl_delay():
+    lines = ["User-agent: TestBot", "Crawl-delay: 2.5", "", "User-agent: *", "Crawl-delay: 0.5  # everyone"]
+    assert parse_crawl_delay(lines, "TestBot/1.0") == 2.5
+    assert parse_crawl_delay(lines, "OtherBot") == 0.5
+    assert parse_crawl_delay(["User-agent: *", "Disallow: /"], "OtherBot") is None
@@ -0,0 +1,45 @@
+# html_extract.py: boilerplate removal keeps the page's main text.
+
+import pytest
+
+pytest.importorskip("lxml")
+
+from html_extract import extract_page
+
+PROSE = "Alternate wetting and drying saves irrigation water without lowering rice yields. " * 6
+
+
+def page(body: str) -> str:
+    return f"<html><head><title>t</title></head><body>{body}</body></html>"
+
+
+def test_content_wrapper_named_like_chrome_is_kept():
+    text, _ = extract_page(page(f'<div class="content-area with-sidebar"><p>{PROSE}</p>'
+                                f'<div class="sidebar"><p>Sidebar teaser</p></div></div>'))
+    assert PROSE.strip() in text
+    assert "Sidebar teaser" not in text
+
+
+def test_page_wide_form_is_kept():
+    text, _ = extract_page(page(f'<form id="aspnetForm"><nav><a href="/a">Home</a></nav><p>{PROSE}</p></form>'))
+    assert PROSE.strip() in text
+    assert "Home" not in text
+
+
+def test_short_linked_paragraph_is_kept():
+    text, links = extract_page(page(f'<p>{PROSE}</p><p>See <a href="/guide">the rice knowledge bank guide</a>.</p>'),
+                               "https://example.edu/page")
+    assert "See the rice knowledge bank guide." in text
+    assert links == ["https://example.edu/guide"]
+
+
+def test_menus_and_banners_are_dropped():
+    text, links = extract_page(page(
+        '<div class="menu-wrap"><a href="/a">About</a> <a href="/b">Research</a></div>'
+        f'<div><p>{PROSE}</p></div>'
+        '<ul><li><a href="/c">Privacy</a></li><li><a href="/d">Terms</a></li></ul>'
+        '<div id="cookie-banner">We use cookies</div>'), "https://example.edu/")
+    assert PROSE.strip() in text
+    for chrome in ("About", "Research", "Privacy", "We use cookies"):
+        assert chrome not in text
+    assert len(links) == 4  # links are collected before anything is removed
@@ -0,0 +1,115 @@
+# Concurrent leases never hand out the same ID: LocalIdAllocator across threads and
+# processes (file lock), S3IdAllocator across threads against moto (conditional PUT).
+
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import pytest
+
+from id_allocator import LocalIdAllocator, S3IdAllocator, BlockIdAllocator
+
+BLOCK = 10
+
+
+def assert_disjoint(starts, count=BLOCK):
+    ids = [start + i for start in starts for i in range(count)]
+    assert len(ids) == len(set(ids))
+    return ids
+
+
+def test_local_first_lease_starts_at_floor(tmp_path):
+    allocator = LocalIdAllocator(str(tmp_path / "counter.txt"), floor=500)
+    assert allocator.lease(BLOCK) == 500
+    assert allocator.lease(BLOCK) == 510
+    assert (tmp_path / "counter.txt").read_text() == "519"
+
+
+def test_local_concurrent_threads(tmp_path):
+    allocator = LocalIdAllocator(str(tmp_path / "counter.txt"))
+    with ThreadPoolExecutor(16) as pool:
+        starts = list(pool.map(lambda _: allocator.lease(BLOCK), range(200)))
+    assert sorted(assert_disjoint(starts)) == list(range(200 * BLOCK))
+
+
+def _lease_many(path):
+    allocator = LocalIdAllocator(path)
+    return [allocator.lease(BLOCK) for _ in range(25)]
+
+
+def test_local_concurrent_processes(tmp_path):
+    path = str(tmp_path / "counter.txt")
+    with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context("spawn")) as pool:
+        starts = [start for starts in pool.map(_lease_many, [path] * 8) for start in starts]
+    assert sorted(assert_disjoint(starts)) == list(range(8 * 25 * BLOCK))
+
+
+def test_block_allocator_threads(tmp_path):
+    allocator = BlockIdAllocator(LocalIdAllocator(str(tmp_path / "counter.txt")), block_size=7)
+    with ThreadPoolExecutor(8) as pool:
+        ids = list(pool.map(lambda _: allocator.next_id(), range(500)))
+    assert sorted(ids) == list(range(500))
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    boto3 = pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+    for name, value in (("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+                        ("AWS_DEFAULT_REGION", "us-east-1")):
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="test-ids")
+        yield client
+
+
+def test_s3_first_lease_and_floor(s3):
+    allocator = S3IdAllocator("test-ids", "last_chunk_id.txt", s3, floor=100)
+    assert allocator.lease(BLOCK) == 100
+    assert allocator.lease(BLOCK) == 110
+    assert s3.get_object(Bucket="test-ids", Key="last_chunk_id.txt")["Body"].read() == b"119"
+
+
+def test_s3_lost_race_is_retried(s3, monkeypatch):
+    # Another worker writes the counter between our read and our conditional PUT
+    allocator = S3IdAllocator("test-ids", "last_chunk_id.txt", s3)
+    other = S3IdAllocator("test-ids", "last_chunk_id.txt", s3)
+    allocator.lease(BLOCK)
+    real_read, raced = allocator._read, []
+
+    def read_then_lose():
+        result = real_read()
+        if not raced:
+            raced.append(other.lease(BLOCK))
+        return result
+
+    monkeypatch.setattr(allocator, "_read", read_then_lose)
+    monkeypatch.setattr("id_allocator.time.sleep", lambda seconds: None)
+    assert allocator.lease(BLOCK) == 2 * BLOCK
+    assert raced == [BLOCK]
+
+
+def test_s3_first_write_race(s3, monkeypatch):
+    # Two workers both see no counter; If-None-Match lets only one create it
+    allocator = S3IdAllocator("test-ids", "last_chunk_id.txt", s3)
+    other = S3IdAllocator("test-ids", "last_chunk_id.txt", s3)
+    real_read, raced = allocator._read, []
+
+    def read_then_lose():
+        result = real_read()
+        if not raced:
+            raced.append(other.lease(BLOCK))
+        return result
+
+    monkeypatch.setattr(allocator, "_read", read_then_lose)
+    monkeypatch.setattr("id_allocator.time.sleep", lambda seconds: None)
+    assert allocator.lease(BLOCK) == BLOCK
+    assert raced == [0]
+
+
+def test_s3_concurrent_threads(s3, monkeypatch):
+    monkeypatch.setattr("id_allocator.S3_LEASE_RETRIES", 200)
+    allocators = [S3IdAllocator("test-ids", "last_chunk_id.txt", s3) for _ in range(8)]
+    with ThreadPoolExecutor(8) as pool:
+        starts = list(pool.map(lambda n: allocators[n % 8].lease(BLOCK), range(80)))
+    assert sorted(assert_disjoint(starts)) == list(range(80 * BLOCK))
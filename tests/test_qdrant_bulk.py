@@ -0,0 +1,92 @@
+# qdrant_bulk.py against an in-memory Qdrant: migration to an alias, seeded shadows,
+# and the checks that keep the alias where it is.
+
+import pytest
+
+pytest.importorskip("qdrant_client")
+
+from qdrant_client import QdrantClient, models
+
+import qdrant_bulk
+from qdrant_bulk import alias_target, migrate_to_alias, shadow_of, start_shadow, finish_shadow, wait_for_index
+
+ALIAS = "knowledge"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(qdrant_bulk, "BULK_POLL_SECONDS", 0)
+    monkeypatch.setattr(qdrant_bulk.time, "strftime", _Clock().strftime)
+    return QdrantClient(":memory:")
+
+
+class _Clock:
+    # A new shadow name per call instead of one per wall-clock second
+    def __init__(self):
+        self.ticks = 0
+
+    def strftime(self, fmt):
+        self.ticks += 1
+        return f"20260101_{self.ticks:06d}"
+
+
+def points(ids):
+    return [models.PointStruct(id=i, vector=[1.0, float(i), 0.0, 0.5], payload={"n": i}) for i in ids]
+
+
+def plain_collection(client, ids):
+    client.create_collection(ALIAS, vectors_config=models.VectorParams(size=4, distance=models.Distance.COSINE))
+    client.upsert(ALIAS, points(ids), wait=True)
+
+
+def test_bulk_load_refuses_plain_collection(client):
+    plain_collection(client, range(10))
+    with pytest.raises(RuntimeError, match="migrate"):
+        shadow_of(client, ALIAS)
+    assert client.count(ALIAS).count == 10  # nothing was deleted
+
+
+def test_migrate_then_seeded_load(client):
+    plain_collection(client, range(10))
+    first = migrate_to_alias(client, ALIAS)
+    assert alias_target(client, ALIAS) == first
+    assert client.count(ALIAS, exact=True).count == 10
+
+    shadow, copied = shadow_of(client, ALIAS, skip={3})
+    assert copied == set(range(10)) - {3}
+    client.upsert(shadow, points(range(10, 15)), wait=True)
+    finish_shadow(client, ALIAS, shadow, expected=len(copied | set(range(10, 15))))
+    assert alias_target(client, ALIAS) == shadow
+    assert client.count(ALIAS, exact=True).count == 14
+
+
+def test_shrinking_load_needs_allow_shrink(client):
+    plain_collection(client, range(10))
+    live = migrate_to_alias(client, ALIAS)
+    shadow = start_shadow(client, ALIAS, 4, "Cosine")
+    client.upsert(shadow, points(range(5)), wait=True)
+
+    with pytest.raises(RuntimeError, match="serves 10"):
+        finish_shadow(client, ALIAS, shadow, expected=5)
+    assert alias_target(client, ALIAS) == live
+
+    finish_shadow(client, ALIAS, shadow, expected=5, allow_shrink=True)
+    assert alias_target(client, ALIAS) == shadow
+
+
+def test_wait_for_index_needs_stable_polls(client, monkeypatch):
+    plain_collection(client, range(3))
+    real_get = client.get_collection
+    polls = []
+
+    def get_collection(name):
+        info = real_get(name)
+        polls.append(info)
+        # The optimizer picks the segments up only after the first poll
+        if len(polls) == 2:
+            return info.model_copy(update={"status": models.CollectionStatus.YELLOW})
+        return info
+
+    monkeypatch.setattr(client, "get_collection", get_collection)
+    wait_for_index(client, ALIAS)
+    assert len(polls) == 2 + qdrant_bulk.BULK_STABLE_POLLS
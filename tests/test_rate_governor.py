@@ -0,0 +1,88 @@
+# RateGovernor slot handling on one key with a concurrency of 1: a release in this
+# process wakes a waiter without polling, and cancellation never leaks a lease.
+
+import time
+import asyncio
+
+import pytest
+
+pytest.importorskip("psutil")
+
+import rate_governor
+from rate_governor import RateGovernor
+
+LIMITS = (6000, 1_000_000, 1, 1)
+
+
+@pytest.fixture
+def governor(tmp_path, monkeypatch):
+    monkeypatch.setattr(rate_governor, "get_limits", lambda provider, model: LIMITS)
+    return RateGovernor(str(tmp_path / "governor.sqlite"))
+
+
+def _leases(governor):
+    return governor._connect().execute("SELECT COUNT(*) FROM leases").fetchone()[0]
+
+
+def test_release_wakes_waiter(governor, monkeypatch):
+    monkeypatch.setattr(rate_governor, "POLL_INTERVAL", 5.0)
+    monkeypatch.setattr(rate_governor, "MAX_POLL_INTERVAL", 5.0)
+
+    async def hold():
+        await asyncio.sleep(0.2)
+        return "first"
+
+    async def immediate():
+        return "second"
+
+    async def main():
+        first = asyncio.create_task(governor.call("p", "m", hold))
+        await asyncio.sleep(0.05)
+        start = time.monotonic()
+        second = await governor.call("p", "m", immediate)
+        return await first, second, time.monotonic() - start
+
+    first, second, waited = asyncio.run(main())
+    assert (first, second) == ("first", "second")
+    assert waited < 2.0  # woken by the release, not by the 5 s poll
+    assert _leases(governor) == 0
+
+
+def test_cancel_while_waiting_or_running(governor):
+    async def hold():
+        await asyncio.sleep(10)
+
+    async def main():
+        running = asyncio.create_task(governor.call("p", "m", hold))
+        await asyncio.sleep(0.1)
+        waiting = asyncio.create_task(governor.call("p", "m", hold))
+        await asyncio.sleep(0.1)
+        waiting.cancel()
+        running.cancel()
+        await asyncio.gather(running, waiting, return_exceptions=True)
+
+    asyncio.run(main())
+    assert _leases(governor) == 0
+
+
+def test_cancel_during_acquire_returns_lease(governor, monkeypatch):
+    try_acquire = governor._try_acquire
+
+    def slow_acquire(*args):
+        time.sleep(0.3)  # the caller is cancelled while this thread holds the new lease
+        return try_acquire(*args)
+
+    monkeypatch.setattr(governor, "_try_acquire", slow_acquire)
+
+    async def never():
+        raise AssertionError("fn must not run after cancellation")
+
+    async def main():
+        task = asyncio.create_task(governor.call("p", "m", never))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert _leases(governor) == 0
@@ -0,0 +1,28 @@
+# text_normalize.py
+# Text clean-up shared by every ingest path. Kept free of clients and heavy
+# imports so process-pool workers (pdf_extract.py) can import it cheaply.
+
+import re
+
+# postprocess_text used to run five passes over the whole document, compiling
+# each pattern on every call:
+#   \\[nrt] -> " ",  \\+ -> "",  "\n" -> " ",  https?://\S+ -> "",  \s{2,} -> " ",  strip()
+# Now the patterns are precompiled, the two backslash rules are fused into one pass,
+# and the backslash / URL passes are skipped when a substring check shows they cannot
+# match (most PDF text). bench_normalize.py checks the output is identical and times
+# both versions. \s{2,} after str.replace measured faster than a fused \s{2,}|\n.
+_BACKSLASHES = re.compile(r'\\+[nrt]?')  # ends in an escape -> space, otherwise deleted
+_URL = re.compile(r'https?://\S+')
+_WHITESPACE = re.compile(r'\s{2,}')
+
+
+def _replace_backslashes(match) -> str:
+    return ' ' if match.group()[-1] in 'nrt' else ''
+
+
+def postprocess_text(text: str) -> str:
+    if '\\' in text:
+        text = _BACKSLASHES.sub(_replace_backslashes, text)
+    if '://' in text:
+        text = _URL.sub('', text)
+    return _WHITESPACE.sub(' ', text.replace('\n', ' ')).strip()
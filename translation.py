@@ -0,0 +1,125 @@
+# translation.py
+# Async Vietnamese -> English translation of chunk summaries.
+#
+# Concurrent save_chunk() callers are grouped by a RequestBatcher (embedding_batcher.py)
+# into one request per batch: the Anthropic backend asks for all texts at once and
+# reads them back through a forced tool call, so the output is a JSON list rather
+# than free text. Results are cached in llm_cache.
+#
+# TRANSLATION_PROVIDER=anthropic (default) or local (NLLB from translation_utils.py,
+# batched generate on CPU in a worker thread).
+
+import os
+import json
+import asyncio
+
+from embedding_batcher import RequestBatcher
+from rate_governor import governor, estimate_tokens
+from llm_cache import cache
+
+TRANSLATION_PROVIDER = os.getenv("TRANSLATION_PROVIDER", "anthropic")
+TRANSLATION_MODEL = os.getenv("TRANSLATION_MODEL", "claude-3-haiku-20240307")
+TRANSLATE_BATCH_MAX_ITEMS = int(os.getenv("TRANSLATE_BATCH_MAX_ITEMS", "20"))
+TRANSLATE_BATCH_MAX_TOKENS = int(os.getenv("TRANSLATE_BATCH_MAX_TOKENS", "3000"))
+TRANSLATE_BATCH_MAX_WAIT = float(os.getenv("TRANSLATE_BATCH_MAX_WAIT", "0.2"))  # seconds
+TRANSLATE_RETRIES = int(os.getenv("TRANSLATE_RETRIES", "3"))
+
+SYSTEM_PROMPT = ("You are a helpful assistant that translates Vietnamese to English. "
+                 "Translate every input text and record the results with the tool, in input order.")
+TRANSLATION_TOOL = {
+    "name": "record_translations",
+    "description": "Record the English translation of each input text, one entry per input, in order.",
+    "input_schema": {
+        "type": "object",
+        "properties": {"translations": {"type": "array", "items": {"type": "string"}}},
+        "required": ["translations"],
+    },
+}
+
+
+class AnthropicTranslator:
+    name = "anthropic"
+
+    def __init__(self, model: str = TRANSLATION_MODEL, client=None):
+        self.model = model
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from anthropic import AsyncAnthropic
+            self._client = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        return self._client
+
+    async def _request(self, texts: list) -> list:
+        user_prompt = json.dumps([{"id": i, "text": t} for i, t in enumerate(texts)], ensure_ascii=False)
+        response = await governor.call("anthropic", self.model, lambda: self.client.messages.create(
+            model=self.model,
+            max_tokens=4096,
+            temperature=0.2,
+            system=SYSTEM_PROMPT,
+            tools=[TRANSLATION_TOOL],
+            tool_choice={"type": "tool", "name": TRANSLATION_TOOL["name"]},
+            messages=[{"role": "user", "content": user_prompt}],
+        ), est_tokens=3 * estimate_tokens(user_prompt) + 200)
+        tool_use = next(block for block in response.content if block.type == "tool_use")
+        translations = tool_use.input["translations"]
+        if len(translations) != len(texts):
+            raise ValueError(f"got {len(translations)} translations for {len(texts)} texts")
+        return [t.strip() for t in translations]
+
+    async def translate_many(self, texts: list) -> list:
+        # 429s are retried inside the governor; this covers timeouts, 5xx and malformed output
+        for attempt in range(TRANSLATE_RETRIES):
+            try:
+                return await self._request(texts)
+            except Exception as e:
+                if attempt == TRANSLATE_RETRIES - 1:
+                    raise
+                print(f"⚠️ Translation batch of {len(texts)} failed ({e}), retrying")
+                await asyncio.sleep(2 ** attempt)
+
+
+class LocalTranslator:
+    name = "local-nllb"
+
+    def __init__(self):
+        self.model = "facebook/nllb-200-distilled-600M"
+
+    async def translate_many(self, texts: list) -> list:
+        import translation_utils
+        return await asyncio.to_thread(translation_utils.translate_many, texts)
+
+
+def get_translator(name: str = TRANSLATION_PROVIDER):
+    if name == "anthropic":
+        return AnthropicTranslator()
+    if name == "local":
+        return LocalTranslator()
+    raise ValueError(f"Unknown TRANSLATION_PROVIDER: {name} (expected 'anthropic' or 'local')")
+
+
+translator = get_translator()
+translation_batcher = RequestBatcher(translator.translate_many, max_items=TRANSLATE_BATCH_MAX_ITEMS,
+                                     max_tokens=TRANSLATE_BATCH_MAX_TOKENS, max_wait=TRANSLATE_BATCH_MAX_WAIT)
+
+
+async def translate_vi_en(text: str) -> str:
+    # Falls back to the untranslated text (summaries are requested in English anyway)
+    if not text.strip():
+        return text
+    cache_prompt = "translate vi-en\n" + text
+    cached = await cache.aget_json(translator.model, cache_prompt)
+    if cached is not None:
+        return cached
+    try:
+        translated = await translation_batcher.submit(text)
+    except Exception as e:
+        print(f"❌ Translation error: {e}")
+        return text
+    await cache.aput_json(translator.model, cache_prompt, translated)
+    return translated
+
+
+async def translate_summary(summary: str, lang: str) -> str:
+    return await translate_vi_en(summary) if lang == "vi" else summary
@@ -1,16 +1,41 @@
 # translation_utils.py
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+# NLLB Vietnamese -> English. The 600M model is downloaded and loaded on the
+# first translation, not at import.
 
 model_name = "facebook/nllb-200-distilled-600M"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+_tokenizer = None
+_model = None
+
+NLLB_BATCH_SIZE = 16
+NLLB_MAX_LENGTH = 512
+
+
+def get_model():
+    # -> (tokenizer, model)
+    global _tokenizer, _model
+    if _model is None:
+        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+        _tokenizer = AutoTokenizer.from_pretrained(model_name)
+        _tokenizer.src_lang = "vie_Latn"
+        _model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+    return _tokenizer, _model
+
+
+def translate_many(texts: list) -> list:
+    # Batched CPU generate: one padded forward pass per NLLB_BATCH_SIZE texts
+    import torch
+
+    tokenizer, model = get_model()
+    target = tokenizer.convert_tokens_to_ids("eng_Latn")
+    results = []
+    for start in range(0, len(texts), NLLB_BATCH_SIZE):
+        batch = texts[start:start + NLLB_BATCH_SIZE]
+        inputs = tokenizer(batch, return_tensors="pt", padding=True, truncation=True, max_length=NLLB_MAX_LENGTH)
+        with torch.inference_mode():
+            generated_tokens = model.generate(**inputs, forced_bos_token_id=target, max_length=NLLB_MAX_LENGTH)
+        results.extend(tokenizer.batch_decode(generated_tokens, skip_special_tokens=True))
+    return results
 
-tokenizer.src_lang = "vie_Latn"
 
 def translate_vi_en(text: str) -> str:
-    inputs = tokenizer(text, return_tensors="pt", padding=True)
-    generated_tokens = model.generate(
-        **inputs,
-        forced_bos_token_id=tokenizer.convert_tokens_to_ids(">>eng_Latn<<")
-    )
-    return tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)[0]
+    return translate_many([text])[0]
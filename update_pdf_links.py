@@ -1,6 +1,8 @@
 import os
 import json
 
+from chunk_shards import chunk_json_files, list_shards, writer_running
+
 # 📁 Directory containing all your JSON chunks
 json_dir = "/final_data/qdrant_chunks"
 
@@ -51,32 +53,66 @@ url_map = {
 
 updated_count = 0
 skipped_count = 0
+unsealed = []
+
 
-for filename in os.listdir(json_dir):
-    if filename.endswith(".json"):
-        path = os.path.join(json_dir, filename)
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+def relink(payload: dict, name: str) -> bool:
+    # pdf://<slug> -> the mapped link; -> whether the payload changed
+    global updated_count, skipped_count
+    url = payload.get("url", "")
+    if payload.get("source", "") != "pdf_import" or not url.startswith("pdf://"):
+        return False
+    slug = url.replace("pdf://", "").strip()
+    if slug not in url_map:
+        print(f"⏭ Skipped (no mapping): {name}")
+        skipped_count += 1
+        return False
+    payload["url"] = url_map[slug]
+    print(f"✅ Updated: {name}")
+    updated_count += 1
+    return True
 
-        payload = data.get("payload", {})
-        source = payload.get("source", "")
-        url = payload.get("url", "")
 
-        if source == "pdf_import" and url.startswith("pdf://"):
-            slug = url.replace("pdf://", "").strip()
-            if slug in url_map:
-                payload["url"] = url_map[slug]
-                data["payload"] = payload
+# Per-chunk JSON files (CHUNK_FORMAT=json)
+for path in chunk_json_files(json_dir):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
 
-                with open(path, "w", encoding="utf-8") as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
+    payload = data.get("payload", {})
+    if relink(payload, os.path.basename(path)):
+        data["payload"] = payload
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
 
-                print(f"✅ Updated: {filename}")
-                updated_count += 1
-            else:
-                print(f"⏭ Skipped (no mapping): {filename}")
-                skipped_count += 1
+# Shards (CHUNK_FORMAT=shard): payloads are the .jsonl lines, in the same row order as the vectors
+for manifest_path in list_shards(json_dir):
+    with open(manifest_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["rows"] is None:
+        unsealed.append(manifest_path)
+        state = "still being written" if writer_running(manifest_path) else "unsealed, its writer is gone"
+        print(f"⚠️ Shard {state}, skipped: {manifest_path}")
+        continue
+    path = os.path.join(json_dir, meta["payloads"])
+    with open(path, encoding="utf-8") as f:
+        lines = f.readlines()
+    changed = False
+    for row, line in enumerate(lines[:meta["rows"]]):
+        data = json.loads(line)
+        if relink(data["payload"], f"{meta['payloads']}#{row}"):
+            lines[row] = json.dumps(data, ensure_ascii=False) + "\n"
+            changed = True
+    if changed:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(tmp, path)
 
 print(f"\n🎯 Completed.")
-print(f"✅ Updated files: {updated_count}")
+print(f"✅ Updated chunks: {updated_count}")
 print(f"⏭ Skipped (no match): {skipped_count}")
+if unsealed:
+    print(f"⚠️ Unsealed shards not updated: {len(unsealed)}. Once their ingest run has stopped, seal them "
+          f"with `python chunk_shards.py seal {json_dir}` and run this again.")
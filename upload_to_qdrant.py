@@ -1,10 +1,20 @@
 import os
 import json
-import glob
 import time
+import random
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as futures_wait
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct, VectorParams, Distance
+from qdrant_client.models import PointStruct
+
+from doc_manifest import manifest
+from chunk_shards import chunk_json_files, list_shards, open_shard, MANIFEST_SUFFIX
+from qdrant_profiles import create_collection
+from qdrant_bulk import collection_or_alias_exists, require_alias, start_shadow, shadow_of, finish_shadow
+from embedding_providers import get_embedding_provider
 
 # ------------------ CONFIG ------------------
 
@@ -12,83 +22,329 @@ load_dotenv()
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME")
-VECTOR_SIZE = 1536
+# Size and distance follow the embedding provider the chunks were produced with
+embedding_provider = get_embedding_provider()
 CHUNK_DIR = "final_data/qdrant_chunks"
-BATCH_SIZE = 25
+
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"
+UPLOAD_READ_WORKERS = int(os.getenv("UPLOAD_READ_WORKERS", "4"))
+UPLOAD_IN_FLIGHT = int(os.getenv("UPLOAD_IN_FLIGHT", "4"))  # concurrent upsert requests
+UPLOAD_BATCH_BYTES = int(float(os.getenv("UPLOAD_BATCH_MB", "4")) * 1024 * 1024)
+UPLOAD_MAX_BATCH_POINTS = int(os.getenv("UPLOAD_MAX_BATCH_POINTS", "512"))
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", "6"))
+UPLOAD_MAX_BACKOFF = 30  # seconds
+# 0: don't wait for Qdrant to apply each upsert (checked once at the end instead)
+UPLOAD_WAIT = os.getenv("UPLOAD_WAIT", "1") == "1"
+UPLOAD_JOURNAL = os.getenv("UPLOAD_JOURNAL", "final_data/upload_journal.jsonl")
 
 # ------------------ INIT CLIENT ------------------
 
-client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+# Connecting and creating the collection happen on first use, not at import
+_client = None
+_journal_lock = threading.Lock()
 
-if COLLECTION_NAME not in [c.name for c in client.get_collections().collections]:
-    client.create_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=VectorParams(size=VECTOR_SIZE, distance=Distance.COSINE),
-    )
 
-# ------------------ LOAD CHUNKS ------------------
+def get_client() -> QdrantClient:
+    global _client
+    if _client is None:
+        _client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, prefer_grpc=QDRANT_PREFER_GRPC)
+    return _client
 
-chunk_files = glob.glob(os.path.join(CHUNK_DIR, "*.json"))
-print(f"🔍 Found {len(chunk_files)} chunk files to upload.")
 
-# ------------------ UPLOAD ------------------
+def ensure_collection(client: QdrantClient):
+    # Storage, quantization and payload indexes come from QDRANT_PROFILE (qdrant_profiles.py).
+    # After a bulk load COLLECTION_NAME is an alias (qdrant_bulk.py).
+    if not collection_or_alias_exists(client, COLLECTION_NAME):
+        create_collection(client, COLLECTION_NAME, embedding_provider.dimension, embedding_provider.distance)
+
+# ------------------ READ ------------------
+
+# Sources are per-chunk JSON files and shard manifests. Every point keeps a ref to
+# where it came from ("<file>.json" or "<shard manifest>#<row>") for the journal.
+
+def _payload_bytes(vector, payload) -> int:
+    # Request size as sent: ~12 bytes per float as JSON text, 4 over gRPC
+    return len(vector) * (4 if QDRANT_PREFER_GRPC else 12) + len(json.dumps(payload, ensure_ascii=False))
 
-def upload_in_batches(files, batch_size=BATCH_SIZE):
-    failed = []
-
-    for i in range(0, len(files), batch_size):
-        batch_files = files[i:i + batch_size]
-        points = []
-
-        for file_path in batch_files:
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    obj = json.load(f)
-                    points.append(PointStruct(
-                        id=obj["id"],
-                        vector=obj["vector"],
-                        payload=obj["payload"]
-                    ))
-            except Exception as e:
-                print(f"❌ JSON read failed: {file_path} | {e}")
-                failed.append(file_path)
-
-        if not points:
+
+def _read_chunk_file(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        obj = json.load(f)
+    point = PointStruct(id=obj["id"], vector=obj["vector"], payload=obj["payload"])
+    return [(path, point, _payload_bytes(obj["vector"], obj["payload"]))]
+
+
+def _row_runs(rows, max_rows: int):
+    # Sorted row numbers -> (start, stop) ranges of consecutive rows, at most max_rows long
+    start = prev = None
+    for row in rows:
+        if start is not None and row == prev + 1 and row - start < max_rows:
+            prev = row
             continue
+        if start is not None:
+            yield start, prev + 1
+        start = prev = row
+    if start is not None:
+        yield start, prev + 1
+
+
+def _read_shard(manifest_path: str, rows=None, retired: set = frozenset()):
+    # PointStruct only takes plain lists, so the vectors are converted, but one contiguous
+    # memmap slice (a batch worth of rows) per tolist() call rather than row by row
+    ids, vectors, payloads = open_shard(manifest_path)
+    rows = range(len(ids)) if rows is None else [r for r in rows if r < len(ids)]
+    out = []
+    for start, stop in _row_runs((r for r in rows if ids[r] not in retired), UPLOAD_MAX_BATCH_POINTS):
+        for i, vector in zip(range(start, stop), vectors[start:stop].tolist()):
+            out.append((f"{manifest_path}#{i}", PointStruct(id=ids[i], vector=vector, payload=payloads[i]),
+                        _payload_bytes(vector, payloads[i])))
+    return out
 
-        uploaded = False
+
+def _read_source(source, retired: set):
+    # source: a JSON file path, a shard manifest path, or (manifest path, [rows]) from the journal
+    try:
+        if isinstance(source, tuple):
+            return _read_shard(source[0], source[1], retired), None
+        if source.endswith(MANIFEST_SUFFIX):
+            return _read_shard(source, None, retired), None
+        return _read_chunk_file(source), None
+    except Exception as e:
+        return [], e
+
+
+def iter_points(sources: list, retired: set, workers: int = UPLOAD_READ_WORKERS):
+    # Reading and decoding run in a thread pool, a bounded window ahead of the uploads.
+    # Yields (ref, point, est_bytes); unreadable sources go to the journal.
+    with ThreadPoolExecutor(workers) as pool:
+        window = deque()
+        for source in sources:
+            window.append((source, pool.submit(_read_source, source, retired)))
+            if len(window) < workers * 4:
+                continue
+            yield from _drain_one(window)
+        while window:
+            yield from _drain_one(window)
+
+
+def _drain_one(window: deque):
+    source, future = window.popleft()
+    points, error = future.result()
+    if error is not None:
+        ref = f"{source[0]}#{','.join(map(str, source[1]))}" if isinstance(source, tuple) else source
+        print(f"❌ Read failed: {ref} | {error}")
+        journal_failure([ref], f"read: {error}")
+    yield from points
+
+# ------------------ UPLOAD ------------------
+
+def journal_failure(refs: list, error: str):
+    # Appends one replayable line: `python upload_to_qdrant.py --replay` retries these refs
+    os.makedirs(os.path.dirname(UPLOAD_JOURNAL) or ".", exist_ok=True)
+    with _journal_lock, open(UPLOAD_JOURNAL, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"time": time.time(), "error": error, "refs": refs}, ensure_ascii=False) + "\n")
+
+
+def upsert_with_backoff(client, points: list, label: str, wait: bool = True, collection: str = None) -> bool:
+    for attempt in range(UPLOAD_RETRIES):
         try:
-            client.upsert(collection_name=COLLECTION_NAME, points=points)
-            uploaded = True
+            client.upsert(collection_name=collection or COLLECTION_NAME, points=points, wait=wait)
+            if attempt:
+                print(f"🔁 Retry succeeded ({label})")
+            return True
         except Exception as e:
-            print(f"⚠️ Upload failed (batch {i // batch_size + 1}), retrying in 2s: {e}")
-            time.sleep(2)
-            try:
-                client.upsert(collection_name=COLLECTION_NAME, points=points)
-                uploaded = True
-                print(f"🔁 Retry succeeded (batch {i // batch_size + 1})")
-            except Exception as e2:
-                print(f"❌ Retry failed (batch {i // batch_size + 1}): {e2}")
-                failed.extend(batch_files)
+            if attempt == UPLOAD_RETRIES - 1:
+                print(f"❌ Upload failed after {UPLOAD_RETRIES} attempts ({label}): {e}")
+                return False
+            delay = min(UPLOAD_MAX_BACKOFF, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"⚠️ Upload failed ({label}), retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
 
-        if uploaded:
-            print(f"✅ Uploaded batch {i // batch_size + 1} ({len(points)} chunks)")
+def iter_batches(points, max_bytes: int = UPLOAD_BATCH_BYTES, max_points: int = UPLOAD_MAX_BATCH_POINTS):
+    # Batches are cut by estimated request size, so long pages and short chunks both
+    # make requests of roughly the same weight
+    batch, size = [], 0
+    for ref, point, nbytes in points:
+        if batch and (size + nbytes > max_bytes or len(batch) >= max_points):
+            yield batch
+            batch, size = [], 0
+        batch.append((ref, point))
+        size += nbytes
+    if batch:
+        yield batch
 
-    return failed
+
+def upload_points(points, in_flight: int = UPLOAD_IN_FLIGHT, wait: bool = UPLOAD_WAIT, collection: str = None) -> dict:
+    # Keeps up to `in_flight` upserts running while the next batches are read.
+    # With wait=False Qdrant acknowledges before applying, so the IDs are checked at the end.
+    # stats["ids"]: distinct point IDs written (what a bulk load's count is checked against)
+    client = get_client()
+    collection = collection or COLLECTION_NAME
+    stats = {"uploaded": 0, "failed": 0, "batches": 0, "ids": set()}
+    sent_ids = []
+
+    def send(number, batch):
+        ok = upsert_with_backoff(client, [point for _, point in batch], f"batch {number}", wait, collection)
+        if not ok:
+            journal_failure([ref for ref, _ in batch], "upsert")
+        return ok, batch
+
+    def collect(future):
+        ok, batch = future.result()
+        stats["uploaded" if ok else "failed"] += len(batch)
+        if ok:
+            print(f"✅ Uploaded batch ({len(batch)} chunks, {stats['uploaded']} total)")
+            stats["ids"].update(point.id for _, point in batch)
+            if not wait:
+                sent_ids.extend((point.id, ref) for ref, point in batch)
+
+    with ThreadPoolExecutor(in_flight) as pool:
+        running = set()
+        for batch in iter_batches(points):
+            stats["batches"] += 1
+            running.add(pool.submit(send, stats["batches"], batch))
+            if len(running) >= in_flight:
+                done, running = futures_wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+        for future in running:
+            collect(future)
+
+    if sent_ids:
+        missing = verify_points(client, sent_ids, collection)
+        lost = set(missing)
+        stats["ids"].difference_update(point_id for point_id, ref in sent_ids if ref in lost)
+        stats["uploaded"] -= len(missing)
+        stats["failed"] += len(missing)
+    return stats
+
+
+def verify_points(client, sent: list, collection: str, attempts: int = 10) -> list:
+    # -> refs still missing after the unacknowledged (wait=False) upserts had time to apply
+    pending = dict(sent)
+    for attempt in range(attempts):
+        ids = list(pending)
+        for start in range(0, len(ids), 1000):
+            found = client.retrieve(collection_name=collection, ids=ids[start:start + 1000],
+                                    with_payload=False, with_vectors=False)
+            for point in found:
+                pending.pop(point.id, None)
+        if not pending:
+            print(f"🔎 Consistency check passed: all {len(sent)} points present")
+            return []
+        time.sleep(min(UPLOAD_MAX_BACKOFF, 0.5 * 2 ** attempt))
+    missing = list(pending.values())
+    print(f"❌ Consistency check: {len(missing)} points missing, written to {UPLOAD_JOURNAL}")
+    journal_failure(missing, "missing after upsert")
+    return missing
+
+# ------------------ REPLAY ------------------
+
+def journal_sources(journal: str = UPLOAD_JOURNAL) -> list:
+    # Journal refs -> sources for iter_points; shard rows are grouped per shard
+    files, shard_rows = [], {}
+    with open(journal, encoding="utf-8") as f:
+        for line in f:
+            for ref in json.loads(line)["refs"]:
+                path, _, rows = ref.partition("#")
+                if rows:
+                    shard_rows.setdefault(path, set()).update(int(r) for r in rows.split(","))
+                else:
+                    files.append(path)
+    return sorted(set(files)) + [(path, sorted(rows)) for path, rows in sorted(shard_rows.items())]
+
+
+def replay_journal(journal: str = UPLOAD_JOURNAL) -> dict:
+    # Retries everything in the journal; what fails again goes into a fresh one
+    replaying = journal + ".replaying"  # left behind if an earlier replay was interrupted
+    if os.path.exists(journal):
+        with open(journal, encoding="utf-8") as src, open(replaying, "a", encoding="utf-8") as dst:
+            dst.write(src.read())
+        os.remove(journal)
+    if not os.path.exists(replaying):
+        print(f"⚠️ No journal at {journal}")
+        return {"uploaded": 0, "failed": 0, "batches": 0}
+    sources = journal_sources(replaying)
+    print(f"🔁 Replaying {len(sources)} sources from {journal}")
+    stats = upload_points(iter_points(sources, manifest.retired_point_ids()))
+    os.remove(replaying)
+    return stats
+
+# ------------------ REMOVE REPLACED POINTS ------------------
+
+def delete_stale_points():
+    # Points from older versions of re-ingested documents (see doc_manifest.py).
+    # Deleted after the upload so a changed document never disappears from search.
+    stale_ids = manifest.stale_point_ids()
+    if stale_ids:
+        try:
+            get_client().delete(collection_name=COLLECTION_NAME, points_selector=stale_ids)
+            manifest.clear_stale(stale_ids)
+            print(f"🧹 Deleted {len(stale_ids)} points replaced by re-ingested documents.")
+        except Exception as e:
+            print(f"❌ Failed to delete replaced points, will retry next run: {e}")
 
 # ------------------ MAIN ------------------
 
-if chunk_files:
-    failed_files = upload_in_batches(chunk_files)
-    print(f"\n🎉 All chunks processed. ✅ Success: {len(chunk_files) - len(failed_files)} | ❌ Failed: {len(failed_files)}")
+def bulk_target(client, retired: set, fresh: bool):
+    # -> (shadow collection, IDs already in it). The shadow starts as a copy of the live
+    # collection, which also holds the points app_aws_upload_qdrant.py loaded from S3;
+    # fresh: start empty and publish only what CHUNK_DIR holds.
+    if fresh or not collection_or_alias_exists(client, COLLECTION_NAME):
+        require_alias(client, COLLECTION_NAME)
+        return start_shadow(client, COLLECTION_NAME, embedding_provider.dimension, embedding_provider.distance), set()
+    live_size = client.get_collection(COLLECTION_NAME).config.params.vectors.size
+    if live_size != embedding_provider.dimension:
+        raise RuntimeError(f"{COLLECTION_NAME} holds {live_size}-d vectors, the embedding provider makes "
+                           f"{embedding_provider.dimension}-d ones; rebuild it with --bulk --fresh")
+    return shadow_of(client, COLLECTION_NAME, skip=retired | set(manifest.stale_point_ids()))
+
+
+def main(bulk: bool = False, fresh: bool = False):
+    # bulk: reindex into a shadow collection, published by moving the alias
+    client = get_client()
+    if not bulk:
+        ensure_collection(client)
+
+    chunk_files = chunk_json_files(CHUNK_DIR)
+    shards = list_shards(CHUNK_DIR)
+    print(f"🔍 Found {len(chunk_files)} chunk files and {len(shards)} shards to upload.")
+    if not chunk_files and not shards:
+        print("⚠️ No chunks found to upload.")
+        return
+
+    retired = manifest.retired_point_ids()
+    target, seeded = bulk_target(client, retired, fresh) if bulk else (COLLECTION_NAME, set())
+    start = time.time()
+    stats = upload_points(iter_points(chunk_files + shards, retired), collection=target)
+    print(f"\n🎉 All chunks processed in {time.time() - start:.1f}s. "
+          f"✅ Success: {stats['uploaded']} | ❌ Failed: {stats['failed']}")
+    if stats["failed"]:
+        print(f"📄 Failed chunks journaled to {UPLOAD_JOURNAL}; run with --replay to retry them")
+        if bulk:
+            print(f"❌ Bulk load incomplete; {COLLECTION_NAME} left as it was, shadow {target} kept")
+            return
+    if bulk:
+        finish_shadow(client, COLLECTION_NAME, target, expected=len(seeded | stats["ids"]), allow_shrink=fresh)
+
+    delete_stale_points()
+
 
-    if failed_files:
-        with open("failed_chunks.txt", "w") as f:
-            for path in failed_files:
-                f.write(path + "\n")
-        print("📄 Failed chunk paths saved to failed_chunks.txt")
-else:
-    print("⚠️ No chunks found to upload.")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload chunk files and shards to Qdrant")
+    parser.add_argument("--replay", action="store_true", help=f"retry the failures recorded in {UPLOAD_JOURNAL}")
+    parser.add_argument("--bulk", action="store_true",
+                        help="reindex everything into a shadow collection and swap the alias when it is ready")
+    parser.add_argument("--fresh", action="store_true",
+                        help="with --bulk: don't carry over the live collection, drop points not in the chunk files")
+    args = parser.parse_args()
+    if args.replay:
+        ensure_collection(get_client())
+        stats = replay_journal()
+        print(f"✅ Replayed: {stats['uploaded']} uploaded, {stats['failed']} still failing")
+    else:
+        main(bulk=args.bulk, fresh=args.fresh)
 
 
 # import os
@@ -96,7 +352,7 @@ else:
 # import glob
 # from dotenv import load_dotenv
 # from qdrant_client import QdrantClient
-# from qdrant_client.models import PointStruct, VectorParams, Distance
+# from qdrant_client.models import PointStruct
 #
 # load_dotenv()
 #